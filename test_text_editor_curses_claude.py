@@ -0,0 +1,491 @@
+#!/usr/bin/env python3
+"""
+Tests for the text buffers and editing commands of the console text editor.
+
+The editor is driven without a terminal: keys go straight to its editing
+methods, so no curses screen is needed.
+"""
+
+import curses
+import os
+import random
+import subprocess
+import sys
+import threading
+
+import pytest
+
+import text_editor_curses_claude
+from text_editor_curses_claude import (
+    LineListBuffer, MappedFileBuffer, PieceTableBuffer, TextEditor, normalize_newlines,
+)
+
+
+def assert_same_document(buffer, expected):
+    """Check every read method of a buffer against a reference buffer."""
+    assert buffer.get_text() == expected.get_text()
+    assert buffer.line_count() == expected.line_count()
+    assert list(buffer.lines()) == list(expected.lines())
+    for row in range(expected.line_count()):
+        assert buffer.get_line(row) == expected.get_line(row)
+        assert buffer.line_length(row) == expected.line_length(row)
+
+
+def type_text(editor, text):
+    """Send each character of text to the editor as a key press."""
+    for char in text:
+        editor.insert_char(ord(char))
+
+
+def test_piece_table_matches_line_list_under_random_edits():
+    """Test that random inserts and deletes give the same document in both backends."""
+    rng = random.Random(7)
+    initial = "first line\nsecond\n\nlast"
+    pieces, lines = PieceTableBuffer(initial), LineListBuffer(initial)
+    for _ in range(2000):
+        row = rng.randrange(lines.line_count())
+        col = rng.randint(0, lines.line_length(row))
+        if rng.random() < 0.6:
+            text = rng.choice(["x", "yz", "\n", "a\nb", "long run of text\n\n"])
+            pieces.insert(row, col, text)
+            lines.insert(row, col, text)
+        else:
+            count = rng.randint(1, 12)
+            assert pieces.delete(row, col, count) == lines.delete(row, col, count)
+        assert pieces.get_text() == lines.get_text()
+    assert_same_document(pieces, lines)
+    assert list(pieces.lines(3)) == list(lines.lines(3))
+
+
+def test_piece_table_snapshot_is_unaffected_by_later_edits():
+    """Test that a snapshot keeps the document as it was."""
+    buffer = PieceTableBuffer("hello\nworld")
+    snapshot = buffer.snapshot()
+    buffer.insert(0, 5, ", there")
+    buffer.delete(1, 0, 3)
+
+    assert buffer.get_text() == "hello, there\nld"
+    assert snapshot.get_text() == "hello\nworld"
+    snapshot.insert(1, 5, "!")
+    assert snapshot.get_text() == "hello\nworld!"
+    assert buffer.get_text() == "hello, there\nld"
+
+
+def test_typing_coalesces_into_one_piece():
+    """Test that consecutive keystrokes extend a piece instead of adding nodes."""
+    buffer = PieceTableBuffer("abc")
+    for col, char in enumerate("hello", start=1):
+        buffer.insert(0, col, char)
+
+    assert buffer.get_text() == "ahellobc"
+    root = buffer._root
+    assert root.size == 8
+    count = 0
+    stack = [root]
+    while stack:
+        node = stack.pop()
+        if node is not None:
+            count += 1
+            stack.extend((node.left, node.right))
+    assert count == 3
+
+
+def test_delete_past_the_end_stops_at_document_end():
+    """Test that deleting more than remains removes only what exists."""
+    for buffer in (PieceTableBuffer("ab\ncd"), LineListBuffer("ab\ncd")):
+        assert buffer.delete(0, 1, 100) == "b\ncd"
+        assert buffer.get_text() == "a"
+        assert buffer.line_count() == 1
+
+
+@pytest.mark.parametrize("buffer_factory", [PieceTableBuffer, LineListBuffer])
+def test_editing_keys(buffer_factory):
+    """Test typing, Enter, Backspace and Delete through the editor."""
+    editor = TextEditor(buffer_factory)
+    type_text(editor, "helo")
+    editor.cursor_col = 3
+    type_text(editor, "l")
+    editor.cursor_col = 5
+    type_text(editor, "\nworld")
+    assert editor.buffer.get_text() == "hello\nworld"
+    assert (editor.cursor_row, editor.cursor_col) == (1, 5)
+
+    editor.cursor_col = 0
+    editor.insert_char(curses.KEY_BACKSPACE)
+    assert editor.buffer.get_text() == "helloworld"
+    assert (editor.cursor_row, editor.cursor_col) == (0, 5)
+
+    editor.insert_char(curses.KEY_DC)
+    editor.cursor_col = 9
+    editor.insert_char(curses.KEY_DC)
+    assert editor.buffer.get_text() == "helloorld"
+
+    editor.undo()
+    assert editor.buffer.get_text() == "helloworld"
+    editor.redo()
+    assert editor.buffer.get_text() == "helloorld"
+
+
+@pytest.mark.parametrize("buffer_factory", [PieceTableBuffer, LineListBuffer])
+def test_cut_and_paste_lines(buffer_factory):
+    """Test that cut removes a whole line and paste inserts it below the cursor."""
+    editor = TextEditor(buffer_factory)
+    editor.buffer = buffer_factory("one\ntwo\nthree")
+    editor.cursor_row = 2
+    editor.cut_line()
+    assert editor.buffer.get_text() == "one\ntwo"
+    assert editor.cursor_row == 1
+
+    editor.cursor_row = 0
+    editor.paste_line()
+    assert editor.buffer.get_text() == "one\nthree\ntwo"
+    editor.copy_line()
+    assert editor.clipboard == "three"
+
+
+def test_load_normalizes_line_endings(tmp_path):
+    """Test that CRLF and CR endings load as lines and save back with LF."""
+    path = tmp_path / "mixed.txt"
+    path.write_bytes(b"one\r\ntwo\rthree\n")
+    editor = TextEditor()
+
+    assert editor.load_file(str(path))
+    assert list(editor.buffer.lines()) == ["one", "two", "three"]
+    assert editor.save_file(str(path))
+    assert path.read_bytes() == b"one\ntwo\nthree"
+    assert normalize_newlines("a\n\n") == "a\n"
+
+
+def test_find_text_searches_forward_and_wraps(monkeypatch):
+    """Test that find moves to the next match and wraps to the top."""
+    editor = TextEditor()
+    editor.buffer = PieceTableBuffer("needle\nhay\nneedle here")
+    monkeypatch.setattr(editor, "prompt", lambda message: "needle")
+
+    editor.find_text()
+    assert (editor.cursor_row, editor.cursor_col) == (2, 0)
+    editor.find_text()
+    assert (editor.cursor_row, editor.cursor_col) == (0, 0)
+
+
+def test_typing_is_undone_a_word_at_a_time():
+    """Test that consecutive keystrokes coalesce into one undo step per word."""
+    editor = TextEditor()
+    type_text(editor, "hello world")
+    assert len(editor.undo_stack) == 2
+
+    editor.undo()
+    assert editor.buffer.get_text() == "hello"
+    assert (editor.cursor_row, editor.cursor_col) == (0, 5)
+    editor.undo()
+    assert editor.buffer.get_text() == ""
+    editor.redo()
+    editor.redo()
+    assert editor.buffer.get_text() == "hello world"
+    assert (editor.cursor_row, editor.cursor_col) == (0, 11)
+
+
+def test_backspace_run_is_one_undo_step_and_moving_breaks_runs():
+    """Test Backspace coalescing and that cursor movement starts a new step."""
+    editor = TextEditor()
+    editor.buffer = PieceTableBuffer("abcdef")
+    editor.cursor_col = 6
+    for _ in range(3):
+        editor.insert_char(curses.KEY_BACKSPACE)
+    editor.move_cursor(curses.KEY_HOME)
+    type_text(editor, "x")
+    assert editor.buffer.get_text() == "xabc"
+    assert len(editor.undo_stack) == 2
+
+    editor.undo()
+    editor.undo()
+    assert editor.buffer.get_text() == "abcdef"
+    assert (editor.cursor_row, editor.cursor_col) == (0, 6)
+    type_text(editor, "!")
+    assert not editor.redo_stack
+
+
+def test_undo_history_is_bounded_by_characters():
+    """Test that the oldest edits are dropped once the budget is exceeded."""
+    editor = TextEditor()
+    editor.undo_budget = 200
+    for _ in range(20):
+        editor.clipboard = "x" * 40
+        editor.paste_line()
+
+    assert editor.undo_size <= editor.undo_budget
+    assert len(editor.undo_stack) == 2
+    while editor.undo_stack:
+        editor.undo()
+    assert editor.buffer.line_count() == 19
+
+    # The newest edit is kept even if it alone is over budget
+    editor.clipboard = "y" * 500
+    editor.paste_line()
+    assert len(editor.undo_stack) == 1
+
+
+@pytest.mark.parametrize("data", [b"", b"a\n", b"a\n\n", b"one\r\ntwo\r\n", b"x\ny\nlast"])
+def test_mapped_file_reads_like_a_loaded_file(tmp_path, data):
+    """Test that a mapped file has the same lines as the file read into memory."""
+    path = tmp_path / "big.txt"
+    path.write_bytes(data)
+    buffer = MappedFileBuffer(str(path))
+
+    assert_same_document(buffer, LineListBuffer(normalize_newlines(data.decode())))
+
+
+def test_mapped_file_edits_are_overlays(tmp_path):
+    """Test random edits on a mapped file against a line list, leaving the file alone."""
+    text = "\n".join(f"line {row} " + "x" * (row % 11) for row in range(3000))
+    path = tmp_path / "big.txt"
+    path.write_text(text)
+    rng = random.Random(11)
+    mapped, lines = MappedFileBuffer(str(path)), LineListBuffer(text)
+    snapshot = mapped.snapshot()
+    for _ in range(1000):
+        row = rng.randrange(lines.line_count())
+        col = rng.randint(0, lines.line_length(row))
+        if rng.random() < 0.6:
+            text_in = rng.choice(["x", "yz", "\n", "a\nb", "q\n\n"])
+            mapped.insert(row, col, text_in)
+            lines.insert(row, col, text_in)
+        else:
+            count = rng.randint(1, 30)
+            assert mapped.delete(row, col, count) == lines.delete(row, col, count)
+
+    assert_same_document(mapped, lines)
+    assert list(mapped.lines(500)) == list(lines.lines(500))
+    assert snapshot.get_text() == text
+    assert path.read_text() == text
+
+
+def test_large_files_open_mapped_and_save_in_place(tmp_path):
+    """Test that files over the threshold load mapped and save over themselves."""
+    path = tmp_path / "big.txt"
+    path.write_text("".join(f"row {row}\n" for row in range(5000)))
+    editor = TextEditor()
+    editor.large_file_threshold = 1024
+
+    assert editor.load_file(str(path))
+    assert isinstance(editor.buffer, MappedFileBuffer)
+    editor.cursor_row, editor.cursor_col = 4999, 8
+    type_text(editor, "!")
+    assert editor.save_file()
+    assert path.read_text() == "".join(f"row {row}\n" for row in range(4999)) + "row 4999!"
+    assert editor.buffer.get_line(4999) == "row 4999!"
+
+
+def test_saving_a_mapped_file_keeps_undecodable_bytes(tmp_path):
+    """Test that bytes that are not UTF-8 survive an edit and save, edited line or not."""
+    path = tmp_path / "big.txt"
+    path.write_bytes(b"".join(b"caf\xe9 %d\r\n" % row for row in range(5000)))
+    editor = TextEditor()
+    editor.large_file_threshold = 1024
+
+    assert editor.load_file(str(path))
+    assert editor.buffer.get_line(7) == "caf\udce9 7"
+    editor.cursor_row, editor.cursor_col = 2500, 0
+    type_text(editor, "!")
+    assert editor.save_file()
+    assert path.read_bytes() == b"\n".join(
+        (b"!" if row == 2500 else b"") + b"caf\xe9 %d" % row for row in range(5000))
+
+
+def test_replaced_mapped_file_is_unmapped_once_snapshots_are_released(tmp_path):
+    """Test that loading another file stops the old indexer and closes its mapping."""
+    path = tmp_path / "big.txt"
+    path.write_text("".join(f"row {row}\n" for row in range(5000)))
+    editor = TextEditor()
+    editor.large_file_threshold = 1024
+    assert editor.load_file(str(path))
+    index = editor.buffer._index
+    snapshot = editor.buffer.snapshot()
+
+    assert editor.load_file(str(tmp_path / "new.txt"))
+    assert not index.closed
+    assert snapshot.get_line(4999) == "row 4999"
+    snapshot.close()
+    assert index.closed and not index.thread.is_alive()
+    assert index.data.closed
+
+
+class RecordingScreen:
+    """Stands in for a curses window, recording the rows each frame repaints."""
+
+    def __init__(self):
+        self.repainted = []
+        self.scrolled = []
+        self.erased = 0
+
+    def erase(self):
+        self.erased += 1
+
+    def move(self, row, col):
+        self.row = row
+
+    def clrtoeol(self):
+        self.repainted.append(self.row)
+
+    def scroll(self, shift):
+        self.scrolled.append(shift)
+
+    def addstr(self, *args):
+        pass
+
+    def setscrreg(self, top, bottom):
+        pass
+
+    def scrollok(self, flag):
+        pass
+
+    def noutrefresh(self):
+        pass
+
+
+@pytest.fixture
+def screen_editor(monkeypatch):
+    """An editor drawing 10 text rows onto a RecordingScreen."""
+    monkeypatch.setattr(curses, "doupdate", lambda: None)
+    editor = TextEditor()
+    editor.buffer = PieceTableBuffer("\n".join(f"line {row}" for row in range(100)))
+    editor.screen = RecordingScreen()
+    editor.height, editor.width = 12, 40
+    editor.draw_screen()
+    return editor
+
+
+def frame(editor):
+    """Draw a frame and return the text rows it repainted."""
+    editor.screen.repainted.clear()
+    editor.scroll_screen()
+    editor.draw_screen()
+    return sorted(row for row in editor.screen.repainted if row < editor.height - 2)
+
+
+def test_draw_repaints_only_damaged_rows(screen_editor):
+    """Test that typing repaints its row, Enter the rows below and moving nothing."""
+    editor = screen_editor
+    assert editor.screen.erased == 1
+    editor.cursor_row = 3
+    type_text(editor, "x")
+    assert frame(editor) == [3]
+
+    editor.move_cursor(curses.KEY_DOWN)
+    assert frame(editor) == []
+
+    type_text(editor, "\n")
+    assert frame(editor) == list(range(4, 10))
+    editor.undo()
+    assert frame(editor) == list(range(4, 10))
+    assert editor.frame_count == 5
+    assert editor.screen.erased == 1
+
+
+def test_draw_scrolls_the_terminal_and_paints_exposed_rows(screen_editor):
+    """Test that scrolling by a line shifts the terminal and repaints one row."""
+    editor = screen_editor
+    editor.cursor_row = 10
+    assert frame(editor) == [9]
+    assert editor.screen.scrolled == [1]
+
+    editor.cursor_row = 7
+    assert frame(editor) == []
+    editor.cursor_row = 0
+    assert frame(editor) == [0]
+    assert editor.screen.scrolled == [1, -1]
+
+    editor.cursor_row = 50
+    frame(editor)
+    assert editor.screen.erased == 2
+
+
+def test_background_save_writes_the_snapshot_taken_when_it_started(tmp_path, monkeypatch):
+    """Test that typing during a save neither reaches the file nor counts as saved."""
+    monkeypatch.setattr(text_editor_curses_claude, "SAVE_CHUNK_SIZE", 16)
+    path = tmp_path / "notes.txt"
+    path.write_text("old")
+    os.chmod(path, 0o600)
+    text = "\n".join(f"line {row}" for row in range(500))
+    editor = TextEditor()
+    editor.buffer = PieceTableBuffer(text)
+
+    assert editor.save_file(str(path), wait=False)
+    type_text(editor, "typed while saving")
+    assert editor.finish_save(wait=True)
+    assert path.read_text() == text
+    assert os.stat(path).st_mode & 0o777 == 0o600
+    assert editor.modified
+    assert editor.status_message == f"Saved: {path}"
+
+    assert editor.save_file()
+    assert not editor.modified
+    assert path.read_text() == "typed while saving" + text
+    assert os.listdir(tmp_path) == ["notes.txt"]
+
+
+def test_save_during_a_save_is_queued_instead_of_waiting(tmp_path, monkeypatch):
+    """Test that saving while a background save runs returns at once and saves after it."""
+    release = threading.Event()
+    write = text_editor_curses_claude.SaveJob._write
+
+    def blocked_write(job):
+        release.wait()
+        write(job)
+
+    monkeypatch.setattr(text_editor_curses_claude.SaveJob, "_write", blocked_write)
+    path = tmp_path / "notes.txt"
+    editor = TextEditor()
+    type_text(editor, "first")
+    assert editor.save_file(str(path), wait=False)
+    type_text(editor, " second")
+    assert editor.save_file(wait=False)
+    assert editor.save_queued
+    assert editor.status_message.startswith("Save in progress")
+
+    release.set()
+    editor.save_job.wait()
+    assert editor.finish_save()
+    assert path.read_text() == "first"
+    assert editor.save_job is not None and not editor.save_queued
+    assert editor.finish_save(wait=True)
+    assert path.read_text() == "first second"
+    assert not editor.modified
+
+
+def test_save_writes_through_a_symlink(tmp_path):
+    """Test that saving a symlinked file replaces the file it points at, not the link."""
+    target = tmp_path / "real.txt"
+    target.write_text("old")
+    link = tmp_path / "link.txt"
+    link.symlink_to(target)
+    editor = TextEditor()
+    assert editor.load_file(str(link))
+    type_text(editor, "new ")
+
+    assert editor.save_file()
+    assert link.is_symlink()
+    assert target.read_text() == "new old"
+    assert sorted(os.listdir(tmp_path)) == ["link.txt", "real.txt"]
+
+
+def test_new_file_mode_follows_the_umask(tmp_path):
+    """Test that a file created by saving gets the mode open() would give it."""
+    script = ("import text_editor_curses_claude as t; e = t.TextEditor(); "
+              f"assert e.save_file({str(tmp_path / 'new.txt')!r})")
+    subprocess.run([sys.executable, "-c", script], check=True,
+                   cwd=os.path.dirname(text_editor_curses_claude.__file__),
+                   preexec_fn=lambda: os.umask(0o077))
+    assert os.stat(tmp_path / "new.txt").st_mode & 0o777 == 0o600
+
+
+def test_failed_save_reports_the_error_and_keeps_the_document_modified(tmp_path):
+    """Test that a save that cannot be written leaves no temporary file behind."""
+    editor = TextEditor()
+    type_text(editor, "text")
+
+    assert not editor.save_file(str(tmp_path / "missing" / "notes.txt"))
+    assert editor.status_message.startswith("Error saving:")
+    assert editor.modified
+    assert editor.save_job is None
+    assert os.listdir(tmp_path) == []
@@ -0,0 +1,1121 @@
+#!/usr/bin/env python3
+"""
+Tests for the warehouse database and business logic layers.
+
+Every test works on a fresh database in pytest's temporary directory so the
+real warehouse.db is never modified.
+"""
+
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal
+from fractions import Fraction
+
+import pytest
+
+from warehouse_db import (
+    CHANGE_DELETE, CHANGE_INSERT, CHANGE_UPDATE, DEFAULT_BACKUP_FILE, DEFAULT_LOCATION, BackupResult, Change, Money, QueryInstrumentation,
+    HistogramBin, InventorySummary, LocationSummary,
+    FORMAT_COLUMNAR, ORDER_BY_NAME, ORDER_BY_PRICE, AsyncWarehouse, PERFORMANCE_PROFILE, BatchResult, MovementBatchResult,
+    MovementSummary, PerformanceProfile, ShardedWarehouseDB,
+    ProductCache, ProductMirror, QueryShape, Warehouse, WarehouseDB, compile_query,
+    main, prefix_upper_bound, run_batch, shard_paths,
+)
+from warehouse_ui import WarehouseUI
+
+
+@pytest.fixture
+def db(tmp_path):
+    """Provide a fresh WarehouseDB and close it afterwards."""
+    database = WarehouseDB(str(tmp_path / "test.db"))
+    yield database
+    database.close()
+
+
+@pytest.fixture
+def warehouse(tmp_path):
+    """Provide a fresh Warehouse and close it afterwards."""
+    wh = Warehouse(str(tmp_path / "test.db"))
+    yield wh
+    wh.close()
+
+
+def test_bulk_upsert_counts_inserts_updates_and_rejects(db):
+    """Test that bulk_upsert reports per-batch counts and applies rows."""
+    db.add_product("hammer", 1000, 5)
+    rows = [
+        ("hammer", 1200, 7),   # update
+        ("saw", 2500, 3),      # insert
+        ("", 100, 1),          # rejected: empty name
+        ("drill", -1, 1),      # rejected: negative price
+        ("chisel", 800, 2),    # insert
+    ]
+    results = db.bulk_upsert(rows, batch_size=3)
+
+    assert results == [BatchResult(1, 1, 1, 1), BatchResult(2, 1, 0, 1)]
+    assert db.get_product_by_name("hammer") == ("hammer", 1200, 7)
+    assert db.get_product_by_name("chisel") == ("chisel", 800, 2)
+    assert db.get_product_by_name("drill") is None
+
+
+def test_bulk_upsert_rejects_only_rows_the_database_refuses(db):
+    """Test that a total below another location's stock rejects that row, not its batch."""
+    db.bulk_upsert([("saw", 1000, 10), ("axe", 500, 1)])
+    db.add_location("depot")
+    db.transfer_stock("saw", DEFAULT_LOCATION, "depot", 6)
+
+    with db.transaction():
+        results = db.bulk_upsert([("saw", 1000, 5), ("axe", 500, 3), ("new", 1, 1)])
+    assert results == [BatchResult(1, 1, 1, 1)]
+    assert db.get_all_products_by_name() == [("axe", 500, 3), ("new", 1, 1), ("saw", 1000, 10)]
+
+
+def test_bulk_upsert_rejects_invalid_batch_size(db):
+    """Test that a non-positive batch size is refused."""
+    with pytest.raises(ValueError):
+        db.bulk_upsert([], batch_size=0)
+
+
+def test_import_products_converts_euros(warehouse):
+    """Test that import_products converts prices and rejects malformed rows."""
+    results = warehouse.import_products(
+        [("hammer", 10.5, 5), ("saw", "cheap", 1), ("bad row",)]
+    )
+
+    assert results == [BatchResult(1, 1, 0, 2)]
+    assert warehouse.get_product_by_name("hammer") == ("hammer", 10.5, 5)
+
+
+def test_performance_profile_applies_pragmas(tmp_path):
+    """Test that the selected profile is applied to the connection."""
+    db = WarehouseDB(str(tmp_path / "wal.db"), PERFORMANCE_PROFILE)
+    try:
+        assert db.cursor.execute('PRAGMA journal_mode').fetchone()[0] == "wal"
+        assert db.cursor.execute('PRAGMA synchronous').fetchone()[0] == 1  # NORMAL
+        assert db.cursor.execute('PRAGMA cache_size').fetchone()[0] == -64_000
+    finally:
+        db.close()
+
+
+def test_default_profile_keeps_journal_mode(tmp_path):
+    """Test that reopening a WAL database with the default profile leaves it in WAL mode."""
+    path = str(tmp_path / "wal.db")
+    WarehouseDB(path, PERFORMANCE_PROFILE).close()
+    db = WarehouseDB(path)
+    try:
+        assert db.cursor.execute('PRAGMA journal_mode').fetchone()[0] == "wal"
+    finally:
+        db.close()
+
+
+def test_read_only_database_skips_schema_setup(tmp_path):
+    """Test that a read-only open neither writes the file nor changes its schema."""
+    path = tmp_path / "ro.db"
+    conn = sqlite3.connect(path)
+    conn.execute('CREATE TABLE products (id INTEGER PRIMARY KEY, name TEXT NOT NULL UNIQUE, '
+                 'price INTEGER NOT NULL, amount INTEGER NOT NULL)')
+    conn.execute("INSERT INTO products (name, price, amount) VALUES ('saw', 1000, 3)")
+    conn.commit()
+    conn.close()
+
+    db = WarehouseDB(str(path), PERFORMANCE_PROFILE, read_only=True)
+    try:
+        assert db.get_product_by_name("saw") == ("saw", 1000, 3)
+        assert not db.fts_enabled
+        assert db.cursor.execute('PRAGMA journal_mode').fetchone()[0] == "delete"
+        assert db.cursor.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'table'").fetchall() == [("products",)]
+        assert not db.add_product("axe", 500, 1)
+    finally:
+        db.close()
+
+
+def test_invalid_profile_is_rejected(tmp_path):
+    """Test that unknown pragma values are refused."""
+    with pytest.raises(ValueError):
+        WarehouseDB(str(tmp_path / "bad.db"), PerformanceProfile(journal_mode="FAST"))
+
+
+def test_optimize_collects_statistics(db):
+    """Test that a full optimize run gathers planner statistics."""
+    db.bulk_upsert((f"item{i}", i, i) for i in range(100))
+    db.optimize(analyze=True)
+    tables = {row[0] for row in db.cursor.execute('SELECT tbl FROM sqlite_stat1')}
+    assert "products" in tables
+
+
+def test_pooled_warehouse_is_thread_safe(tmp_path):
+    """Test concurrent reads and writes through a pooled Warehouse."""
+    wh = Warehouse(str(tmp_path / "pooled.db"), PERFORMANCE_PROFILE, pooled=True)
+
+    def work(i):
+        assert wh.add_product(f"item{i}", i, i)
+        assert wh.get_product_by_name(f"item{i}") == (f"item{i}", float(i), i)
+        return len(wh.find_products_by_partial_name("item"))
+
+    try:
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            list(executor.map(work, range(200)))
+        assert len(wh.get_all_products_by_name()) == 200
+        assert len(wh.db._readers) > 1
+    finally:
+        wh.close()
+    assert wh.db._readers == []
+
+
+def test_pooled_mode_needs_a_file():
+    """Test that pooled mode refuses an in-memory database."""
+    with pytest.raises(ValueError):
+        WarehouseDB(":memory:", pooled=True)
+
+
+def test_partial_name_search_uses_trigram_index(db):
+    """Test that substring search is case insensitive and index backed."""
+    db.bulk_upsert([("CHAINSAW", 9900, 1), ("hacksaw", 1500, 4), ("hammer", 1000, 2)])
+
+    assert db.fts_enabled
+    assert sorted(r[0] for r in db.find_products_by_partial_name("saw")) == ["CHAINSAW", "hacksaw"]
+    plan = db.cursor.execute(
+        'EXPLAIN QUERY PLAN SELECT rowid FROM products_fts WHERE products_fts MATCH ?',
+        ('"saw"',)
+    ).fetchall()
+    assert any("VIRTUAL TABLE INDEX" in row[-1] for row in plan)
+
+
+def test_search_index_follows_updates_and_deletes(db):
+    """Test that the triggers keep the search index in sync."""
+    db.add_product("chainsaw", 9900, 1)
+    db.cursor.execute("UPDATE products SET name = 'jigsaw' WHERE name = 'chainsaw'")
+    db.conn.commit()
+    assert [r[0] for r in db.find_products_by_partial_name("saw")] == ["jigsaw"]
+    assert db.find_products_by_partial_name("chain") == []
+
+    db.delete_product("jigsaw")
+    assert db.find_products_by_partial_name("saw") == []
+
+
+def test_short_terms_fall_back_to_like(db):
+    """Test that terms below the trigram length still match."""
+    db.add_product("Saw", 100, 1)
+    assert db.find_products_by_partial_name("sa") == [("Saw", 100, 1)]
+
+
+def test_ranked_search_orders_by_relevance(warehouse):
+    """Test that the ranked variant puts the closest match first."""
+    warehouse.import_products([("saw blade replacement kit", 10, 1), ("saw", 5, 1)])
+
+    assert [r[0] for r in warehouse.find_products_ranked("saw")][0] == "saw"
+    assert len(warehouse.find_products_ranked("saw", limit=1)) == 1
+
+
+def test_iter_products_pages_by_keyset(db):
+    """Test that streamed listings match the full listings across pages."""
+    db.bulk_upsert((f"item{i:03d}", (i * 37) % 10, i) for i in range(25))
+
+    assert list(db.iter_products(ORDER_BY_NAME, page_size=4)) == db.get_all_products_by_name()
+    by_price = list(db.iter_products(ORDER_BY_PRICE, page_size=4))
+    assert len(by_price) == 25
+    assert [r[1] for r in by_price] == sorted(r[1] for r in by_price)
+    assert [r[0] for r in db.iter_products(ORDER_BY_NAME, after="item022")] == [
+        "item023", "item024"]
+
+
+def test_iter_products_rejects_unknown_sort_key(db):
+    """Test that only the indexed sort keys are accepted."""
+    with pytest.raises(ValueError):
+        next(db.iter_products("amount"))
+
+
+def test_display_products_consumes_iterator(warehouse, capsys):
+    """Test that the UI prints streamed listings and counts them."""
+    warehouse.import_products([("saw", 12.5, 3), ("axe", 20.0, 1)])
+    WarehouseUI(warehouse, Money, DEFAULT_BACKUP_FILE, ORDER_BY_PRICE).list_products_by_name()
+
+    output = capsys.readouterr().out
+    assert output.index("axe") < output.index("saw")
+    assert "Total: 2 products" in output
+
+
+def test_product_lookup_is_cached_and_invalidated(warehouse):
+    """Test cache hits and precise invalidation by writes."""
+    warehouse.add_product("saw", 10.0, 3)
+    warehouse.add_product("axe", 20.0, 1)
+    assert warehouse.get_product_by_name("saw") == ("saw", 10.0, 3)
+    assert warehouse.get_product_by_name("saw") == ("saw", 10.0, 3)
+    warehouse.get_product_by_name("axe")
+    stats = warehouse.cache_stats()
+    assert (stats.hits, stats.misses, stats.size) == (1, 2, 2)
+
+    warehouse.update_product("saw", 11.0, 4)
+    assert "saw" not in warehouse.cache and "axe" in warehouse.cache
+    assert warehouse.get_product_by_name("saw") == ("saw", 11.0, 4)
+
+    warehouse.import_products([("axe", 25.0, 2)])
+    assert warehouse.get_product_by_name("axe") == ("axe", 25.0, 2)
+
+    warehouse.delete_product("saw")
+    assert warehouse.get_product_by_name("saw") is None
+
+
+def test_product_cache_evicts_and_expires():
+    """Test LRU eviction and TTL expiry counters."""
+    now = [0.0]
+    cache = ProductCache(max_size=2, ttl=10, clock=lambda: now[0])
+    for key in ("a", "b", "c"):
+        _, _, token = cache.get(key)
+        cache.put(key, key.upper(), token)
+    assert "a" not in cache and cache.stats().evictions == 1
+
+    now[0] = 11.0
+    assert cache.get("b")[0] is False
+    assert cache.stats().expirations == 1
+
+
+def test_product_cache_discards_loads_racing_a_write():
+    """Test that a value loaded before a write completes is not cached."""
+    cache = ProductCache()
+    _, _, token = cache.get("saw")
+    cache.begin_write()
+    cache.end_write(["saw"])
+    cache.put("saw", "stale", token)
+    assert "saw" not in cache
+
+
+def test_async_warehouse_serves_many_concurrent_callers(tmp_path):
+    """Test thousands of concurrent awaits on a fixed number of threads."""
+    async def scenario():
+        async with AsyncWarehouse(str(tmp_path / "async.db"), max_workers=4) as wh:
+            await wh.import_products((f"item{i:04d}", i / 10, i) for i in range(100))
+            threads_before = threading.active_count()
+            results = await asyncio.gather(
+                *(wh.get_product_by_name(f"item{i % 100:04d}") for i in range(2000))
+            )
+            assert all(results)
+            assert threading.active_count() - threads_before <= 4
+
+            names = [row[0] async for row in wh.iter_products(ORDER_BY_NAME, page_size=7)]
+            assert names == [f"item{i:04d}" for i in range(100)]
+            assert await wh.find_products_by_partial_name("item0099") == [("item0099", Money(990), 99)]
+
+    asyncio.run(scenario())
+
+
+def test_adjust_stock_records_movements_and_totals(db):
+    """Test that adjustments update stock, the ledger and per-day totals."""
+    db.add_product("saw", 1000, 5)
+    day1, day2 = 1_700_000_000, 1_700_000_000 + 86_400
+
+    assert db.adjust_stock("saw", 10, timestamp=day1)
+    assert db.adjust_stock("saw", -3, timestamp=day1)
+    assert db.adjust_stock("saw", -2, timestamp=day2)
+    assert not db.adjust_stock("saw", -100, timestamp=day2)
+    assert not db.adjust_stock("missing", 1)
+    assert not db.adjust_stock("saw", 0)
+
+    assert db.get_product_by_name("saw") == ("saw", 1000, 10)
+    # The opening stock of 5 is logged today, after the backdated movements
+    assert db.get_movement_summaries("saw")[-1].inbound == 5
+    assert db.get_movement_summaries("saw", "2023-11-14", "2023-11-15") == [
+        MovementSummary("2023-11-14", 10, 3, 2),
+        MovementSummary("2023-11-15", 0, 2, 1),
+    ]
+    assert db.get_movement_summaries("saw", "2023-11-15", "2023-11-15") == [
+        MovementSummary("2023-11-15", 0, 2, 1)]
+
+
+def test_stock_ledger_is_append_only(db):
+    """Test that recorded movements cannot be rewritten."""
+    db.add_product("saw", 1000, 5)
+    db.adjust_stock("saw", 1)
+    with pytest.raises(sqlite3.IntegrityError):
+        db.cursor.execute('UPDATE stock_movements SET delta = 100')
+    with pytest.raises(sqlite3.IntegrityError):
+        db.cursor.execute('DELETE FROM stock_movements')
+    db.conn.rollback()
+
+    # Deleting the product keeps its history and logs the stock it took away
+    assert db.delete_product("saw")
+    assert db.cursor.execute('SELECT COUNT(*), SUM(delta) FROM stock_movements').fetchone() == (3, 0)
+
+
+def test_stock_ledger_reconciles_with_overwrites(db):
+    """Test that every way of setting stock is logged, so the ledger sums to the stock."""
+    def ledger_totals():
+        return dict(db.cursor.execute(
+            '''SELECT p.name, SUM(m.delta) FROM stock_movements m
+            JOIN products p ON p.id = m.product_id GROUP BY p.name''').fetchall())
+
+    db.add_product("saw", 1000, 5)
+    db.adjust_stock("saw", 3)
+    db.update_product("saw", 1200, 2)
+    db.update_product("saw", 1500, 2)
+    db.bulk_upsert([("saw", 1500, 9), ("axe", 500, 4), ("axe", 500, 6)])
+    db.record_movements([("axe", -1)])
+    assert ledger_totals() == {"saw": 9, "axe": 5}
+    assert db.cursor.execute(
+        "SELECT kind, delta FROM stock_movements ORDER BY id").fetchall() == [
+        ("set", 5), ("move", 3), ("set", -6), ("set", 7), ("set", 4), ("set", 2), ("move", -1)]
+
+    # A new product never takes over the id, and so the history, of a deleted one
+    db.delete_product("axe")
+    db.add_product("pick", 700, 0)
+    assert ledger_totals() == {"saw": 9}
+
+
+def test_stock_ledger_migrated_from_older_schema(tmp_path):
+    """Test that a ledger without movement kinds is upgraded and opened with the unlogged stock."""
+    path = str(tmp_path / "old.db")
+    conn = sqlite3.connect(path)
+    conn.execute('CREATE TABLE products (id INTEGER PRIMARY KEY, name TEXT NOT NULL UNIQUE, '
+                 'price INTEGER NOT NULL, amount INTEGER NOT NULL)')
+    conn.execute('CREATE TABLE stock_movements (id INTEGER PRIMARY KEY, product_id INTEGER NOT NULL, '
+                 'delta INTEGER NOT NULL, created_at INTEGER NOT NULL)')
+    conn.execute("INSERT INTO products (name, price, amount) VALUES ('saw', 1000, 7)")
+    conn.execute("INSERT INTO stock_movements (product_id, delta, created_at) VALUES (1, 2, 0)")
+    conn.commit()
+    conn.close()
+
+    db = WarehouseDB(path)
+    try:
+        assert db.cursor.execute(
+            "SELECT kind, delta FROM stock_movements ORDER BY id").fetchall() == [("move", 2), ("set", 5)]
+        assert db.adjust_stock("saw", -7)
+        assert db.get_product_by_name("saw") == ("saw", 1000, 0)
+    finally:
+        db.close()
+
+
+def test_locations_track_stock_and_totals(db):
+    """Test per-location stock, transfers and the maintained location totals."""
+    db.add_product("saw", 1000, 10)
+    db.add_product("axe", 500, 4)
+    assert db.add_location("depot")
+    assert not db.add_location("depot")
+
+    assert db.transfer_stock("saw", DEFAULT_LOCATION, "depot", 6)
+    assert db.adjust_stock("axe", 3, location="depot")
+    assert not db.transfer_stock("saw", "depot", DEFAULT_LOCATION, 7)
+    assert not db.transfer_stock("saw", "depot", "nowhere", 1)
+    assert not db.adjust_stock("axe", -4, location="depot")
+
+    assert db.get_product_by_name("saw") == ("saw", 1000, 10)
+    assert db.get_product_by_name("saw", "depot") == ("saw", 1000, 6)
+    assert db.get_product_locations("axe") == [(DEFAULT_LOCATION, 4), ("depot", 3)]
+    assert db.get_all_products_by_name("depot") == [("axe", 500, 3), ("saw", 1000, 6)]
+    assert db.low_stock(5, DEFAULT_LOCATION) == [("axe", 500, 4), ("saw", 1000, 4)]
+
+    # A smaller total comes out of the default location, never below zero
+    assert db.update_product("saw", 2000, 8)
+    assert not db.update_product("saw", 2000, 5)
+    assert db.get_product_locations("saw") == [(DEFAULT_LOCATION, 2), ("depot", 6)]
+    assert db.inventory_summary("depot") == InventorySummary(2, 9, 13500, 500, 2000)
+    assert db.get_locations() == [LocationSummary(DEFAULT_LOCATION, 2, 6, 6000),
+                                  LocationSummary("depot", 2, 9, 13500)]
+
+    assert db.delete_product("saw")
+    assert db.get_locations() == [LocationSummary(DEFAULT_LOCATION, 1, 4, 2000),
+                                  LocationSummary("depot", 1, 3, 1500)]
+
+
+def test_locations_added_to_existing_database(tmp_path):
+    """Test that stock from before locations existed lands in the default location."""
+    path = str(tmp_path / "old.db")
+    conn = sqlite3.connect(path)
+    conn.execute('CREATE TABLE products (id INTEGER PRIMARY KEY, name TEXT NOT NULL UNIQUE, '
+                 'price INTEGER NOT NULL, amount INTEGER NOT NULL)')
+    conn.execute("INSERT INTO products (name, price, amount) VALUES ('saw', 1000, 3)")
+    conn.commit()
+    conn.close()
+
+    warehouse = Warehouse(path)
+    try:
+        assert warehouse.get_locations() == [LocationSummary(DEFAULT_LOCATION, 1, 3, Money(3000))]
+        assert warehouse.add_location("depot")
+        assert warehouse.transfer_stock("saw", DEFAULT_LOCATION, "depot", 3)
+        assert warehouse.get_all_products_by_price("depot") == [("saw", Money(1000), 3)]
+        assert warehouse.get_product_by_name("saw") == ("saw", Money(1000), 3)
+    finally:
+        warehouse.close()
+
+
+def ledger_location_stock(db):
+    """Rebuild the stock per (product, location) from the movement ledger."""
+    return dict(((product, location), amount) for product, location, amount in db.cursor.execute(
+        '''SELECT p.name, l.name, SUM(m.delta) FROM stock_movements m
+        JOIN products p ON p.id = m.product_id JOIN locations l ON l.id = m.location_id
+        GROUP BY p.name, l.name HAVING SUM(m.delta) != 0'''))
+
+
+def test_stock_ledger_rebuilds_location_stock(db):
+    """Test that the ledger logs locations, so it sums to the stock at each location."""
+    db.add_product("saw", 1000, 10)
+    db.add_product("axe", 500, 4)
+    db.add_location("depot")
+    assert db.transfer_stock("saw", DEFAULT_LOCATION, "depot", 6)
+    assert db.adjust_stock("saw", -2, location="depot")
+    assert db.adjust_stock("axe", 3, location="depot")
+    assert db.update_product("saw", 1000, 5)
+    assert ledger_location_stock(db) == {
+        ("saw", DEFAULT_LOCATION): 1, ("saw", "depot"): 4,
+        ("axe", DEFAULT_LOCATION): 4, ("axe", "depot"): 3}
+
+    # Transfers are neither applied again nor counted as inbound or outbound
+    assert db.get_product_by_name("saw") == ("saw", 1000, 5)
+    summary = db.get_movement_summaries("saw")[-1]
+    assert (summary.inbound, summary.outbound) == (10, 5)
+
+    assert db.delete_product("saw")
+    assert ledger_location_stock(db) == {("axe", DEFAULT_LOCATION): 4, ("axe", "depot"): 3}
+
+
+def test_stock_ledger_gains_locations_from_older_schema(tmp_path):
+    """Test that a ledger without locations is reconciled with the stock already transferred."""
+    path = str(tmp_path / "old.db")
+    db = WarehouseDB(path)
+    db.add_product("saw", 1000, 10)
+    db.add_location("depot")
+    db.transfer_stock("saw", DEFAULT_LOCATION, "depot", 6)
+    db.close()
+    conn = sqlite3.connect(path)
+    conn.execute('DROP TRIGGER stock_movements_no_delete')
+    conn.execute('DELETE FROM stock_movements WHERE kind = \'transfer\'')
+    conn.execute('ALTER TABLE stock_movements DROP COLUMN location_id')
+    conn.commit()
+    conn.close()
+
+    db = WarehouseDB(path)
+    try:
+        assert ledger_location_stock(db) == {("saw", DEFAULT_LOCATION): 4, ("saw", "depot"): 6}
+        assert db.adjust_stock("saw", -6, location="depot")
+        assert ledger_location_stock(db) == {("saw", DEFAULT_LOCATION): 4}
+    finally:
+        db.close()
+
+
+def test_record_movements_rejects_only_bad_rows(warehouse):
+    """Test batched ingestion with a movement that would go negative."""
+    warehouse.add_product("saw", 10.0, 2)
+    warehouse.get_product_by_name("saw")
+    results = warehouse.record_movements(
+        [("saw", 5), ("saw", -10), ("missing", 1), ("saw", -1), ("bad",)], batch_size=10
+    )
+
+    assert results == [MovementBatchResult(1, 2, 3)]
+    assert warehouse.get_product_by_name("saw") == ("saw", 10.0, 6)
+
+
+@pytest.mark.parametrize("filename", ["products.csv", "products.jsonl", "products.wcol"])
+def test_export_import_round_trip(tmp_path, filename):
+    """Test that every export format imports back to the same catalogue."""
+    source = Warehouse(str(tmp_path / "source.db"))
+    target = Warehouse(str(tmp_path / "target.db"))
+    try:
+        source.import_products([("saw", 12.5, 3), ('"quoted", ünïcode', 0.0, 0),
+                                ("axe", 20.0, 1)])
+        path = str(tmp_path / filename)
+
+        assert source.export_products(path) == 3
+        assert target.import_file(path) == [BatchResult(1, 3, 0, 0)]
+        assert target.get_all_products_by_name() == source.get_all_products_by_name()
+    finally:
+        source.close()
+        target.close()
+
+
+def test_import_counts_malformed_records_as_rejected(tmp_path, warehouse):
+    """Test that bad CSV and JSON Lines records are rejected, not fatal."""
+    csv_path = tmp_path / "bad.csv"
+    csv_path.write_text("name,price,amount\nsaw,100,1\naxe,cheap,1\nshort,1\n")
+    jsonl_path = tmp_path / "bad.jsonl"
+    jsonl_path.write_text('{"name": "drill", "price": 5, "amount": 1}\nnot json\n{"name": "x"}\n')
+
+    assert warehouse.import_file(str(csv_path)) == [BatchResult(1, 1, 0, 2)]
+    assert warehouse.import_file(str(jsonl_path)) == [BatchResult(1, 1, 0, 2)]
+
+
+def test_columnar_import_rejects_foreign_files(tmp_path, warehouse):
+    """Test that files without the columnar header are refused."""
+    path = tmp_path / "bad.wcol"
+    path.write_bytes(b"not columnar")
+    with pytest.raises(ValueError):
+        warehouse.import_file(str(path), FORMAT_COLUMNAR)
+
+
+def test_inventory_analytics(warehouse):
+    """Test the SQL-side summary, low stock, histogram and top-value queries."""
+    assert warehouse.inventory_summary() == InventorySummary(0, 0, 0, None, None)
+    assert warehouse.price_histogram(4) == []
+
+    warehouse.import_products([("saw", 10.0, 3), ("axe", 20.0, 1), ("drill", 50.0, 2),
+                               ("nail", 0.0, 1000)])
+
+    assert warehouse.inventory_summary() == InventorySummary(4, 1006, 150.0, 0.0, 50.0)
+    assert warehouse.low_stock(3) == [("axe", 20.0, 1), ("drill", 50.0, 2)]
+    assert warehouse.price_histogram(2) == [HistogramBin(0.0, 25.0, 3, 1004),
+                                            HistogramBin(25.0, 50.0, 1, 2)]
+    assert warehouse.top_n_by_value(2) == [("drill", 50.0, 2, 100.0), ("saw", 10.0, 3, 30.0)]
+
+
+def test_analytics_queries_use_covering_indexes(db):
+    """Test that the summary query is answered from an index alone."""
+    plan = db._query('EXPLAIN QUERY PLAN SELECT COUNT(*), SUM(price * amount) '
+                     'FROM products INDEXED BY idx_products_price_covering')
+    assert "COVERING INDEX" in plan[0][-1]
+
+
+def test_mirror_serves_listings_and_follows_writes(tmp_path):
+    """Test that the in-memory mirror matches SQLite after every kind of write."""
+    path = str(tmp_path / "mirror.db")
+    plain = Warehouse(path)
+    plain.import_products([("saw", 10.0, 3), ("axe", 20.0, 1)])
+    mirrored = Warehouse(path, mirror=True)
+    try:
+        mirrored.add_product("drill", 15.0, 2)
+        mirrored.update_product("saw", 25.0, 4)
+        mirrored.adjust_stock("axe", 5)
+        mirrored.import_products([("nail", 0.1, 100), ("drill", 5.0, 2)])
+        mirrored.record_movements([("nail", -10)])
+        mirrored.delete_product("axe")
+        mirrored.add_product("hammer", 15.0, 1)
+
+        assert mirrored.get_all_products_by_name() == plain.get_all_products_by_name()
+        assert mirrored.get_all_products_by_price() == [
+            ("nail", Money(10), 90), ("drill", 5.0, 2), ("hammer", 15.0, 1), ("saw", 25.0, 4)]
+        assert list(mirrored.iter_products(ORDER_BY_PRICE)) == mirrored.get_all_products_by_price()
+        assert mirrored.get_products_in_price_range(5, 15) == [
+            ("drill", 5.0, 2), ("hammer", 15.0, 1)]
+        assert plain.get_products_in_price_range(5, 15) == [
+            ("drill", 5.0, 2), ("hammer", 15.0, 1)]
+        assert mirrored.count_products() == plain.count_products() == 4
+    finally:
+        plain.close()
+        mirrored.close()
+
+
+def test_mirror_refreshes_apply_in_read_order():
+    """Test that a refresh holding an older read cannot overwrite a newer refresh."""
+    mirror = ProductMirror()
+    mirror.load([("saw", 1000, 1)])
+    reading = threading.Event()
+    release = threading.Event()
+
+    class StaleDB:
+        def get_products_by_names(self, names):
+            reading.set()
+            release.wait(5)
+            return [("saw", 1000, 2)]
+
+    class FreshDB:
+        def get_products_by_names(self, names):
+            return [("saw", 1000, 3)]
+
+    stale = threading.Thread(target=mirror.refresh, args=(StaleDB(), ["saw"]))
+    stale.start()
+    reading.wait(5)
+    fresh = threading.Thread(target=mirror.refresh, args=(FreshDB(), ["saw"]))
+    fresh.start()
+    fresh.join(0.2)
+    release.set()
+    stale.join(5)
+    fresh.join(5)
+
+    assert mirror.listing(ORDER_BY_NAME) == [("saw", Money(1000), 3)]
+
+
+def test_mirror_listing_is_a_private_copy(tmp_path):
+    """Test that callers cannot corrupt the mirror through returned lists."""
+    wh = Warehouse(str(tmp_path / "mirror.db"), mirror=True)
+    try:
+        wh.add_product("saw", 1.0, 1)
+        wh.get_all_products_by_name().clear()
+        assert wh.get_all_products_by_name() == [("saw", 1.0, 1)]
+    finally:
+        wh.close()
+
+
+def test_query_combines_filters(warehouse):
+    """Test that query() applies every filter, the ordering and the limit."""
+    warehouse.import_products([("saw", 10.0, 3), ("sander", 50.0, 1), ("screw", 0.1, 500),
+                               ("axe", 20.0, 8)])
+
+    assert list(warehouse.query(name_prefix="sa")) == [("sander", 50.0, 1), ("saw", 10.0, 3)]
+    assert list(warehouse.query(price_min=5, price_max=30, order_by=ORDER_BY_PRICE)) == [
+        ("saw", 10.0, 3), ("axe", 20.0, 8)]
+    assert list(warehouse.query(amount_min=3, order_by=ORDER_BY_PRICE, limit=2)) == [
+        ("screw", Money(10), 500), ("saw", 10.0, 3)]
+    assert len(list(warehouse.query())) == 4
+    with pytest.raises(ValueError):
+        list(warehouse.query(order_by="amount"))
+
+
+def test_query_shapes_share_sql_and_use_indexes(db):
+    """Test per-shape SQL reuse and that explain() reports the chosen index."""
+    first = db._prepare_query(100, 200, None, None, ORDER_BY_PRICE, 10)
+    second = db._prepare_query(5, 50, None, None, ORDER_BY_PRICE, 3)
+    assert first[0] is second[0]
+    assert compile_query.cache_info().hits > 0
+
+    plan = db.explain(price_min=100, price_max=200, order_by=ORDER_BY_PRICE)
+    assert plan == ["SEARCH products USING COVERING INDEX idx_products_price_covering "
+                    "(price>? AND price<?)"]
+    assert "idx_products_name" in db.explain(name_prefix="sa")[0]
+
+
+def test_prefix_query_below_surrogates(db):
+    """Test a prefix whose last character sits just below the surrogate range."""
+    db.add_product("x\ud7ffz", 100, 1)
+    assert list(db.query(name_prefix="x\ud7ff")) == [("x\ud7ffz", 100, 1)]
+
+
+def test_redundant_price_index_is_dropped(db):
+    """Test that only the covering index serves lookups by price."""
+    indexes = {row[0] for row in db.cursor.execute(
+        "SELECT name FROM sqlite_master WHERE type = 'index' AND tbl_name = 'products'")}
+    assert "idx_products_price_covering" in indexes
+    assert "idx_products_price" not in indexes
+
+
+def test_prefix_upper_bound():
+    """Test the exclusive upper bound used for name prefix ranges."""
+    assert prefix_upper_bound("saw") == "sax"
+    assert prefix_upper_bound("a" + chr(0x10FFFF)) == "b"
+    assert prefix_upper_bound("") is None
+    assert prefix_upper_bound("x\ud7ff") == "x\ue000"
+    assert "LIMIT" not in compile_query(QueryShape(False, False, False, False, False,
+                                                   ORDER_BY_NAME, False))
+
+
+def test_sharded_warehouse_matches_single_file(tmp_path):
+    """Test that a sharded Warehouse spreads products but keeps the same API results."""
+    rows = [(f"item{i:03d}", (i * 37) % 100 + 0.5, i % 7) for i in range(60)]
+    single = Warehouse(str(tmp_path / "single.db"))
+    sharded = Warehouse(str(tmp_path / "sharded.db"), shards=3)
+    try:
+        assert isinstance(sharded.db, ShardedWarehouseDB)
+        for wh in (single, sharded):
+            wh.import_products(rows)
+            wh.update_product("item001", 99.0, 1)
+            wh.delete_product("item002")
+        assert [len(shard.get_all_products_by_name()) for shard in sharded.db.shards] != [59, 0, 0]
+
+        for method, args in [("get_all_products_by_name", ()), ("get_all_products_by_price", ()),
+                             ("get_products_in_price_range", (10, 40)),
+                             ("low_stock", (2,)), ("top_n_by_value", (5,)),
+                             ("inventory_summary", ()), ("price_histogram", (4,))]:
+            assert getattr(sharded, method)(*args) == getattr(single, method)(*args), method
+        assert sorted(sharded.find_products_ranked("item01")) == \
+            sorted(single.find_products_ranked("item01"))
+        assert list(sharded.iter_products(ORDER_BY_PRICE, page_size=7)) == \
+            single.get_all_products_by_price()
+        assert list(sharded.iter_products(page_size=7, after="item050")) == \
+            list(single.iter_products(after="item050"))
+        assert list(sharded.query(amount_min=5, order_by=ORDER_BY_PRICE, limit=4)) == \
+            list(single.query(amount_min=5, order_by=ORDER_BY_PRICE, limit=4))
+        assert sharded.get_product_by_name("item001") == ("item001", 99.0, 1)
+        assert sharded.adjust_stock("item001", 4)
+        assert sharded.get_product_by_name("item001") == ("item001", 99.0, 5)
+    finally:
+        single.close()
+        sharded.close()
+
+
+def test_sharded_db_scatters_reads_to_processes(tmp_path):
+    """Test scatter-gather reads through worker processes and bulk write counts."""
+    db = ShardedWarehouseDB(str(tmp_path / "test.db"), shards=2, processes=2)
+    try:
+        results = db.bulk_upsert([(f"p{i}", i, 1) for i in range(10)] + [("", 1, 1)],
+                                 batch_size=100)
+        assert results == [BatchResult(1, 10, 0, 1)]
+        assert [name for name, _, _ in db.get_all_products_by_price()] == \
+            [f"p{i}" for i in range(10)]
+        assert db.find_products_by_partial_name("P1") == [("p1", 1, 1)]
+        with pytest.raises(ValueError):
+            list(db.iter_products(ORDER_BY_PRICE, after="p1"))
+    finally:
+        db.close()
+
+
+def test_sharded_add_location_repairs_partial_add(tmp_path):
+    """Test that adding a location again fills in the shards an earlier call missed."""
+    db = ShardedWarehouseDB(str(tmp_path / "test.db"), shards=3)
+    try:
+        assert db.shards[1].add_location("depot")
+        assert db.add_location("depot")
+        assert all(any(summary.location == "depot" for summary in shard.get_locations())
+                   for shard in db.shards)
+        assert not db.add_location("depot")
+    finally:
+        db.close()
+
+
+def test_changelog_records_every_write(warehouse):
+    """Test that inserts, updates and deletes are streamed in sequence order."""
+    warehouse.add_product("saw", 10.0, 3)
+    warehouse.import_products([("saw", 10.0, 3), ("axe", 20.0, 1)])  # saw unchanged
+    warehouse.adjust_stock("axe", 4)
+    warehouse.delete_product("saw")
+
+    changes = list(warehouse.changes_since())
+    assert [(c.op, c.name, c.price, c.amount) for c in changes] == [
+        (CHANGE_INSERT, "saw", 10.0, 3), (CHANGE_INSERT, "axe", 20.0, 1),
+        (CHANGE_UPDATE, "axe", 20.0, 5), (CHANGE_DELETE, "saw", None, None)]
+    assert [c.seq for c in changes] == sorted(c.seq for c in changes)
+    assert list(warehouse.changes_since(changes[1].seq)) == changes[2:]
+    assert list(warehouse.db.changes_since(page_size=1))[0] == Change(changes[0].seq, CHANGE_INSERT,
+                                                                     "saw", 1000, 3)
+
+
+def test_changelog_compaction_keeps_latest_per_product(warehouse):
+    """Test that compaction keeps the newest entry per name and never reuses seqs."""
+    for amount in range(5):
+        warehouse.add_product("saw", 1.0, amount) or warehouse.update_product("saw", 1.0, amount)
+    warehouse.add_product("axe", 2.0, 1)
+    warehouse.delete_product("axe")
+    last = warehouse.db.last_change_seq()
+
+    assert warehouse.compact_changes() == 5
+    assert [(c.op, c.name, c.amount) for c in warehouse.changes_since()] == [
+        ("U", "saw", 4), ("D", "axe", None)]
+    assert warehouse.compact_changes(drop_deletes=True) == 1
+    warehouse.add_product("chisel", 3.0, 1)
+    assert [c.seq for c in warehouse.changes_since(last)] == [last + 1]
+
+
+def test_sharded_changelog_resumes_from_composite_seq(tmp_path):
+    """Test that a sharded warehouse streams and compacts every shard's changelog."""
+    wh = Warehouse(str(tmp_path / "sharded.db"), shards=3)
+    try:
+        wh.import_products((f"item{i}", 1.0, i) for i in range(12))
+        for i in range(12):
+            wh.update_product(f"item{i}", 2.0, i)
+        changes = list(wh.changes_since())
+        assert len(changes) == 24
+        assert all(isinstance(c.seq, tuple) and len(c.seq) == 3 for c in changes)
+        for i in range(12):
+            ops = [c.op for c in changes if c.name == f"item{i}"]
+            assert ops == [CHANGE_INSERT, CHANGE_UPDATE]
+        assert changes[-1].seq == wh.db.last_change_seq()
+        # Resuming yields exactly the entries not yet seen, in the same per-shard order
+        resumed = list(wh.changes_since(changes[9].seq))
+        assert sorted(c[1:] for c in resumed) == sorted(c[1:] for c in changes[10:])
+        assert resumed[-1].seq == changes[-1].seq
+
+        wh.delete_product("item0")
+        assert [(c.op, c.name) for c in wh.changes_since(changes[-1].seq)] == [
+            (CHANGE_DELETE, "item0")]
+        assert wh.compact_changes(changes[-1].seq) == 12
+        assert {c.op for c in wh.changes_since()} == {CHANGE_UPDATE, CHANGE_DELETE}
+        with pytest.raises(ValueError):
+            list(wh.changes_since(5))
+    finally:
+        wh.close()
+
+
+def test_backup_runs_alongside_writers_and_restores(tmp_path):
+    """Test an online backup that interleaves with writes, then a restore."""
+    wh = Warehouse(str(tmp_path / "live.db"), PERFORMANCE_PROFILE, pooled=True, mirror=True)
+    try:
+        wh.import_products((f"item{i:05d}", 1.0, i) for i in range(5000))
+        steps = []
+        writer = threading.Thread(target=lambda: [wh.add_product(f"new{i}", 2.0, 1)
+                                                  for i in range(50)])
+
+        def progress(copied, total):
+            steps.append((copied, total))
+            if len(steps) == 1:
+                writer.start()
+
+        result = wh.backup(str(tmp_path / "backup.db"), pages_per_step=4, progress=progress)
+        writer.join()
+        assert isinstance(result, BackupResult)
+        assert len(steps) > 1 and steps[-1][0] == steps[-1][1] == result.pages
+        assert result.bytes_per_second > 0
+
+        wh.delete_product("item00000")
+        assert wh.get_product_by_name("item00001") == ("item00001", 1.0, 1)
+        wh.update_product("item00001", 9.0, 9)
+        assert wh.restore(str(tmp_path / "backup.db"))
+        assert wh.get_product_by_name("item00000") == ("item00000", 1.0, 0)
+        assert wh.get_product_by_name("item00001") == ("item00001", 1.0, 1)
+        assert wh.count_products() == 5000 + sum(1 for c in wh.changes_since()
+                                                 if c.name.startswith("new") and c.op == CHANGE_INSERT)
+        assert not wh.restore(str(tmp_path / "missing.db"))
+    finally:
+        wh.close()
+
+
+def test_restore_upgrades_schema_and_continues_changelog(db, tmp_path):
+    """Test restoring a bare products table: the schema is rebuilt and the changelog moves forward."""
+    backup = str(tmp_path / "bare.db")
+    conn = sqlite3.connect(backup)
+    conn.execute('CREATE TABLE products (id INTEGER PRIMARY KEY, name TEXT NOT NULL UNIQUE, '
+                 'price INTEGER NOT NULL, amount INTEGER NOT NULL)')
+    conn.executemany('INSERT INTO products (name, price, amount) VALUES (?, ?, ?)',
+                     [("saw", 1000, 5), ("axe", 500, 3)])
+    conn.commit()
+    conn.close()
+
+    db.add_product("saw", 900, 1)
+    db.add_product("drill", 2000, 2)
+    db.compact_changes(drop_deletes=True)
+    last = db.last_change_seq()
+
+    assert db.restore(backup)
+    assert [(c.op, c.name, c.amount) for c in db.changes_since(last)] == [
+        (CHANGE_DELETE, "drill", None), (CHANGE_INSERT, "axe", 3), (CHANGE_UPDATE, "saw", 5)]
+    assert min(c.seq for c in db.changes_since(last)) == last + 1
+    assert db.adjust_stock("saw", -2)
+    assert db.get_locations() == [LocationSummary(DEFAULT_LOCATION, 2, 6, 4500)]
+    assert db.fts_enabled
+    assert db.find_products_by_partial_name("saw") == [("saw", 1000, 3)]
+
+
+def test_failed_restore_leaves_database_unchanged(db, tmp_path):
+    """Test that a backup whose schema cannot be upgraded is never swapped in."""
+    backup = str(tmp_path / "broken.db")
+    conn = sqlite3.connect(backup)
+    conn.execute('CREATE TABLE products (id INTEGER PRIMARY KEY, name TEXT NOT NULL UNIQUE)')
+    conn.execute("INSERT INTO products (name) VALUES ('axe')")
+    conn.commit()
+    conn.close()
+    db.add_product("saw", 900, 1)
+    last = db.last_change_seq()
+
+    assert not db.restore(backup)
+    assert db.get_all_products_by_name() == [("saw", 900, 1)]
+    assert db.last_change_seq() == last
+    assert sorted(os.listdir(tmp_path)) == ["broken.db", "test.db"]
+
+
+def test_sharded_restore_checks_every_shard_first(tmp_path):
+    """Test that one unusable shard backup stops the restore before any shard is overwritten."""
+    db = ShardedWarehouseDB(str(tmp_path / "live.db"), shards=3)
+    try:
+        db.bulk_upsert([(f"item{i}", 100, 1) for i in range(30)])
+        backup = str(tmp_path / "backup.db")
+        assert db.backup(backup)
+        db.bulk_upsert([(f"item{i}", 200, 2) for i in range(30)])
+        with open(shard_paths(backup, 3)[2], "r+b") as f:
+            good = f.read()
+            f.seek(0)
+            f.write(b"not a database")
+
+        assert not db.restore(backup)
+        assert {price for _, price, _ in db.get_all_products_by_name()} == {200}
+
+        with open(shard_paths(backup, 3)[2], "wb") as f:
+            f.write(good)
+        assert db.restore(backup)
+        assert {price for _, price, _ in db.get_all_products_by_name()} == {100}
+        assert sorted(os.listdir(tmp_path)) == sorted(
+            [os.path.basename(p) for p in shard_paths(str(tmp_path / "live.db"), 3)] +
+            [os.path.basename(p) for p in shard_paths(backup, 3)])
+    finally:
+        db.close()
+
+
+def test_backup_throttles_io(db, tmp_path):
+    """Test that max_bytes_per_second limits the backup rate."""
+    db.bulk_upsert((f"item{i}", i, i) for i in range(2000))
+    result = db.backup(str(tmp_path / "backup.db"), pages_per_step=8,
+                       max_bytes_per_second=400_000)
+    assert result.seconds >= result.bytes / 400_000 * 0.9
+    assert result.bytes_per_second <= 400_000 * 1.1
+
+
+def test_transaction_rolls_back_every_write(warehouse):
+    """Test that a failing transaction() block leaves no write behind."""
+    warehouse.add_product("saw", 10.0, 3)
+    with pytest.raises(RuntimeError):
+        with warehouse.transaction():
+            warehouse.add_product("axe", 20.0, 1)
+            warehouse.update_product("saw", 11.0, 4)
+            assert warehouse.get_product_by_name("saw") == ("saw", 11.0, 4)
+            raise RuntimeError("abort")
+    assert warehouse.get_product_by_name("saw") == ("saw", 10.0, 3)
+    assert warehouse.get_product_by_name("axe") is None
+
+    with pytest.raises(sqlite3.DatabaseError):
+        with warehouse.transaction():
+            warehouse.add_product("axe", 20.0, 1)
+            warehouse.adjust_stock("saw", -5)  # refused: rolls the transaction back
+    assert warehouse.count_products() == 1
+
+
+def test_record_movements_in_transaction_keeps_earlier_writes(warehouse):
+    """Test that a refused movement inside a transaction() block undoes only its batch."""
+    warehouse.add_product("saw", 10.0, 3)
+    with warehouse.transaction():
+        warehouse.update_product("saw", 11.0, 4)
+        assert warehouse.record_movements([("saw", 1), ("saw", -10)]) == [
+            MovementBatchResult(1, 1, 1)]
+    assert warehouse.get_product_by_name("saw") == ("saw", 11.0, 5)
+
+
+def test_pooled_transaction_keeps_cache_and_mirror_current(tmp_path):
+    """Test that reads inside a pooled transaction see its writes and nothing stays stale after it."""
+    wh = Warehouse(str(tmp_path / "pooled.db"), PERFORMANCE_PROFILE, pooled=True, mirror=True)
+    try:
+        wh.import_products([("saw", 10.0, 1), ("axe", 5.0, 2)])
+        assert wh.get_product_by_name("saw") == ("saw", 10.0, 1)  # cached
+
+        with wh.transaction():
+            wh.update_product("saw", 20.0, 5)
+            assert wh.get_product_by_name("saw") == ("saw", 20.0, 5)
+            wh.import_products([("drill", 7.0, 3)])
+        assert wh.get_product_by_name("saw") == ("saw", 20.0, 5)
+        assert wh.get_all_products_by_name() == [
+            ("axe", 5.0, 2), ("drill", 7.0, 3), ("saw", 20.0, 5)]
+
+        with pytest.raises(RuntimeError):
+            with wh.transaction():
+                wh.delete_product("axe")
+                assert wh.get_product_by_name("axe") is None
+                raise RuntimeError("abort")
+        assert wh.get_product_by_name("axe") == ("axe", 5.0, 2)
+        assert wh.get_all_products_by_price() == [
+            ("axe", 5.0, 2), ("drill", 7.0, 3), ("saw", 20.0, 5)]
+    finally:
+        wh.close()
+
+
+def test_sharded_transaction_stays_on_one_shard(tmp_path, capsys):
+    """Test single-shard transactions and the refusal of batches that span shards."""
+    wh = Warehouse(str(tmp_path / "sharded.db"), shards=2)
+    try:
+        names = [f"item{i}" for i in range(20)]
+        first = [name for name in names if wh.db._shard_index(name) == 0]
+        second = [name for name in names if wh.db._shard_index(name) == 1]
+
+        with wh.transaction(first[:2]):
+            wh.add_product(first[0], 1.0, 1)
+            wh.import_products([(first[1], 2.0, 2)])
+            with pytest.raises(ValueError):
+                wh.add_product(second[0], 1.0, 1)
+        with pytest.raises(RuntimeError):
+            with wh.transaction(first[:1]):
+                wh.update_product(first[0], 9.0, 9)
+                raise RuntimeError("abort")
+        with pytest.raises(ValueError):
+            with wh.transaction([first[0], second[0]]):
+                pytest.fail("a transaction spanning shards must not start")
+        assert wh.get_all_products_by_name() == [(first[0], 1.0, 1), (first[1], 2.0, 2)]
+
+        batch = tmp_path / "ops.txt"
+        batch.write_text(f"add {first[2]} 1 1\nadd {second[0]} 1 1\n")
+        assert run_batch(wh, str(batch)) == 1
+        assert "spread over 2 shards" in capsys.readouterr().err
+        batch.write_text(f"add {second[0]} 1 1\nupdate {second[0]} 2 2\n")
+        assert run_batch(wh, str(batch)) == 0
+        assert wh.get_product_by_name(second[0]) == (second[0], 2.0, 2)
+        assert wh.count_products() == 3
+    finally:
+        wh.close()
+
+
+def test_cli_subcommands_and_batch(tmp_path, capsys):
+    """Test the non-interactive commands and all-or-nothing batch files."""
+    db_name = str(tmp_path / "cli.db")
+    assert main(["--db", db_name, "add", "saw", "12.5", "3"]) == 0
+    assert main(["--db", db_name, "add", "saw", "1", "1"]) == 1
+    batch = tmp_path / "ops.txt"
+    batch.write_text('add "big axe" 20 1\nupdate saw 13 4  # raise price\n\ndelete ghost\n')
+    assert main(["--db", db_name, "--batch", str(batch)]) == 1
+    batch.write_text('add "big axe" 20 1\nupdate saw 13 4\n')
+    assert main(["--db", db_name, "--batch", str(batch)]) == 0
+    batch.write_text("add drill 1.0\n")
+    assert main(["--db", db_name, "--batch", str(batch)]) == 2
+    capsys.readouterr()
+
+    assert main(["--db", db_name, "list", "--by", "price"]) == 0
+    assert capsys.readouterr().out == "saw\t13.00\t4\nbig axe\t20.00\t1\n"
+    assert main(["--db", db_name, "find", "AXE"]) == 0
+    assert capsys.readouterr().out == "big axe\t20.00\t1\n"
+    assert main(["--db", db_name, "stats"]) == 0
+    assert "Products:    2" in capsys.readouterr().out
+
+
+def test_instrumentation_times_statements_and_logs_slow_ones(tmp_path, caplog):
+    """Test per-statement counters, captured plans and the slow-query log."""
+    plain = Warehouse(str(tmp_path / "plain.db"))
+    assert plain.stats() is None
+    plain.close()
+    instrumentation = QueryInstrumentation(slow_query_ms=0)
+    wh = Warehouse(str(tmp_path / "test.db"), cache_size=0, instrumentation=instrumentation)
+    try:
+        wh.import_products((f"item{i}", 1.0, i) for i in range(50))
+        instrumentation.reset()
+        with caplog.at_level(logging.WARNING, logger="warehouse_db.slow_queries"):
+            wh.get_product_by_name("item7")
+            wh.get_product_by_name("item8")
+            assert len(list(wh.query(amount_min=10, limit=5))) == 5
+            with pytest.raises(sqlite3.OperationalError):
+                wh.db._query("SELECT nosuchcolumn FROM products")
+
+        stats = wh.stats()
+        lookup = next(s for s in stats.statements if "WHERE name = ?" in s.sql)
+        assert (lookup.calls, lookup.rows, lookup.errors) == (2, 2, 0)
+        assert any("idx_products_name" in step or "sqlite_autoindex" in step
+                   for step in lookup.plan)
+        assert stats.errors == 1 and stats.slow == stats.calls
+        assert sum(s.rows for s in stats.statements if "LIMIT" in s.sql) == 5
+
+        records = [json.loads(r.getMessage()) for r in caplog.records]
+        assert {r["event"] for r in records} == {"slow_query", "failed_query"}
+        assert any(r["params"] == ["item7"] and r["rows"] == 1 for r in records)
+    finally:
+        wh.close()
+
+
+def test_money_parses_exactly():
+    """Test exact euro parsing, rounding, comparisons and formatting of Money."""
+    assert Money.parse(19.99).cents == 1999
+    assert Money.parse("19.99") == Money.parse(Decimal("19.99")) == Money(1999)
+    assert Money.parse("€ 0.005").cents == 1 and Money.parse(-2).cents == -200
+    assert Money(1000) == 10 == Money.parse(10.0) and hash(Money(1000)) == hash(10)
+    assert Money(1999) != Decimal("19.99") and Money(1999) == 19.99
+    assert Money(1999) < Decimal("19.991") and Money(1999) >= Fraction(1999, 100)
+    assert Money(1999) < 19.995 and Money(1999) > 19.98 and Money(1999) != 19.994
+    assert Money(1) < float("inf") and Money(1) != float("nan")
+    assert hash(Money(1999)) == hash(19.99) and {19.99: 1}.get(Money(1999)) == 1
+    assert Money(1999) in {19.99} and Money(1000) in {10}
+    assert Money(5) < Money(6) < 1 and sum([Money(1), Money(2)]) == Money(3)
+    assert Money(250) * 4 == Money(1000) and str(Money(-5)) == "-0.05"
+    assert Money(1999) * 1.5 == Money(2999) and Money(1999) * Decimal("0.5") == Money(1000)
+    assert Money(1999) / 2 == Money(1000) and Money(-1999) / 2 == Money(-1000)
+    assert Money(1999) / Money(1000) == 1.999
+    assert Money(1999) + 1 == Money(2099) and 20 - Money(1999) == Money(1)
+    assert Money(1999) - 0.99 == Money(1900) and 2 * Money(5) == Money(10)
+    assert f"{Money(1999):>8.2f}" == "   19.99" and repr(Money(1)) == "Money('0.01')"
+    assert Money.of(1999) is Money.of(1999)
+    for bad in ("abc", float("nan"), float("inf"), "1e999999"):
+        with pytest.raises(ValueError):
+            Money.parse(bad)
+    with pytest.raises(TypeError):
+        Money.parse(True)
+    with pytest.raises(TypeError):
+        Money(1) + "1"
+    with pytest.raises(ZeroDivisionError):
+        Money(1) / 0
+    with pytest.raises(AttributeError):
+        Money(1).cents = 2
+
+
+def test_warehouse_prices_are_exact_money(warehouse):
+    """Test that 19.99 is stored as 1999 cents and read back as Money."""
+    assert warehouse.add_product("saw", 19.99, 3)
+    assert warehouse.db.get_product_by_name("saw") == ("saw", 1999, 3)
+    assert warehouse.update_product("saw", "0.29", 3)
+    assert warehouse.db.get_product_by_name("saw") == ("saw", 29, 3)
+    assert not warehouse.add_product("axe", "abc", 1)
+    assert not warehouse.add_product("axe", -0.01, 1)
+    warehouse.import_products([("axe", 4.35, 2), ("adze", "bad", 1)])
+    assert warehouse.get_product_by_name("axe") == ("axe", Money(435), 2)
+    assert warehouse.inventory_summary().total_value == Money(29 * 3 + 435 * 2)
+    assert warehouse.get_products_in_price_range("0.29", 4.35) == [
+        ("saw", Money(29), 3), ("axe", Money(435), 2)]
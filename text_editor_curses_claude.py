@@ -6,11 +6,847 @@ Supports standard Windows keyboard shortcuts and file operations.
 """
 
 import curses
+import mmap
 import os
+import random
+import stat
 import sys
-from typing import List, Tuple, Optional
+import tempfile
+import threading
+import time
+from abc import ABC, abstractmethod
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import deque
+from typing import Callable, Deque, Iterable, Iterator, List, Set, Tuple, Optional, Union
 from pathlib import Path
 
+# Typed text is appended to a shared add buffer until it holds this many
+# characters; appending copies the buffer, so it is kept small
+ADD_BUFFER_LIMIT = 16 * 1024
+
+# Characters of edited text the undo history may hold; each edit also
+# counts EDIT_OVERHEAD characters for its bookkeeping
+UNDO_BUDGET = 1_000_000
+EDIT_OVERHEAD = 32
+
+# Files at least this big are memory-mapped and decoded a line at a time
+# instead of being read into memory
+LARGE_FILE_THRESHOLD = 64 * 1024 * 1024
+
+# Bytes the background indexer scans between publishing line offsets, lines
+# indexed before a mapped file is shown, and lines decoded per block when a
+# mapped file is read through
+INDEX_CHUNK_SIZE = 4 * 1024 * 1024
+MAPPED_PRELOAD_LINES = 1000
+DECODE_BLOCK_LINES = 4096
+
+# Milliseconds between redraws while a mapped file is still being indexed
+# or a save is running in the background
+BACKGROUND_REFRESH_MS = 250
+
+# Characters gathered from the document before each write when saving
+SAVE_CHUNK_SIZE = 1024 * 1024
+
+# Mode given to files that did not exist before they were saved: what open()
+# would create under the process umask, which can only be read by setting
+# it, so it is read once here rather than from the saving thread
+_UMASK = os.umask(0o022)
+os.umask(_UMASK)
+NEW_FILE_MODE = 0o666 & ~_UMASK
+
+
+def newline_offsets(text: str) -> array:
+    """Return the offsets of every newline in text as an array of int64."""
+    offsets = array("q")
+    find = text.find
+    pos = find("\n")
+    while pos != -1:
+        offsets.append(pos)
+        pos = find("\n", pos + 1)
+    return offsets
+
+
+def encode_lines(lines: Iterable[str]) -> Iterator[Tuple[int, bytes]]:
+    """
+    Encode lines as UTF-8 in blocks of about SAVE_CHUNK_SIZE characters.
+
+    Yields (lines, data) pairs, the lines of each block joined by "\\n".
+    Surrogate escapes are written back as the bytes they stand for.
+    """
+    chunk: List[str] = []
+    size = 0
+    for line in lines:
+        chunk.append(line)
+        size += len(line) + 1
+        if size >= SAVE_CHUNK_SIZE:
+            yield len(chunk), "\n".join(chunk).encode("utf-8", "surrogateescape")
+            chunk, size = [], 0
+    if chunk:
+        yield len(chunk), "\n".join(chunk).encode("utf-8", "surrogateescape")
+
+
+def normalize_newlines(text: str) -> str:
+    """Convert \\r\\n and \\r line endings to \\n and drop one trailing newline."""
+    text = text.replace("\r\n", "\n").replace("\r", "\n")
+    return text[:-1] if text.endswith("\n") else text
+
+
+class TextBuffer(ABC):
+    """
+    Storage of the document edited by TextEditor.
+
+    Positions are (row, col) pairs; rows are separated by "\\n", which counts
+    as one character when deleting across the end of a line. Backends only
+    need to provide the abstract methods; the rest are built on them.
+    """
+
+    @abstractmethod
+    def line_count(self) -> int:
+        """Return the number of lines; an empty document has one empty line."""
+
+    @abstractmethod
+    def get_line(self, row: int) -> str:
+        """Return the text of a line without its newline."""
+
+    @abstractmethod
+    def insert(self, row: int, col: int, text: str):
+        """Insert text, which may contain newlines, before (row, col)."""
+
+    @abstractmethod
+    def delete(self, row: int, col: int, count: int) -> str:
+        """Delete up to count characters from (row, col) on and return them."""
+
+    @abstractmethod
+    def snapshot(self) -> "TextBuffer":
+        """Return a copy that later edits to this buffer do not change."""
+
+    def line_length(self, row: int) -> int:
+        """Return the length of a line without its newline."""
+        return len(self.get_line(row))
+
+    def lines(self, start: int = 0) -> Iterator[str]:
+        """Yield the lines from row start to the end of the document."""
+        for row in range(start, self.line_count()):
+            yield self.get_line(row)
+
+    def get_text(self) -> str:
+        """Return the whole document with "\\n" between lines."""
+        return "\n".join(self.lines())
+
+    def encoded_blocks(self) -> Iterator[Tuple[int, bytes]]:
+        """Yield the document as (lines, data) blocks of UTF-8 to be joined by "\\n"."""
+        return encode_lines(self.lines())
+
+    def load_progress(self) -> float:
+        """Return the fraction of the document loaded; 1.0 once all of it is."""
+        return 1.0
+
+    def close(self):
+        """Release what the buffer holds open; it is not used afterwards."""
+
+
+class LineListBuffer(TextBuffer):
+    """A list of lines; simple and fast for small files, O(n) edits on big ones."""
+
+    def __init__(self, text: str = ""):
+        self._lines: List[str] = text.split("\n")
+
+    def line_count(self) -> int:
+        return len(self._lines)
+
+    def get_line(self, row: int) -> str:
+        return self._lines[row]
+
+    def insert(self, row: int, col: int, text: str):
+        line = self._lines[row]
+        self._lines[row:row + 1] = (line[:col] + text + line[col:]).split("\n")
+
+    def delete(self, row: int, col: int, count: int) -> str:
+        end_row, end_col, left = row, col, count
+        while left > 0:
+            available = len(self._lines[end_row]) - end_col
+            if left <= available or end_row + 1 == len(self._lines):
+                end_col += min(left, available)
+                break
+            left -= available + 1
+            end_row += 1
+            end_col = 0
+        first, last = self._lines[row], self._lines[end_row]
+        if row == end_row:
+            deleted = first[col:end_col]
+        else:
+            deleted = "\n".join([first[col:]] + self._lines[row + 1:end_row] + [last[:end_col]])
+        self._lines[row:end_row + 1] = [first[:col] + last[end_col:]]
+        return deleted
+
+    def snapshot(self) -> "LineListBuffer":
+        copy = LineListBuffer()
+        copy._lines = list(self._lines)
+        return copy
+
+    def lines(self, start: int = 0) -> Iterator[str]:
+        return iter(self._lines[start:])
+
+
+class _Source:
+    """Append-only text that pieces point into, with its newline offsets."""
+    __slots__ = ("text", "newlines")
+
+    def __init__(self, text: str = ""):
+        self.text = text
+        self.newlines = newline_offsets(text)
+
+    def append(self, text: str):
+        base = len(self.text)
+        self.newlines.extend(base + offset for offset in newline_offsets(text))
+        self.text += text
+
+    def count_newlines(self, start: int, end: int) -> int:
+        return bisect_left(self.newlines, end) - bisect_left(self.newlines, start)
+
+
+class _Piece:
+    """
+    Immutable treap node: a run of source text plus subtree totals.
+
+    Nodes are ordered by document position and heap-ordered by priority.
+    Edits copy the path they change, so older roots stay valid snapshots.
+    """
+    __slots__ = ("source", "start", "length", "newlines", "priority",
+                 "left", "right", "size", "lines")
+
+    def __init__(self, source: _Source, start: int, length: int, newlines: int,
+                 priority: float, left: Optional["_Piece"], right: Optional["_Piece"]):
+        self.source = source
+        self.start = start
+        self.length = length
+        self.newlines = newlines
+        self.priority = priority
+        self.left = left
+        self.right = right
+        self.size = length
+        self.lines = newlines
+        if left is not None:
+            self.size += left.size
+            self.lines += left.lines
+        if right is not None:
+            self.size += right.size
+            self.lines += right.lines
+
+    def with_children(self, left: Optional["_Piece"], right: Optional["_Piece"]) -> "_Piece":
+        return _Piece(self.source, self.start, self.length, self.newlines, self.priority,
+                      left, right)
+
+
+def _merge(first: Optional[_Piece], second: Optional[_Piece]) -> Optional[_Piece]:
+    """Join two treaps, with every piece of first before every piece of second."""
+    if first is None:
+        return second
+    if second is None:
+        return first
+    if first.priority > second.priority:
+        return first.with_children(first.left, _merge(first.right, second))
+    return second.with_children(_merge(first, second.left), second.right)
+
+
+def _split(node: Optional[_Piece], offset: int) -> Tuple[Optional[_Piece], Optional[_Piece]]:
+    """Split a treap into the text before offset and the text from offset on."""
+    if node is None:
+        return None, None
+    left_size = node.left.size if node.left is not None else 0
+    if offset <= left_size:
+        before, after = _split(node.left, offset)
+        return before, node.with_children(after, node.right)
+    if offset >= left_size + node.length:
+        before, after = _split(node.right, offset - left_size - node.length)
+        return node.with_children(node.left, before), after
+    # Cut the piece in two; both halves keep its priority, so the heap
+    # order holds without rebalancing
+    cut = offset - left_size
+    source, start = node.source, node.start
+    newlines = source.count_newlines(start, start + cut)
+    before = _Piece(source, start, cut, newlines, node.priority, node.left, None)
+    after = _Piece(source, start + cut, node.length - cut, node.newlines - newlines,
+                   node.priority, None, node.right)
+    return before, after
+
+
+def _grow_last(node: _Piece, source: _Source, length: int, newlines: int) -> Optional[_Piece]:
+    """
+    Extend the last piece by length characters appended to its source.
+
+    Returns None unless the last piece ends exactly where source ended
+    before the append, which is the case while the user keeps typing.
+    """
+    if node.right is not None:
+        right = _grow_last(node.right, source, length, newlines)
+        return None if right is None else node.with_children(node.left, right)
+    if node.source is not source or node.start + node.length != len(source.text) - length:
+        return None
+    return _Piece(source, node.start, node.length + length, node.newlines + newlines,
+                  node.priority, node.left, None)
+
+
+class PieceTableBuffer(TextBuffer):
+    """
+    A piece table kept in a persistent treap.
+
+    The loaded text and everything typed since live in append-only sources;
+    the document is the in-order sequence of pieces pointing into them.
+    Every node knows the characters and newlines in its subtree, so finding
+    a line, inserting and deleting take O(log n) in the number of pieces,
+    however long the lines are. snapshot() is O(1).
+    """
+
+    def __init__(self, text: str = ""):
+        self._add = _Source()
+        self._root: Optional[_Piece] = None
+        if text:
+            source = _Source(text)
+            self._root = _Piece(source, 0, len(text), len(source.newlines), random.random(),
+                                None, None)
+
+    def __len__(self) -> int:
+        return self._root.size if self._root is not None else 0
+
+    def line_count(self) -> int:
+        return (self._root.lines if self._root is not None else 0) + 1
+
+    def _newline_offset(self, index: int) -> int:
+        """Return the document offset of the newline ending line index."""
+        node, base = self._root, 0
+        while node is not None:
+            left_lines = node.left.lines if node.left is not None else 0
+            left_size = node.left.size if node.left is not None else 0
+            if index < left_lines:
+                node = node.left
+            elif index < left_lines + node.newlines:
+                newlines = node.source.newlines
+                position = newlines[bisect_left(newlines, node.start) + index - left_lines]
+                return base + left_size + position - node.start
+            else:
+                index -= left_lines + node.newlines
+                base += left_size + node.length
+                node = node.right
+        raise IndexError("line index out of range")
+
+    def _line_span(self, row: int) -> Tuple[int, int]:
+        """Return the document offsets where a line starts and ends."""
+        if not 0 <= row < self.line_count():
+            raise IndexError("line index out of range")
+        start = self._newline_offset(row - 1) + 1 if row else 0
+        end = self._newline_offset(row) if row < self.line_count() - 1 else len(self)
+        return start, end
+
+    def _offset(self, row: int, col: int) -> int:
+        return (self._newline_offset(row - 1) + 1 if row else 0) + col
+
+    def _chunks(self, start: int = 0, end: Optional[int] = None) -> Iterator[str]:
+        """Yield the document text between two offsets, one piece at a time."""
+        remaining = (len(self) if end is None else end) - start
+        pending: List[_Piece] = []
+        node = self._root
+        while node is not None and remaining > 0:
+            left_size = node.left.size if node.left is not None else 0
+            if start < left_size:
+                pending.append(node)
+                node = node.left
+            elif start < left_size + node.length:
+                first = node.start + start - left_size
+                chunk = node.source.text[first:min(node.start + node.length, first + remaining)]
+                remaining -= len(chunk)
+                yield chunk
+                node = node.right
+                break
+            else:
+                start -= left_size + node.length
+                node = node.right
+        while remaining > 0:
+            while node is not None:
+                pending.append(node)
+                node = node.left
+            if not pending:
+                return
+            node = pending.pop()
+            chunk = node.source.text[node.start:node.start + min(node.length, remaining)]
+            remaining -= len(chunk)
+            yield chunk
+            node = node.right
+
+    def _text(self, start: int, end: int) -> str:
+        """Return the document text between two offsets."""
+        return "".join(self._chunks(start, end))
+
+    def get_line(self, row: int) -> str:
+        return self._text(*self._line_span(row))
+
+    def line_length(self, row: int) -> int:
+        start, end = self._line_span(row)
+        return end - start
+
+    def insert(self, row: int, col: int, text: str):
+        if not text:
+            return
+        offset = self._offset(row, col)
+        if len(self._add.text) + len(text) > ADD_BUFFER_LIMIT:
+            self._add = _Source()
+        source = self._add
+        start = len(source.text)
+        source.append(text)
+        newlines = source.count_newlines(start, start + len(text))
+
+        before, after = _split(self._root, offset)
+        grown = _grow_last(before, source, len(text), newlines) if before is not None else None
+        if grown is None:
+            grown = _merge(before, _Piece(source, start, len(text), newlines, random.random(),
+                                          None, None))
+        self._root = _merge(grown, after)
+
+    def delete(self, row: int, col: int, count: int) -> str:
+        start = self._offset(row, col)
+        end = min(start + count, len(self))
+        if end <= start:
+            return ""
+        deleted = self._text(start, end)
+        before, rest = _split(self._root, start)
+        _, after = _split(rest, end - start)
+        self._root = _merge(before, after)
+        return deleted
+
+    def snapshot(self) -> "PieceTableBuffer":
+        copy = PieceTableBuffer()
+        copy._add = self._add
+        copy._root = self._root
+        return copy
+
+    def lines(self, start: int = 0) -> Iterator[str]:
+        if start >= self.line_count():
+            return
+        partial: List[str] = []
+        for chunk in self._chunks(self._offset(start, 0)):
+            parts = chunk.split("\n")
+            if len(parts) == 1:
+                partial.append(chunk)
+                continue
+            partial.append(parts[0])
+            yield "".join(partial)
+            yield from parts[1:-1]
+            partial = [parts[-1]]
+        yield "".join(partial)
+
+    def get_text(self) -> str:
+        return "".join(self._chunks())
+
+
+class _LineIndex:
+    """
+    A read-only mapping of a file and the offsets at which its lines start.
+
+    The offsets are found by a background thread; readers wait only for the
+    lines they ask for. Shared by a MappedFileBuffer and its snapshots, each
+    holding a reference; releasing the last stops the scan and unmaps the file.
+    """
+
+    def __init__(self, path: str):
+        with open(path, "rb") as f:
+            self.size = os.fstat(f.fileno()).st_size
+            # An empty file cannot be mapped, and has nothing to index
+            self.data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if self.size else b""
+        self.ends_with_newline = self.data[self.size - 1:self.size] == b"\n"
+        self.starts = array("q", [0])
+        self.scanned = 0
+        self.done = False
+        self.ready = threading.Condition()
+        self.references = 1
+        self.closed = False
+        self.thread: Optional[threading.Thread] = None
+        if self.size:
+            self.thread = threading.Thread(target=self._build, name="line-index", daemon=True)
+            self.thread.start()
+        else:
+            self.done = True
+
+    def _build(self):
+        """Scan the file for newlines, publishing line starts a chunk at a time."""
+        data, size = self.data, self.size
+        pos = 0
+        while pos < size and not self.closed:
+            end = min(pos + INDEX_CHUNK_SIZE, size)
+            chunk = data[pos:end]
+            starts = array("q")
+            find = chunk.find
+            found = find(b"\n")
+            while found != -1:
+                starts.append(pos + found + 1)
+                found = find(b"\n", found + 1)
+            with self.ready:
+                self.starts.extend(starts)
+                self.scanned = end
+                self.ready.notify_all()
+            pos = end
+        with self.ready:
+            # A final newline ends the last line rather than starting another
+            if self.starts[-1] == size:
+                self.starts.pop()
+            self.done = True
+            self.ready.notify_all()
+
+    def acquire(self) -> "_LineIndex":
+        """Take another reference to the index."""
+        with self.ready:
+            self.references += 1
+        return self
+
+    def release(self):
+        """Drop a reference; the last one stops the indexer and closes the mapping."""
+        with self.ready:
+            self.references -= 1
+            if self.references:
+                return
+            self.closed = True
+        if self.thread is not None:
+            self.thread.join()
+        if isinstance(self.data, mmap.mmap):
+            self.data.close()
+
+    def known(self) -> int:
+        """Return the number of lines whose extent is known so far."""
+        return len(self.starts) if self.done else len(self.starts) - 1
+
+    def wait_for(self, count: int):
+        """Block until count lines are known or the whole file is indexed."""
+        if self.done or self.known() >= count:
+            return
+        with self.ready:
+            while not self.done and self.known() < count:
+                self.ready.wait()
+
+    def _end(self, row: int) -> int:
+        """Return the offset just past a line's text, before its newline."""
+        if row + 1 < len(self.starts):
+            return self.starts[row + 1] - 1
+        return self.size - self.ends_with_newline
+
+    def line(self, row: int) -> str:
+        """Decode one line of the file."""
+        self.wait_for(row + 1)
+        if row >= self.known():
+            raise IndexError(row)
+        text = self.data[self.starts[row]:self._end(row)].decode("utf-8", "surrogateescape")
+        return text[:-1] if text.endswith("\r") else text
+
+    def lines(self, first: int, end: Optional[int] = None) -> Iterator[str]:
+        """Yield lines first to end, or to the end of the file, a block at a time."""
+        for _, block in self.blocks(first, end):
+            yield from block.decode("utf-8", "surrogateescape").split("\n")
+
+    def blocks(self, first: int, end: Optional[int] = None) -> Iterator[Tuple[int, bytes]]:
+        """Yield the raw bytes of lines first to end as (lines, data) blocks joined by "\\n"."""
+        row = first
+        while end is None or row < end:
+            self.wait_for(row + 1)
+            known = self.known()
+            if row >= known:
+                return
+            last = min(known, row + DECODE_BLOCK_LINES)
+            if end is not None:
+                last = min(last, end)
+            block = self.data[self.starts[row]:self._end(last - 1)]
+            if block.endswith(b"\r"):
+                block = block[:-1]
+            yield last - row, block.replace(b"\r\n", b"\n")
+            row = last
+
+    def progress(self) -> float:
+        """Return the fraction of the file indexed so far."""
+        return 1.0 if self.done else self.scanned / self.size
+
+
+# A run of a mapped file's lines, (first, end) with end None for "to the end
+# of the file", or a list of lines that have been edited
+_LinePiece = Union[Tuple[int, Optional[int]], List[str]]
+
+
+class MappedFileBuffer(TextBuffer):
+    """
+    A large file memory-mapped and decoded only as its lines are read.
+
+    Opening costs only the first screen's worth of indexing; the rest of the
+    line index is built in the background. The mapping is never written:
+    the document is a list of pieces, runs of the file's lines or lists of
+    edited lines, so an edit replaces the lines it touches with an overlay.
+    Lines are UTF-8 and may end in "\\n" or "\\r\\n". Undecodable bytes are
+    kept as surrogate escapes, and runs of unedited lines are saved as the
+    bytes they were read from, so saving never alters text it cannot decode.
+    """
+
+    def __init__(self, path: str):
+        self._index = _LineIndex(path)
+        self._closed = False
+        self._pieces: List[_LinePiece] = [(0, None)]
+        # First row of each piece, for bisecting
+        self._starts: List[int] = [0]
+        self._index.wait_for(MAPPED_PRELOAD_LINES)
+
+    def _size(self, piece: _LinePiece) -> int:
+        """Return the number of lines in a piece."""
+        if isinstance(piece, list):
+            return len(piece)
+        first, end = piece
+        return max(0, (self._index.known() if end is None else end) - first)
+
+    def _locate(self, row: int) -> Tuple[int, int]:
+        """Return the piece holding a row and the row's position within it."""
+        i = bisect_right(self._starts, row) - 1
+        return i, row - self._starts[i]
+
+    def _split_at(self, row: int) -> int:
+        """Split pieces so that one starts at row and return its position."""
+        i, offset = self._locate(row)
+        if offset == 0:
+            return i
+        piece = self._pieces[i]
+        if isinstance(piece, list):
+            if offset >= len(piece):
+                return i + 1
+            head, tail = piece[:offset], piece[offset:]
+        else:
+            first, end = piece
+            if end is not None and first + offset >= end:
+                return i + 1
+            head, tail = (first, first + offset), (first + offset, end)
+        self._pieces[i:i + 1] = [head, tail]
+        self._starts.insert(i + 1, row)
+        return i + 1
+
+    def _replace(self, row: int, count: int, lines: List[str]):
+        """Replace count lines from row with edited lines."""
+        i, offset = self._locate(row)
+        piece = self._pieces[i]
+        if count == len(lines) == 1 and isinstance(piece, list):
+            piece[offset] = lines[0]
+            return
+        i = self._split_at(row)
+        j = self._split_at(row + count)
+        self._pieces[i:j] = [lines]
+        # Neighbouring overlays are joined so typing does not fragment the list
+        if i + 1 < len(self._pieces) and isinstance(self._pieces[i + 1], list):
+            lines.extend(self._pieces.pop(i + 1))
+        if i > 0 and isinstance(self._pieces[i - 1], list):
+            self._pieces[i - 1].extend(self._pieces.pop(i))
+            i -= 1
+        del self._starts[i + 1:]
+        for piece in self._pieces[i:-1]:
+            self._starts.append(self._starts[-1] + self._size(piece))
+
+    def line_count(self) -> int:
+        return self._starts[-1] + self._size(self._pieces[-1])
+
+    def get_line(self, row: int) -> str:
+        i, offset = self._locate(row)
+        piece = self._pieces[i]
+        if isinstance(piece, list):
+            return piece[offset]
+        return self._index.line(piece[0] + offset)
+
+    def insert(self, row: int, col: int, text: str):
+        line = self.get_line(row)
+        self._replace(row, 1, (line[:col] + text + line[col:]).split("\n"))
+
+    def delete(self, row: int, col: int, count: int) -> str:
+        lines = [self.get_line(row)]
+        end_col, left = col, count
+        while left > 0:
+            available = len(lines[-1]) - end_col
+            if left <= available or row + len(lines) == self.line_count():
+                end_col += min(left, available)
+                break
+            left -= available + 1
+            lines.append(self.get_line(row + len(lines)))
+            end_col = 0
+        first, last = lines[0], lines[-1]
+        if len(lines) == 1:
+            deleted = first[col:end_col]
+        else:
+            deleted = "\n".join([first[col:]] + lines[1:-1] + [last[:end_col]])
+        self._replace(row, len(lines), [first[:col] + last[end_col:]])
+        return deleted
+
+    def snapshot(self) -> "MappedFileBuffer":
+        copy = MappedFileBuffer.__new__(MappedFileBuffer)
+        copy._index = self._index.acquire()
+        copy._closed = False
+        copy._pieces = [list(piece) if isinstance(piece, list) else piece
+                        for piece in self._pieces]
+        copy._starts = list(self._starts)
+        return copy
+
+    def lines(self, start: int = 0) -> Iterator[str]:
+        if start >= self.line_count():
+            return
+        i, offset = self._locate(start)
+        for piece in self._pieces[i:]:
+            if isinstance(piece, list):
+                yield from piece[offset:]
+            else:
+                yield from self._index.lines(piece[0] + offset, piece[1])
+            offset = 0
+
+    def encoded_blocks(self) -> Iterator[Tuple[int, bytes]]:
+        for piece in self._pieces:
+            if isinstance(piece, list):
+                yield from encode_lines(piece)
+            else:
+                yield from self._index.blocks(*piece)
+
+    def load_progress(self) -> float:
+        return self._index.progress()
+
+    def close(self):
+        if not self._closed:
+            self._closed = True
+            self._index.release()
+
+
+class Edit:
+    """
+    One undoable change: text inserted at or deleted from (row, col).
+
+    Undo and redo apply the change itself to the buffer, so they take time
+    proportional to the edited text rather than to the document.
+    """
+    INSERT = "insert"
+    DELETE = "delete"
+    __slots__ = ("kind", "row", "col", "text", "cursor_before", "cursor_after")
+
+    def __init__(self, kind: str, row: int, col: int, text: str,
+                 cursor_before: Tuple[int, int], cursor_after: Tuple[int, int]):
+        self.kind = kind
+        self.row = row
+        self.col = col
+        self.text = text
+        self.cursor_before = cursor_before
+        self.cursor_after = cursor_after
+
+    def cost(self) -> int:
+        """Return the size charged against the undo budget."""
+        return len(self.text) + EDIT_OVERHEAD
+
+    def replay(self, buffer: TextBuffer):
+        """Apply the change to a buffer again."""
+        if self.kind == Edit.INSERT:
+            buffer.insert(self.row, self.col, self.text)
+        else:
+            buffer.delete(self.row, self.col, len(self.text))
+
+    def revert(self, buffer: TextBuffer):
+        """Take the change back out of a buffer."""
+        if self.kind == Edit.INSERT:
+            buffer.delete(self.row, self.col, len(self.text))
+        else:
+            buffer.insert(self.row, self.col, self.text)
+
+    def absorb(self, edit: "Edit") -> bool:
+        """
+        Merge the edit that directly follows this one, if both belong to one
+        run of typing, Backspace or Delete on a line; True if merged.
+        """
+        if (edit.kind != self.kind or edit.row != self.row
+                or edit.cursor_before != self.cursor_after
+                or "\n" in edit.text or "\n" in self.text):
+            return False
+        if self.kind == Edit.INSERT:
+            # A space typed after a word starts the next undo step
+            if (edit.col != self.col + len(self.text)
+                    or (edit.text.isspace() and not self.text[-1:].isspace())):
+                return False
+            self.text += edit.text
+        elif edit.col + len(edit.text) == self.col:  # Backspace
+            self.text = edit.text + self.text
+            self.col = edit.col
+        elif edit.col == self.col:  # Delete
+            self.text += edit.text
+        else:
+            return False
+        self.cursor_after = edit.cursor_after
+        return True
+
+
+class SaveJob:
+    """
+    A snapshot of the document being written to a file on a background thread.
+
+    The text goes to a temporary file beside the target, in the blocks
+    TextBuffer.encoded_blocks yields, and is synced to disk before being renamed
+    over the target, so a crash leaves either the old file or the new one.
+    A symlink is saved through to the file it points at. The file is
+    replaced rather than rewritten, so other hard links to it keep the old
+    contents.
+    """
+
+    def __init__(self, buffer: TextBuffer, filename: str, change_count: int):
+        self.buffer = buffer
+        self.filename = filename
+        # The editor's change count when the snapshot was taken
+        self.change_count = change_count
+        self.rows_written = 0
+        self.error: Optional[Exception] = None
+        # Not a daemon, so quitting the editor still lets the save finish
+        self.thread = threading.Thread(target=self._run, name="save")
+
+    def start(self):
+        """Start writing in the background."""
+        self.thread.start()
+
+    def wait(self):
+        """Block until the save has finished."""
+        self.thread.join()
+
+    def done(self) -> bool:
+        """Return whether the save has finished, successfully or not."""
+        return not self.thread.is_alive()
+
+    def progress(self) -> float:
+        """Return the fraction of lines written so far."""
+        return min(1.0, self.rows_written / self.buffer.line_count())
+
+    def _run(self):
+        try:
+            self._write()
+        except Exception as e:
+            self.error = e
+        finally:
+            self.buffer.close()
+
+    def _write(self):
+        """Write the snapshot to a temporary file and move it over the target."""
+        target = os.path.realpath(self.filename)
+        fd, temp_name = tempfile.mkstemp(prefix=f".{os.path.basename(target)}.",
+                                         suffix=".tmp", dir=os.path.dirname(target))
+        try:
+            with open(fd, 'wb') as f:
+                for rows, block in self.buffer.encoded_blocks():
+                    if self.rows_written:
+                        f.write(b'\n')
+                    f.write(block)
+                    self.rows_written += rows
+                f.flush()
+                os.fsync(f.fileno())
+            if os.path.exists(target):
+                mode = stat.S_IMODE(os.stat(target).st_mode)
+            else:
+                mode = NEW_FILE_MODE
+            os.chmod(temp_name, mode)
+            os.replace(temp_name, target)
+        except BaseException:
+            try:
+                os.unlink(temp_name)
+            except OSError:
+                pass
+            raise
+
+
 class TextEditor:
     """A comprehensive console-based text editor with Windows-style shortcuts."""
     
@@ -27,9 +863,18 @@ class TextEditor:
     CTRL_A = 1   # Select All
     CTRL_F = 6   # Find
     
-    def __init__(self):
-        """Initialize the text editor."""
-        self.lines: List[str] = [""]
+    def __init__(self, buffer_factory: Callable[[str], TextBuffer] = PieceTableBuffer):
+        """
+        Initialize the text editor.
+
+        Args:
+            buffer_factory: Builds the document storage from a file's text,
+                e.g. PieceTableBuffer or LineListBuffer
+        """
+        self.buffer_factory = buffer_factory
+        self.buffer: TextBuffer = buffer_factory("")
+        # Files at least this big open as a MappedFileBuffer instead
+        self.large_file_threshold: int = LARGE_FILE_THRESHOLD
         self.cursor_row: int = 0
         self.cursor_col: int = 0
         self.offset_row: int = 0
@@ -42,69 +887,129 @@ class TextEditor:
         self.height: int = 0
         self.width: int = 0
         
-        # Undo/Redo stacks
-        self.undo_stack: List[Tuple[List[str], int, int]] = []
-        self.redo_stack: List[Tuple[List[str], int, int]] = []
-        self.max_undo: int = 100
-        
-    def save_state(self):
-        """Save current state for undo functionality."""
-        state = (
-            [line for line in self.lines],  # Deep copy of lines
-            self.cursor_row,
-            self.cursor_col
-        )
-        self.undo_stack.append(state)
-        if len(self.undo_stack) > self.max_undo:
-            self.undo_stack.pop(0)
+        # Undo/Redo history of edits, bounded by the characters it holds
+        self.undo_stack: Deque[Edit] = deque()
+        self.redo_stack: Deque[Edit] = deque()
+        self.undo_budget: int = UNDO_BUDGET
+        self.undo_size: int = 0
+        # Latest edit, while further typing may still be merged into it
+        self.open_edit: Optional[Edit] = None
+        # Bumped by every change to the document, so a save can tell whether
+        # the document still matches the snapshot it wrote
+        self.change_count: int = 0
+        self.save_job: Optional[SaveJob] = None
+        # A background save was asked for while another was still running
+        self.save_queued: bool = False
+
+        # Damage since the last frame: document rows to repaint, every row
+        # from dirty_from down, or the whole screen
+        self.dirty_rows: Set[int] = set()
+        self.dirty_from: Optional[int] = None
+        self.full_redraw: bool = True
+        # What the terminal shows, to find the rows a frame has to change
+        self.drawn_offset_row: int = 0
+        self.drawn_offset_col: int = 0
+        self.drawn_line_count: int = 0
+        # Render timing: frames drawn, their total and latest cost in seconds
+        self.frame_count: int = 0
+        self.frame_time: float = 0.0
+        self.last_frame_time: float = 0.0
+
+    def mark_dirty(self, row: int, to_end: bool = False):
+        """Mark a document row, or every row from it down, for repainting."""
+        if to_end:
+            self.dirty_from = row if self.dirty_from is None else min(self.dirty_from, row)
+        else:
+            self.dirty_rows.add(row)
+
+    def mark_edit_dirty(self, edit: Edit):
+        """Mark the rows an edit changed; one that splits or joins lines moves all below."""
+        self.mark_dirty(edit.row, to_end="\n" in edit.text)
+
+    def apply_edit(self, edit: Edit):
+        """Make an edit to the buffer, record it for undo and move the cursor."""
+        if edit.kind == Edit.INSERT:
+            self.buffer.insert(edit.row, edit.col, edit.text)
+        else:
+            edit.text = self.buffer.delete(edit.row, edit.col, len(edit.text))
+        self.mark_edit_dirty(edit)
+        self.cursor_row, self.cursor_col = edit.cursor_after
+        self.modified = True
+        self.change_count += 1
         self.redo_stack.clear()
-        
+
+        if self.open_edit is not None and self.open_edit.absorb(edit):
+            self.undo_size += len(edit.text)
+        else:
+            self.undo_stack.append(edit)
+            self.undo_size += edit.cost()
+            self.open_edit = edit
+        # Forget the oldest edits past the budget, but always keep the newest
+        while self.undo_size > self.undo_budget and len(self.undo_stack) > 1:
+            self.undo_size -= self.undo_stack.popleft().cost()
+
+    def insert_text(self, row: int, col: int, text: str, cursor_after: Tuple[int, int]):
+        """Insert text at (row, col) as an undoable edit."""
+        self.apply_edit(Edit(Edit.INSERT, row, col, text,
+                             (self.cursor_row, self.cursor_col), cursor_after))
+
+    def delete_text(self, row: int, col: int, count: int, cursor_after: Tuple[int, int]):
+        """Delete count characters from (row, col) on as an undoable edit."""
+        # The buffer fills in the deleted text; the placeholder only has its length
+        self.apply_edit(Edit(Edit.DELETE, row, col, " " * count,
+                             (self.cursor_row, self.cursor_col), cursor_after))
+
+    def clear_history(self):
+        """Forget every undoable edit, e.g. when another document is loaded."""
+        self.undo_stack.clear()
+        self.redo_stack.clear()
+        self.undo_size = 0
+        self.open_edit = None
+
     def undo(self):
         """Undo the last action."""
         if self.undo_stack:
-            current_state = (
-                [line for line in self.lines],
-                self.cursor_row,
-                self.cursor_col
-            )
-            self.redo_stack.append(current_state)
-            
-            state = self.undo_stack.pop()
-            self.lines, self.cursor_row, self.cursor_col = state
+            edit = self.undo_stack.pop()
+            self.undo_size -= edit.cost()
+            edit.revert(self.buffer)
+            self.mark_edit_dirty(edit)
+            self.redo_stack.append(edit)
+            self.open_edit = None
+            self.cursor_row, self.cursor_col = edit.cursor_before
             self.modified = True
+            self.change_count += 1
             self.status_message = "Undone"
-            
+
     def redo(self):
         """Redo the last undone action."""
         if self.redo_stack:
-            current_state = (
-                [line for line in self.lines],
-                self.cursor_row,
-                self.cursor_col
-            )
-            self.undo_stack.append(current_state)
-            
-            state = self.redo_stack.pop()
-            self.lines, self.cursor_row, self.cursor_col = state
+            edit = self.redo_stack.pop()
+            edit.replay(self.buffer)
+            self.mark_edit_dirty(edit)
+            self.undo_stack.append(edit)
+            self.undo_size += edit.cost()
+            self.open_edit = None
+            self.cursor_row, self.cursor_col = edit.cursor_after
             self.modified = True
+            self.change_count += 1
             self.status_message = "Redone"
-            
+
     def move_cursor(self, key: int):
         """Move cursor based on key input."""
         if key == curses.KEY_UP and self.cursor_row > 0:
             self.cursor_row -= 1
-            self.cursor_col = min(self.cursor_col, len(self.lines[self.cursor_row]))
-        elif key == curses.KEY_DOWN and self.cursor_row < len(self.lines) - 1:
+            self.cursor_col = min(self.cursor_col, self.buffer.line_length(self.cursor_row))
+        elif key == curses.KEY_DOWN and self.cursor_row < self.buffer.line_count() - 1:
             self.cursor_row += 1
-            self.cursor_col = min(self.cursor_col, len(self.lines[self.cursor_row]))
+            self.cursor_col = min(self.cursor_col, self.buffer.line_length(self.cursor_row))
         elif key == curses.KEY_LEFT and self.cursor_col > 0:
             self.cursor_col -= 1
-        elif key == curses.KEY_RIGHT and self.cursor_col < len(self.lines[self.cursor_row]):
+        elif key == curses.KEY_RIGHT and self.cursor_col < self.buffer.line_length(self.cursor_row):
             self.cursor_col += 1
         elif key == curses.KEY_HOME:
             self.cursor_col = 0
         elif key == curses.KEY_END:
-            self.cursor_col = len(self.lines[self.cursor_row])
+            self.cursor_col = self.buffer.line_length(self.cursor_row)
             
     def scroll_screen(self):
         """Adjust screen offset to keep cursor visible."""
@@ -122,83 +1027,66 @@ class TextEditor:
             
     def insert_char(self, char: int):
         """Insert a character at the current cursor position."""
+        row, col = self.cursor_row, self.cursor_col
         if char == ord('\n') or char == curses.KEY_ENTER or char == 10:
-            self.save_state()
             # Split line at cursor
-            current_line = self.lines[self.cursor_row]
-            self.lines[self.cursor_row] = current_line[:self.cursor_col]
-            self.lines.insert(self.cursor_row + 1, current_line[self.cursor_col:])
-            self.cursor_row += 1
-            self.cursor_col = 0
-            self.modified = True
+            self.insert_text(row, col, "\n", (row + 1, 0))
         elif char == curses.KEY_BACKSPACE or char == 127 or char == 8:
-            if self.cursor_col > 0:
-                self.save_state()
-                current_line = self.lines[self.cursor_row]
-                self.lines[self.cursor_row] = current_line[:self.cursor_col-1] + current_line[self.cursor_col:]
-                self.cursor_col -= 1
-                self.modified = True
-            elif self.cursor_row > 0:
-                self.save_state()
+            if col > 0:
+                self.delete_text(row, col - 1, 1, (row, col - 1))
+            elif row > 0:
                 # Join with previous line
-                prev_line_len = len(self.lines[self.cursor_row - 1])
-                self.lines[self.cursor_row - 1] += self.lines[self.cursor_row]
-                del self.lines[self.cursor_row]
-                self.cursor_row -= 1
-                self.cursor_col = prev_line_len
-                self.modified = True
+                prev_line_len = self.buffer.line_length(row - 1)
+                self.delete_text(row - 1, prev_line_len, 1, (row - 1, prev_line_len))
         elif char == curses.KEY_DC:  # Delete key
-            if self.cursor_col < len(self.lines[self.cursor_row]):
-                self.save_state()
-                current_line = self.lines[self.cursor_row]
-                self.lines[self.cursor_row] = current_line[:self.cursor_col] + current_line[self.cursor_col+1:]
-                self.modified = True
-            elif self.cursor_row < len(self.lines) - 1:
-                self.save_state()
-                # Join with next line
-                self.lines[self.cursor_row] += self.lines[self.cursor_row + 1]
-                del self.lines[self.cursor_row + 1]
-                self.modified = True
+            # At the end of a line this joins the next line
+            if col < self.buffer.line_length(row) or row < self.buffer.line_count() - 1:
+                self.delete_text(row, col, 1, (row, col))
         elif 32 <= char <= 126:  # Printable characters
-            self.save_state()
-            current_line = self.lines[self.cursor_row]
-            self.lines[self.cursor_row] = current_line[:self.cursor_col] + chr(char) + current_line[self.cursor_col:]
-            self.cursor_col += 1
-            self.modified = True
-            
+            self.insert_text(row, col, chr(char), (row, col + 1))
+
     def copy_line(self):
         """Copy current line to clipboard."""
-        if 0 <= self.cursor_row < len(self.lines):
-            self.clipboard = self.lines[self.cursor_row]
+        if 0 <= self.cursor_row < self.buffer.line_count():
+            self.clipboard = self.buffer.get_line(self.cursor_row)
             self.status_message = "Line copied"
             
     def cut_line(self):
         """Cut current line to clipboard."""
-        if 0 <= self.cursor_row < len(self.lines):
-            self.save_state()
-            self.clipboard = self.lines[self.cursor_row]
-            if len(self.lines) > 1:
-                del self.lines[self.cursor_row]
-                if self.cursor_row >= len(self.lines):
-                    self.cursor_row = len(self.lines) - 1
-            else:
-                self.lines[0] = ""
-            self.cursor_col = 0
-            self.modified = True
+        if 0 <= self.cursor_row < self.buffer.line_count():
+            row = self.cursor_row
+            self.clipboard = self.buffer.get_line(row)
+            length = len(self.clipboard)
+            if row < self.buffer.line_count() - 1:
+                # Remove the line together with its newline
+                self.delete_text(row, 0, length + 1, (row, 0))
+            elif row > 0:
+                # The last line goes with the newline before it
+                self.delete_text(row - 1, self.buffer.line_length(row - 1), length + 1,
+                                 (row - 1, 0))
+            elif length:
+                self.delete_text(0, 0, length, (0, 0))
             self.status_message = "Line cut"
             
     def paste_line(self):
         """Paste clipboard content."""
         if self.clipboard:
-            self.save_state()
-            self.lines.insert(self.cursor_row + 1, self.clipboard)
-            self.cursor_row += 1
-            self.cursor_col = 0
-            self.modified = True
+            row = self.cursor_row
+            self.insert_text(row, self.buffer.line_length(row), "\n" + self.clipboard,
+                             (row + 1, 0))
             self.status_message = "Line pasted"
             
-    def save_file(self, filename: Optional[str] = None):
-        """Save the current file."""
+    def save_file(self, filename: Optional[str] = None, wait: bool = True):
+        """
+        Save the current file.
+
+        Args:
+            filename: Save under this name instead of the current one
+            wait: Return once the file is written; otherwise it is written in
+                the background and finish_save reports the outcome. A save
+                already running is not waited for: this one is queued and
+                starts once finish_save has collected it.
+        """
         try:
             if filename:
                 self.filename = filename
@@ -207,34 +1095,66 @@ class TextEditor:
                 if not self.filename:
                     self.status_message = "Save cancelled"
                     return False
-                    
-            with open(self.filename, 'w', encoding='utf-8') as f:
-                for i, line in enumerate(self.lines):
-                    f.write(line)
-                    if i < len(self.lines) - 1:
-                        f.write('\n')
-                        
-            self.modified = False
-            self.status_message = f"Saved: {self.filename}"
-            return True
+
+            if not wait and self.save_job is not None and not self.save_job.done():
+                self.save_queued = True
+                self.status_message = f"Save in progress, saving again after: {self.filename}"
+                return True
+
+            # One save at a time, each of a snapshot that later typing leaves alone
+            self.save_queued = False
+            self.finish_save(wait=True)
+            self.save_job = SaveJob(self.buffer.snapshot(), self.filename, self.change_count)
+            self.save_job.start()
         except Exception as e:
             self.status_message = f"Error saving: {str(e)}"
             return False
+
+        if not wait:
+            self.status_message = f"Saving: {self.filename}"
+            return True
+        return self.finish_save(wait=True)
+
+    def finish_save(self, wait: bool = False) -> bool:
+        """
+        Report a background save once it is done and start a queued one.
+
+        Returns:
+            bool: False if the save failed, which also drops a queued save
+        """
+        job = self.save_job
+        if job is None:
+            return True
+        if wait:
+            job.wait()
+        elif not job.done():
+            return True
+        self.save_job = None
+        queued, self.save_queued = self.save_queued, False
+        if job.error is not None:
+            self.status_message = f"Error saving: {str(job.error)}"
+            return False
+        # Edits made while saving leave the document modified
+        if job.change_count == self.change_count:
+            self.modified = False
+        self.status_message = f"Saved: {job.filename}"
+        if queued and (self.modified or job.filename != self.filename):
+            return self.save_file(wait=False)
+        return True
             
     def load_file(self, filename: str):
         """Load a file."""
+        previous = self.buffer
         try:
-            if os.path.exists(filename):
-                with open(filename, 'r', encoding='utf-8') as f:
-                    content = f.read()
-                    if content:
-                        self.lines = content.splitlines()
-                        if not self.lines:
-                            self.lines = [""]
-                    else:
-                        self.lines = [""]
+            if os.path.exists(filename) and os.path.getsize(filename) >= self.large_file_threshold:
+                self.buffer = MappedFileBuffer(filename)
+            elif os.path.exists(filename):
+                # newline='' keeps \r so that normalize_newlines sees every ending
+                with open(filename, 'r', encoding='utf-8', newline='') as f:
+                    self.buffer = self.buffer_factory(normalize_newlines(f.read()))
             else:
-                self.lines = [""]
+                self.buffer = self.buffer_factory("")
+            previous.close()
                 
             self.filename = filename
             self.cursor_row = 0
@@ -242,8 +1162,10 @@ class TextEditor:
             self.offset_row = 0
             self.offset_col = 0
             self.modified = False
-            self.undo_stack.clear()
-            self.redo_stack.clear()
+            self.save_queued = False
+            self.change_count += 1
+            self.clear_history()
+            self.full_redraw = True
             self.status_message = f"Loaded: {filename}"
             return True
         except Exception as e:
@@ -258,15 +1180,18 @@ class TextEditor:
                 if not self.save_file():
                     return False
                     
-        self.lines = [""]
+        self.buffer.close()
+        self.buffer = self.buffer_factory("")
         self.filename = None
         self.cursor_row = 0
         self.cursor_col = 0
         self.offset_row = 0
         self.offset_col = 0
         self.modified = False
-        self.undo_stack.clear()
-        self.redo_stack.clear()
+        self.save_queued = False
+        self.change_count += 1
+        self.clear_history()
+        self.full_redraw = True
         self.status_message = "New file"
         return True
         
@@ -299,9 +1224,9 @@ class TextEditor:
             return
             
         # Search from current position
-        for row in range(self.cursor_row, len(self.lines)):
+        for row, line in enumerate(self.buffer.lines(self.cursor_row), self.cursor_row):
             start_col = self.cursor_col + 1 if row == self.cursor_row else 0
-            pos = self.lines[row].find(search_term, start_col)
+            pos = line.find(search_term, start_col)
             if pos != -1:
                 self.cursor_row = row
                 self.cursor_col = pos
@@ -309,9 +1234,9 @@ class TextEditor:
                 return
                 
         # Search from beginning
-        for row in range(0, self.cursor_row + 1):
-            end_col = self.cursor_col if row == self.cursor_row else len(self.lines[row])
-            pos = self.lines[row].find(search_term, 0, end_col)
+        for row, line in zip(range(self.cursor_row + 1), self.buffer.lines()):
+            end_col = self.cursor_col if row == self.cursor_row else len(line)
+            pos = line.find(search_term, 0, end_col)
             if pos != -1:
                 self.cursor_row = row
                 self.cursor_col = pos
@@ -320,27 +1245,79 @@ class TextEditor:
                 
         self.status_message = f"Not found: {search_term}"
         
+    def draw_line(self, screen_row: int, line_count: int):
+        """Repaint one row of the text area."""
+        row = screen_row + self.offset_row
+        try:
+            self.screen.move(screen_row, 0)
+            self.screen.clrtoeol()
+            if row < line_count:
+                line = self.buffer.get_line(row)
+                display_line = line[self.offset_col:self.offset_col + self.width - 1]
+                if display_line:
+                    try:
+                        self.screen.addstr(screen_row, 0, display_line)
+                    except UnicodeEncodeError:
+                        # Undecodable bytes of a mapped file, kept as surrogates
+                        self.screen.addstr(screen_row, 0, display_line.encode(
+                            "utf-8", "replace").decode("utf-8"))
+        except curses.error:
+            pass
+
+    def scroll_text(self, shift: int):
+        """Scroll the text area by shift rows in the terminal; returns the rows exposed."""
+        text_height = self.height - 2
+        self.screen.setscrreg(0, text_height - 1)
+        self.screen.scrollok(True)
+        self.screen.scroll(shift)
+        self.screen.scrollok(False)
+        self.screen.setscrreg(0, self.height - 1)
+        if shift > 0:
+            return range(text_height - shift, text_height)
+        return range(-shift)
+
     def draw_screen(self):
-        """Draw the editor screen."""
-        self.screen.clear()
-        
-        # Draw text content
-        for i in range(min(self.height - 2, len(self.lines) - self.offset_row)):
-            row = i + self.offset_row
-            if row < len(self.lines):
-                line = self.lines[row]
-                if self.offset_col < len(line):
-                    display_line = line[self.offset_col:self.offset_col + self.width]
-                else:
-                    display_line = ""
-                try:
-                    self.screen.addstr(i, 0, display_line[:self.width-1])
-                except curses.error:
-                    pass
+        """Draw the editor screen, repainting only rows changed since the last frame."""
+        start = time.perf_counter()
+        text_height = self.height - 2
+        line_count = self.buffer.line_count()
+        if line_count != self.drawn_line_count:
+            # Rows past the shorter document appear or go blank
+            self.mark_dirty(min(line_count, self.drawn_line_count), to_end=True)
+        shift = self.offset_row - self.drawn_offset_row
+        if self.offset_col != self.drawn_offset_col or abs(shift) >= text_height:
+            self.full_redraw = True
+
+        if self.full_redraw:
+            # erase() rather than clear(), which would resend the whole terminal
+            self.screen.erase()
+            rows = range(text_height)
+        else:
+            rows = set()
+            if shift:
+                rows.update(self.scroll_text(shift))
+            for screen_row in range(text_height):
+                row = screen_row + self.offset_row
+                if row in self.dirty_rows or (self.dirty_from is not None and row >= self.dirty_from):
+                    rows.add(screen_row)
+        for screen_row in rows:
+            self.draw_line(screen_row, line_count)
+
+        self.dirty_rows.clear()
+        self.dirty_from = None
+        self.full_redraw = False
+        self.drawn_offset_row = self.offset_row
+        self.drawn_offset_col = self.offset_col
+        self.drawn_line_count = line_count
                     
         # Draw status line
         status_left = f"{self.filename or 'Untitled'}{' *' if self.modified else ''}"
         status_right = f"Line {self.cursor_row + 1}, Col {self.cursor_col + 1}"
+        progress = self.buffer.load_progress()
+        if progress < 1.0:
+            status_right = f"Indexing {progress:.0%}  {status_right}"
+        if self.save_job is not None:
+            status_right = f"Saving {self.save_job.progress():.0%}  {status_right}"
         status_line = status_left + " " * (self.width - len(status_left) - len(status_right)) + status_right
         
         try:
@@ -349,11 +1326,13 @@ class TextEditor:
             pass
             
         # Draw message line
-        if self.status_message:
-            try:
+        try:
+            self.screen.move(self.height - 1, 0)
+            self.screen.clrtoeol()
+            if self.status_message:
                 self.screen.addstr(self.height - 1, 0, self.status_message[:self.width-1])
-            except curses.error:
-                pass
+        except curses.error:
+            pass
                 
         # Position cursor
         screen_row = self.cursor_row - self.offset_row
@@ -364,7 +1343,13 @@ class TextEditor:
             except curses.error:
                 pass
                 
-        self.screen.refresh()
+        # Send only the changed cells to the terminal, in one update
+        self.screen.noutrefresh()
+        curses.doupdate()
+
+        self.last_frame_time = time.perf_counter() - start
+        self.frame_time += self.last_frame_time
+        self.frame_count += 1
         
     def run(self):
         """Main editor loop."""
@@ -375,20 +1360,28 @@ class TextEditor:
             curses.cbreak()
             curses.curs_set(1)
             self.screen.keypad(True)
+            # Let curses scroll with the terminal's insert/delete line support
+            self.screen.idlok(True)
             
             # Get screen dimensions
             self.height, self.width = self.screen.getmaxyx()
             
             # Main loop
             while True:
+                self.finish_save()
                 self.scroll_screen()
                 self.draw_screen()
                 
+                # Redraw periodically while a file is indexed or saved in the background
+                busy = self.buffer.load_progress() < 1.0 or self.save_job is not None
+                self.screen.timeout(BACKGROUND_REFRESH_MS if busy else -1)
+                key = self.screen.getch()
+                if key == -1:
+                    continue
+                    
                 # Clear status message after displaying
                 if self.status_message:
                     self.status_message = ""
-                    
-                key = self.screen.getch()
                 
                 # Handle keyboard shortcuts
                 if key == self.CTRL_Q:  # Quit
@@ -404,7 +1397,7 @@ class TextEditor:
                     else:
                         break
                 elif key == self.CTRL_S:  # Save
-                    self.save_file()
+                    self.save_file(wait=False)
                 elif key == self.CTRL_O:  # Open
                     filename = self.prompt("Open file: ")
                     if filename:
@@ -428,6 +1421,7 @@ class TextEditor:
                     self.move_cursor(key)
                 elif key == curses.KEY_RESIZE:
                     self.height, self.width = self.screen.getmaxyx()
+                    self.full_redraw = True
                 else:
                     self.insert_char(key)
                     
@@ -0,0 +1,470 @@
+#!/usr/bin/env python3
+"""
+Warehouse Benchmarks
+
+Compares the throughput of the warehouse layer's code paths on synthetic
+product catalogues. Every benchmark runs against a throwaway database in a
+temporary directory, so the real warehouse.db is never touched.
+"""
+
+import argparse
+import json
+import math
+import os
+import platform
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Iterator, List, Sequence, Tuple
+
+from warehouse_db import ORDER_BY_NAME, ORDER_BY_PRICE, PERFORMANCE_PROFILE, Warehouse, WarehouseDB
+
+# Default catalogue size for a benchmark run
+DEFAULT_ROWS: int = 20_000
+
+# Default worker threads and operations per worker for the concurrency benchmark
+DEFAULT_THREADS: int = 8
+DEFAULT_OPERATIONS: int = 2_000
+
+# One in this many operations of the concurrent workload is a write
+WRITE_EVERY: int = 10
+
+# Number of substring searches timed by the search benchmark
+SEARCH_QUERIES: int = 200
+
+# Number of sorted listings timed by the mirror benchmark
+LISTING_REPEATS: int = 20
+
+# Shard counts compared by the sharded write benchmark
+SHARD_COUNTS: Tuple[int, ...] = (1, 2, 4, 8)
+
+# Catalogue sizes and timed calls per operation for the latency suite
+DEFAULT_SUITE_SIZES: Tuple[int, ...] = (10_000,)
+DEFAULT_SAMPLES: int = 1_000
+
+# Full listings scan the whole catalogue, so the suite times fewer of them
+LISTING_SAMPLES: int = 5
+
+# Operations timed by the latency suite, in the order they run
+SUITE_OPERATIONS: Tuple[str, ...] = ("add", "update", "lookup", "search",
+                                     "list_by_name", "list_by_price", "delete")
+
+# Format version of the suite's JSON results
+RESULTS_VERSION: int = 1
+
+# Relative p95 slowdown reported as a regression by --compare
+DEFAULT_TOLERANCE: float = 0.20
+
+# p95 slowdowns smaller than this many milliseconds are timer noise, not regressions
+MIN_REGRESSION_MS: float = 0.05
+
+
+def generate_products(count: int) -> Iterator[Tuple[str, int, int]]:
+    """Yield a deterministic synthetic catalogue of (name, price_cents, amount)."""
+    for i in range(count):
+        yield f"product-{i:08d}", (i * 7919) % 100_000, i % 500
+
+
+def benchmark_bulk_import(rows: int) -> Tuple[float, float]:
+    """
+    Time loading a catalogue row by row versus through bulk_upsert.
+
+    Args:
+        rows: Number of products to load
+
+    Returns:
+        Tuple[float, float]: Seconds taken by the per-row and bulk paths
+    """
+    with tempfile.TemporaryDirectory() as tmp:
+        db = WarehouseDB(os.path.join(tmp, "per_row.db"))
+        start = time.perf_counter()
+        for name, price, amount in generate_products(rows):
+            db.add_product(name, price, amount)
+        per_row = time.perf_counter() - start
+        db.close()
+
+        db = WarehouseDB(os.path.join(tmp, "bulk.db"))
+        start = time.perf_counter()
+        db.bulk_upsert(generate_products(rows))
+        bulk = time.perf_counter() - start
+        db.close()
+    return per_row, bulk
+
+
+def benchmark_concurrent(rows: int, threads: int, operations: int) -> Tuple[float, int, int]:
+    """
+    Time a mixed read/write workload against a pooled Warehouse.
+
+    Each worker thread performs exact lookups and partial-name searches, with
+    every WRITE_EVERY-th operation updating a product instead.
+
+    Args:
+        rows: Size of the catalogue loaded before the run
+        threads: Number of worker threads
+        operations: Operations performed by each worker
+
+    Returns:
+        Tuple[float, int, int]: Seconds taken, reads performed, writes performed
+    """
+    def worker(worker_id: int) -> Tuple[int, int]:
+        reads = writes = 0
+        for i in range(operations):
+            name = f"product-{(worker_id * operations + i) % rows:08d}"
+            if i % WRITE_EVERY == 0:
+                warehouse.update_product(name, i / 100, i)
+                writes += 1
+            elif i % 2:
+                warehouse.get_product_by_name(name)
+                reads += 1
+            else:
+                warehouse.find_products_by_partial_name(name[-6:])
+                reads += 1
+        return reads, writes
+
+    with tempfile.TemporaryDirectory() as tmp:
+        warehouse = Warehouse(os.path.join(tmp, "concurrent.db"), PERFORMANCE_PROFILE,
+                              pooled=True)
+        warehouse.db.bulk_upsert(generate_products(rows))
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=threads) as executor:
+            counts = list(executor.map(worker, range(threads)))
+        elapsed = time.perf_counter() - start
+        warehouse.close()
+    return elapsed, sum(r for r, _ in counts), sum(w for _, w in counts)
+
+
+def benchmark_sharded_writes(rows: int, threads: int) -> Dict[int, float]:
+    """
+    Time concurrent single-product inserts against 1 to 8 shard files.
+
+    Each add_product is its own transaction, so a single file serializes every
+    commit behind one writer while shards commit in parallel.
+
+    Args:
+        rows: Number of products inserted
+        threads: Number of worker threads issuing the inserts
+
+    Returns:
+        Dict[int, float]: Seconds taken for each shard count
+    """
+    products = list(generate_products(rows))
+    timings = {}
+    for shards in SHARD_COUNTS:
+        with tempfile.TemporaryDirectory() as tmp:
+            warehouse = Warehouse(os.path.join(tmp, "sharded.db"), pooled=True, shards=shards)
+            start = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=threads) as executor:
+                for name, price, amount in products:
+                    executor.submit(warehouse.db.add_product, name, price, amount)
+            timings[shards] = time.perf_counter() - start
+            warehouse.close()
+    return timings
+
+
+def benchmark_search(rows: int) -> Tuple[float, float]:
+    """
+    Time substring searches with a full LIKE scan versus the trigram index.
+
+    Args:
+        rows: Size of the catalogue searched
+
+    Returns:
+        Tuple[float, float]: Mean seconds per search for LIKE and the index
+    """
+    terms = [f"{(i * 7919) % rows:06d}" for i in range(SEARCH_QUERIES)]
+    with tempfile.TemporaryDirectory() as tmp:
+        db = WarehouseDB(os.path.join(tmp, "search.db"))
+        db.bulk_upsert(generate_products(rows))
+
+        start = time.perf_counter()
+        for term in terms:
+            db._query('SELECT name, price, amount FROM products WHERE name LIKE ? COLLATE NOCASE',
+                      (f'%{term}%',))
+        like = (time.perf_counter() - start) / len(terms)
+
+        start = time.perf_counter()
+        for term in terms:
+            db.find_products_by_partial_name(term)
+        indexed = (time.perf_counter() - start) / len(terms)
+        db.close()
+    return like, indexed
+
+
+def benchmark_export(rows: int) -> Dict[str, Tuple[float, float, int]]:
+    """
+    Time exporting and re-importing a catalogue in every file format.
+
+    The exporters and importers stream, so this can be run at 10M rows
+    (--rows 10000000) without memory growing with the catalogue.
+
+    Args:
+        rows: Size of the catalogue exported
+
+    Returns:
+        Dict[str, Tuple[float, float, int]]: Export seconds, import seconds and
+        file size in bytes for each format
+    """
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        db = WarehouseDB(os.path.join(tmp, "export.db"), PERFORMANCE_PROFILE)
+        db.bulk_upsert(generate_products(rows))
+        formats = (("csv", db.export_csv, "import_csv"),
+                   ("jsonl", db.export_jsonl, "import_jsonl"),
+                   ("wcol", db.export_columnar, "import_columnar"))
+        for extension, export, import_name in formats:
+            path = os.path.join(tmp, f"products.{extension}")
+            start = time.perf_counter()
+            export(path)
+            exported = time.perf_counter() - start
+
+            target = WarehouseDB(os.path.join(tmp, f"import_{extension}.db"), PERFORMANCE_PROFILE)
+            start = time.perf_counter()
+            getattr(target, import_name)(path)
+            imported = time.perf_counter() - start
+            target.close()
+            results[extension] = (exported, imported, os.path.getsize(path))
+        db.close()
+    return results
+
+
+def benchmark_mirror(rows: int) -> Dict[str, Tuple[float, float]]:
+    """
+    Time sorted listings and price-range queries from SQLite and the mirror.
+
+    Args:
+        rows: Size of the catalogue listed
+
+    Returns:
+        Dict[str, Tuple[float, float]]: Mean seconds per call from SQLite and
+        from the in-memory mirror, by operation
+    """
+    def mean_time(func, *args) -> float:
+        start = time.perf_counter()
+        for _ in range(LISTING_REPEATS):
+            func(*args)
+        return (time.perf_counter() - start) / LISTING_REPEATS
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "mirror.db")
+        plain = Warehouse(path)
+        plain.db.bulk_upsert(generate_products(rows))
+        mirrored = Warehouse(path, mirror=True)
+        results = {}
+        for label, method, args in (("list by name", "get_all_products_by_name", ()),
+                                    ("list by price", "get_all_products_by_price", ()),
+                                    ("price range", "get_products_in_price_range", (100, 110))):
+            results[label] = (mean_time(getattr(plain, method), *args),
+                              mean_time(getattr(mirrored, method), *args))
+        plain.close()
+        mirrored.close()
+    return results
+
+
+def percentile(ordered: Sequence[float], fraction: float) -> float:
+    """Return the nearest-rank percentile of already sorted samples."""
+    index = max(0, min(len(ordered) - 1, math.ceil(fraction * len(ordered)) - 1))
+    return ordered[index]
+
+
+def summarize(samples: List[float]) -> Dict[str, float]:
+    """
+    Condense per-call latencies into the figures stored in the JSON results.
+
+    Args:
+        samples: Seconds taken by each timed call
+
+    Returns:
+        Dict[str, float]: Sample count, p50/p95/p99/max and mean latency in
+        milliseconds, and calls per second
+    """
+    ordered = sorted(samples)
+    total = sum(ordered)
+    return {
+        "samples": len(ordered),
+        "p50_ms": percentile(ordered, 0.50) * 1000,
+        "p95_ms": percentile(ordered, 0.95) * 1000,
+        "p99_ms": percentile(ordered, 0.99) * 1000,
+        "max_ms": ordered[-1] * 1000,
+        "mean_ms": total / len(ordered) * 1000,
+        "ops_per_second": len(ordered) / total if total > 0 else 0.0,
+    }
+
+
+def time_calls(calls: Iterator[Callable[[], object]]) -> List[float]:
+    """Run each call and return how many seconds each one took."""
+    samples = []
+    for call in calls:
+        start = time.perf_counter()
+        call()
+        samples.append(time.perf_counter() - start)
+    return samples
+
+
+def run_suite(rows: int, samples: int, seed: int) -> Dict[str, Dict[str, float]]:
+    """
+    Time every Warehouse operation against a synthetic catalogue.
+
+    The catalogue is bulk loaded first and is not part of the timings. The
+    get_product_by_name cache is disabled so lookups measure the database.
+    Adds create new products, which the final delete phase removes again.
+
+    Args:
+        rows: Size of the catalogue
+        samples: Timed calls per operation (listings use LISTING_SAMPLES)
+        seed: Seed for choosing the products each call touches
+
+    Returns:
+        Dict[str, Dict[str, float]]: summarize() output per operation
+    """
+    rng = random.Random(seed)
+    existing = [f"product-{rng.randrange(rows):08d}" for _ in range(samples)]
+    added = [f"added-{i:08d}" for i in range(samples)]
+    listings = min(samples, LISTING_SAMPLES)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        warehouse = Warehouse(os.path.join(tmp, "suite.db"), PERFORMANCE_PROFILE, cache_size=0)
+        warehouse.db.bulk_upsert(generate_products(rows))
+        warehouse.db.optimize(analyze=True)
+        phases = {
+            "add": (lambda name=name: warehouse.add_product(name, 9.99, 1) for name in added),
+            "update": (lambda name=name, i=i: warehouse.update_product(name, i / 100, i)
+                       for i, name in enumerate(existing)),
+            "lookup": (lambda name=name: warehouse.get_product_by_name(name)
+                       for name in existing),
+            "search": (lambda name=name: warehouse.find_products_by_partial_name(name[-6:])
+                       for name in existing),
+            "list_by_name": (lambda: sum(1 for _ in warehouse.iter_products(ORDER_BY_NAME))
+                             for _ in range(listings)),
+            "list_by_price": (lambda: sum(1 for _ in warehouse.iter_products(ORDER_BY_PRICE))
+                              for _ in range(listings)),
+            "delete": (lambda name=name: warehouse.delete_product(name) for name in added),
+        }
+        results = {operation: summarize(time_calls(phases[operation]))
+                   for operation in SUITE_OPERATIONS}
+        warehouse.close()
+    return results
+
+
+def compare_results(baseline: Dict, current: Dict, tolerance: float) -> List[str]:
+    """
+    List the operations whose p95 latency grew by more than tolerance
+    (and by at least MIN_REGRESSION_MS).
+
+    Only catalogue sizes and operations present in both result sets are compared.
+    """
+    regressions = []
+    for size, operations in current["results"].items():
+        for operation, stats in operations.items():
+            before = baseline["results"].get(size, {}).get(operation)
+            if (before and stats["p95_ms"] > before["p95_ms"] * (1 + tolerance)
+                    and stats["p95_ms"] - before["p95_ms"] >= MIN_REGRESSION_MS):
+                regressions.append(f"{operation} at {size} rows: p95 {before['p95_ms']:.3f} ms "
+                                   f"-> {stats['p95_ms']:.3f} ms")
+    return regressions
+
+
+def main_suite(args) -> int:
+    """Run the latency suite, print it, and write or compare JSON results."""
+    results = {
+        "version": RESULTS_VERSION,
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "python": platform.python_version(),
+        "sqlite": sqlite3.sqlite_version,
+        "platform": platform.platform(),
+        "samples": args.samples,
+        "seed": args.seed,
+        "results": {},
+    }
+    for rows in args.sizes:
+        print(f"Latency suite, {rows} products")
+        print(f"  {'operation':<14} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'ops/s':>11}")
+        suite = run_suite(rows, args.samples, args.seed)
+        for operation, stats in suite.items():
+            print(f"  {operation:<14} {stats['p50_ms']:9.3f} {stats['p95_ms']:9.3f} "
+                  f"{stats['p99_ms']:9.3f} {stats['ops_per_second']:11.1f}")
+        results["results"][str(rows)] = suite
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+        print(f"Results written to {args.json}")
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)
+        regressions = compare_results(baseline, results, args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION: {regression}")
+        if regressions:
+            return 1
+        print(f"No p95 regressions above {args.tolerance:.0%} against {args.compare}")
+    return 0
+
+
+def main():
+    """Run the benchmarks and print a summary."""
+    parser = argparse.ArgumentParser(description="Benchmark the warehouse layer")
+    parser.add_argument("--rows", type=int, default=DEFAULT_ROWS,
+                        help=f"number of products to generate (default: {DEFAULT_ROWS})")
+    parser.add_argument("--threads", type=int, default=DEFAULT_THREADS,
+                        help=f"worker threads for the concurrency run (default: {DEFAULT_THREADS})")
+    parser.add_argument("--operations", type=int, default=DEFAULT_OPERATIONS,
+                        help=f"operations per worker thread (default: {DEFAULT_OPERATIONS})")
+    parser.add_argument("--suite", action="store_true",
+                        help="run the per-operation latency suite instead of the comparisons")
+    parser.add_argument("--sizes", type=int, nargs="+", default=list(DEFAULT_SUITE_SIZES),
+                        help="catalogue sizes for the suite, e.g. 10000 1000000 10000000")
+    parser.add_argument("--samples", type=int, default=DEFAULT_SAMPLES,
+                        help=f"timed calls per operation in the suite (default: {DEFAULT_SAMPLES})")
+    parser.add_argument("--seed", type=int, default=0,
+                        help="seed for the products the suite touches (default: 0)")
+    parser.add_argument("--json", metavar="FILE", help="write the suite results to FILE")
+    parser.add_argument("--compare", metavar="FILE",
+                        help="compare the suite with earlier --json results and exit with "
+                             "status 1 on a p95 regression")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE,
+                        help=f"allowed relative p95 slowdown (default: {DEFAULT_TOLERANCE})")
+    args = parser.parse_args()
+    if args.suite:
+        if args.samples <= 0 or min(args.sizes) <= 0:
+            parser.error("--samples and --sizes must be positive")
+        return main_suite(args)
+
+    per_row, bulk = benchmark_bulk_import(args.rows)
+    print(f"Import of {args.rows} products")
+    print(f"  per-row add_product: {per_row:8.3f} s ({args.rows / per_row:12.0f} rows/s)")
+    print(f"  bulk_upsert:         {bulk:8.3f} s ({args.rows / bulk:12.0f} rows/s)")
+    print(f"  speedup:             {per_row / bulk:8.1f}x")
+
+    like, indexed = benchmark_search(args.rows)
+    print(f"Substring search over {args.rows} products")
+    print(f"  LIKE scan:     {like * 1000:8.3f} ms/query")
+    print(f"  trigram index: {indexed * 1000:8.3f} ms/query")
+
+    print(f"Export and import of {args.rows} products")
+    for extension, (exported, imported, size) in benchmark_export(args.rows).items():
+        print(f"  {extension:<6} export {args.rows / exported:10.0f} rows/s, "
+              f"import {args.rows / imported:10.0f} rows/s, {size / 1e6:8.2f} MB")
+
+    print(f"Listings of {args.rows} products, SQLite vs in-memory mirror")
+    for label, (sqlite_time, mirror_time) in benchmark_mirror(args.rows).items():
+        print(f"  {label:<14} {sqlite_time * 1000:9.3f} ms vs {mirror_time * 1000:9.3f} ms "
+              f"({sqlite_time / mirror_time:6.1f}x)")
+
+    elapsed, reads, writes = benchmark_concurrent(args.rows, args.threads, args.operations)
+    print(f"Concurrent workload, {args.threads} threads")
+    print(f"  reads:  {reads:8d} ({reads / elapsed:10.0f} ops/s)")
+    print(f"  writes: {writes:8d} ({writes / elapsed:10.0f} ops/s)")
+
+    write_rows = min(args.rows, 5_000)
+    print(f"Concurrent single-row inserts of {write_rows} products, {args.threads} threads")
+    timings = benchmark_sharded_writes(write_rows, args.threads)
+    for shards, elapsed in timings.items():
+        print(f"  {shards} shard(s): {write_rows / elapsed:10.0f} rows/s "
+              f"({timings[SHARD_COUNTS[0]] / elapsed:5.2f}x)")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,19 +1,568 @@
 # db.py - Database Layer
+import csv
+import functools
+import heapq
+import json
+import math
+import operator
+import os
 import sqlite3
-from typing import List, Tuple, Optional
+import struct
+import sys
+import threading
+import time
+import types
+import zlib
+from array import array
+from bisect import bisect_left, bisect_right, insort
+from collections import OrderedDict
+from contextlib import ExitStack, contextmanager
+from decimal import ROUND_HALF_UP, Decimal, InvalidOperation
+from fractions import Fraction
+from itertools import chain, islice
+from typing import (
+    Any, AsyncIterator, Callable, Collection, Dict, Hashable, Iterable, Iterator, List, NamedTuple, Tuple, Optional, Union,
+    TYPE_CHECKING,
+)
+from urllib.parse import quote
+
+# asyncio, concurrent.futures and multiprocessing are only needed by the async facade
+# and the sharded backend, and the interactive menu lives in warehouse_ui, so
+# they are imported where those start up; the command line interface stays
+# fast to launch without them
+if TYPE_CHECKING:
+    from concurrent.futures import Future
+
+# Number of rows written per transaction by the bulk import path
+DEFAULT_BATCH_SIZE = 10_000
+
+# Number of rows fetched per query by the streaming listings
+DEFAULT_PAGE_SIZE = 1000
+
+# Sort keys accepted by the streaming listings
+ORDER_BY_NAME = "name"
+ORDER_BY_PRICE = "price"
+
+# File formats understood by the exporters and importers
+FORMAT_CSV = "csv"
+FORMAT_JSONL = "jsonl"
+FORMAT_COLUMNAR = "columnar"
+FORMAT_EXTENSIONS = {".csv": FORMAT_CSV, ".jsonl": FORMAT_JSONL, ".wcol": FORMAT_COLUMNAR}
+CSV_HEADER = ("name", "price", "amount")
+
+# Columnar file layout: the magic bytes, then row groups each starting with a
+# little-endian uint32 row count (0 ends the file) followed by the name byte
+# lengths (uint32), the UTF-8 names, the prices in cents (int64) and the
+# amounts (int64), each column stored as one contiguous array
+COLUMNAR_MAGIC = b"WHCOL\x01"
+COLUMNAR_GROUP_SIZE = 65_536
+COLUMNAR_COUNT = struct.Struct("<I")
+
+# Buffer size for the exporters and importers
+FILE_BUFFER_SIZE = 1024 * 1024
+
+# Names looked up per query by get_products_by_names, well below SQLite's
+# limit on bound parameters
+NAMES_PER_QUERY = 500
+
+# Prepared statements kept per connection; every query() shape maps to one
+# fixed SQL text, so each shape is prepared once per connection
+STATEMENT_CACHE_SIZE = 256
+
+# Highest Unicode code point, used to compute name prefix upper bounds
+MAX_CODE_POINT = 0x10FFFF
+
+# Surrogate code points cannot be encoded to UTF-8, so a prefix bound skips them
+SURROGATE_FIRST = 0xD800
+SURROGATE_LAST = 0xDFFF
+
+
+class QueryShape(NamedTuple):
+    """Which filters a query() call uses; calls of the same shape share SQL."""
+    price_min: bool
+    price_max: bool
+    amount_min: bool
+    name_prefix: bool
+    prefix_bounded: bool
+    order_by: str
+    limit: bool
+
+
+@functools.lru_cache(maxsize=None)
+def compile_query(shape: QueryShape) -> str:
+    """Build the parameterized SQL for a query shape."""
+    conditions = []
+    if shape.price_min:
+        conditions.append('price >= ?')
+    if shape.price_max:
+        conditions.append('price <= ?')
+    if shape.amount_min:
+        conditions.append('amount >= ?')
+    if shape.name_prefix:
+        conditions.append('name >= ?')
+        if shape.prefix_bounded:
+            conditions.append('name < ?')
+    sql = 'SELECT name, price, amount FROM products'
+    if conditions:
+        sql += ' WHERE ' + ' AND '.join(conditions)
+    sql += ' ORDER BY name' if shape.order_by == ORDER_BY_NAME else ' ORDER BY price, name'
+    if shape.limit:
+        sql += ' LIMIT ?'
+    return sql
+
+
+def prefix_upper_bound(prefix: str) -> Optional[str]:
+    """Return the smallest string greater than every string starting with prefix."""
+    stripped = prefix.rstrip(chr(MAX_CODE_POINT))
+    if not stripped:
+        return None
+    following = ord(stripped[-1]) + 1
+    if SURROGATE_FIRST <= following <= SURROGATE_LAST:
+        following = SURROGATE_LAST + 1
+    return stripped[:-1] + chr(following)
+
+
+class BatchResult(NamedTuple):
+    """Row counts for one committed batch of a bulk upsert."""
+    batch: int
+    inserted: int
+    updated: int
+    rejected: int
+
+
+class MovementBatchResult(NamedTuple):
+    """Row counts for one committed batch of stock movements."""
+    batch: int
+    applied: int
+    rejected: int
+
+
+# Rowid for a new product: above every id the stock ledger still refers to,
+# so the kept history of a deleted product never passes to a new one
+NEXT_PRODUCT_ID_SQL = '''(SELECT MAX(id) + 1 FROM (
+    SELECT COALESCE(MAX(id), 0) AS id FROM products
+    UNION ALL SELECT COALESCE(MAX(product_id), 0) FROM stock_movements))'''
+
+
+class MovementSummary(NamedTuple):
+    """Stock movement totals of one product over one day (UTC, YYYY-MM-DD)."""
+    period: str
+    inbound: int
+    outbound: int
+    movements: int
+
+
+# Operations recorded in the product changelog
+CHANGE_INSERT = "I"
+CHANGE_UPDATE = "U"
+CHANGE_DELETE = "D"
+
+# Number of changelog entries fetched per query by changes_since()
+CHANGE_PAGE_SIZE = 1000
+
+
+# Changelog position: a sequence number, or for a ShardedWarehouseDB one
+# sequence number per shard
+ChangeSeq = Union[int, Tuple[int, ...]]
+
+
+class Change(NamedTuple):
+    """
+    One entry of the product changelog.
+
+    price and amount hold the product's values after the change, or None
+    for a delete. seq is the position to resume from after applying it.
+    """
+    seq: ChangeSeq
+    op: str
+    name: str
+    price: Union[int, "Money", None]
+    amount: Optional[int]
+
+
+# Location holding every unit of a product that no other location holds;
+# it exists in every database and cannot be removed
+DEFAULT_LOCATION = "main"
+DEFAULT_LOCATION_ID = 1
+
+
+class LocationSummary(NamedTuple):
+    """Totals of one stock location; value in the caller's unit."""
+    location: str
+    products: int
+    units: int
+    total_value: Union[int, "Money"]
+
+
+# (name, price, amount) rows of the products a location holds, with the
+# amount held there; a location has rows only for products ever stocked there
+LOCATION_PRODUCTS_SQL = '''SELECT p.name, p.price, s.amount
+    FROM location_stock s JOIN products p ON p.id = s.product_id
+    WHERE s.location_id = (SELECT id FROM locations WHERE name = ?)'''
+
+
+# Database pages copied per online backup step (4 MiB with 4 KiB pages)
+DEFAULT_BACKUP_PAGES = 1024
+
+# Backup file offered by the user interface
+DEFAULT_BACKUP_FILE = "warehouse-backup.db"
+
+
+class BackupResult(NamedTuple):
+    """Size and duration of a completed online backup."""
+    pages: int
+    bytes: int
+    seconds: float
+    bytes_per_second: float
+
+
+class PerformanceProfile(NamedTuple):
+    """
+    Connection-level SQLite tuning applied when a WarehouseDB is opened.
+
+    Attributes:
+        journal_mode: Journal mode, e.g. "DELETE" or "WAL"; None keeps
+            whatever mode the database file already uses
+        synchronous: Sync level: "OFF", "NORMAL", "FULL" or "EXTRA"
+        cache_size: Page cache size in pages, or in KiB when negative
+        mmap_size: Bytes of the database file to memory-map (0 disables)
+        temp_store: Where temporary tables live: "DEFAULT", "FILE" or "MEMORY"
+        busy_timeout: Milliseconds to wait on a locked database
+        optimize_on_close: Run PRAGMA optimize before closing the connection
+    """
+    journal_mode: Optional[str] = None
+    synchronous: str = "FULL"
+    cache_size: int = -2000
+    mmap_size: int = 0
+    temp_store: str = "DEFAULT"
+    busy_timeout: int = 5000
+    optimize_on_close: bool = True
+
+
+# SQLite's stock settings: fully synchronous commits, and the journal mode
+# left as the file has it, so opening a WAL database does not switch it back
+DEFAULT_PROFILE = PerformanceProfile()
+
+# Concurrent readers with a single writer: WAL journal, relaxed syncing,
+# 64 MiB page cache and a 256 MiB memory map
+PERFORMANCE_PROFILE = PerformanceProfile(
+    journal_mode="WAL",
+    synchronous="NORMAL",
+    cache_size=-64_000,
+    mmap_size=256 * 1024 * 1024,
+    temp_store="MEMORY",
+)
+
+# Allowed values for the textual pragmas, which cannot be bound as parameters
+JOURNAL_MODES = ("DELETE", "TRUNCATE", "PERSIST", "MEMORY", "WAL", "OFF")
+SYNCHRONOUS_LEVELS = ("OFF", "NORMAL", "FULL", "EXTRA")
+TEMP_STORES = ("DEFAULT", "FILE", "MEMORY")
+
+# Upper bound on rows sampled per index when PRAGMA optimize runs ANALYZE
+ANALYSIS_LIMIT = 1000
+
+# The trigram tokenizer only indexes terms of at least this many characters;
+# shorter search terms fall back to a LIKE scan
+MIN_TRIGRAM_TERM_LENGTH = 3
+
+
+class InventorySummary(NamedTuple):
+    """Totals over the whole catalogue; prices and value in the caller's unit."""
+    products: int
+    units: int
+    total_value: Union[int, "Money"]
+    min_price: Union[int, "Money", None]
+    max_price: Union[int, "Money", None]
+
+
+class HistogramBin(NamedTuple):
+    """Products whose price lies in [low, high); the last bin includes high."""
+    low: float
+    high: float
+    products: int
+    units: int
+
+
+# Statements slower than this are written to the slow-query log
+DEFAULT_SLOW_QUERY_MS = 100.0
+
+# Logger receiving slow-query and failed-statement records
+SLOW_QUERY_LOGGER = "warehouse_db.slow_queries"
+
+# Statements whose query plan is captured; DDL and pragmas have none
+PLANNED_STATEMENTS = ("SELECT", "INSERT", "UPDATE", "DELETE", "WITH")
+
+
+class StatementStats(NamedTuple):
+    """Counters for one distinct SQL statement."""
+    sql: str
+    calls: int
+    rows: int
+    errors: int
+    slow: int
+    total_ms: float
+    max_ms: float
+    plan: Tuple[str, ...]
+
+
+class QueryStats(NamedTuple):
+    """Totals over every statement, plus per-statement counters by total time."""
+    calls: int
+    rows: int
+    errors: int
+    slow: int
+    total_ms: float
+    statements: List[StatementStats]
+
+
+class QueryInstrumentation:
+    """
+    Opt-in per-statement timing for WarehouseDB connections.
+
+    Pass one to WarehouseDB (or Warehouse) and every statement run on its
+    connections is timed from execute until its rows are fetched. Each
+    distinct statement's query plan is captured the first time it runs.
+    Executions over the threshold, and failed statements, are logged to
+    SLOW_QUERY_LOGGER as one JSON object per record.
+    An instance is thread-safe and may be shared by several databases.
+    """
+
+    def __init__(self, slow_query_ms: float = DEFAULT_SLOW_QUERY_MS, capture_plans: bool = True):
+        """
+        Args:
+            slow_query_ms: Log executions taking at least this many milliseconds
+            capture_plans: Run EXPLAIN QUERY PLAN once per distinct statement
+        """
+        # logging is only loaded once instrumentation is switched on
+        import logging
+
+        self.slow_query_seconds = slow_query_ms / 1000
+        self.capture_plans = capture_plans
+        self.logger = logging.getLogger(SLOW_QUERY_LOGGER)
+        self._lock = threading.Lock()
+        self._statements: Dict[str, list] = {}
+        self._plans: Dict[str, Tuple[str, ...]] = {}
+
+    def _plan(self, conn: sqlite3.Connection, sql: str, params) -> Tuple[str, ...]:
+        """Return the cached query plan of a statement, capturing it on first use."""
+        plan = self._plans.get(sql)
+        if plan is None:
+            plan = ()
+            if self.capture_plans and sql.lstrip().upper().startswith(PLANNED_STATEMENTS):
+                try:
+                    rows = conn.cursor(sqlite3.Cursor).execute(
+                        f'EXPLAIN QUERY PLAN {sql}', params).fetchall()
+                    plan = tuple(row[-1] for row in rows)
+                except sqlite3.Error:
+                    pass
+            self._plans[sql] = plan
+        return plan
+
+    def record(self, conn: sqlite3.Connection, sql: str, params, seconds: float, rows: int,
+               error: Optional[BaseException] = None):
+        """Count one finished execution and log it if it was slow or failed."""
+        slow = seconds >= self.slow_query_seconds
+        plan = self._plan(conn, sql, params) if error is None else ()
+        with self._lock:
+            counters = self._statements.setdefault(sql, [0, 0, 0, 0, 0.0, 0.0])
+            counters[0] += 1
+            counters[1] += rows
+            counters[2] += error is not None
+            counters[3] += slow
+            counters[4] += seconds
+            counters[5] = max(counters[5], seconds)
+        if slow or error is not None:
+            record = {
+                "event": "failed_query" if error is not None else "slow_query",
+                "sql": " ".join(sql.split()),
+                "params": [p if isinstance(p, (int, float, str)) or p is None else repr(p)
+                           for p in (params if isinstance(params, (list, tuple)) else ())],
+                "ms": round(seconds * 1000, 3),
+                "rows": rows,
+                "plan": list(plan),
+            }
+            if error is not None:
+                record["error"] = str(error)
+            self.logger.warning(json.dumps(record), extra={"query": record})
+
+    def stats(self) -> QueryStats:
+        """Return the counters collected so far."""
+        with self._lock:
+            statements = [
+                StatementStats(sql, calls, rows, errors, slow, total * 1000, longest * 1000,
+                               self._plans.get(sql, ()))
+                for sql, (calls, rows, errors, slow, total, longest) in self._statements.items()
+            ]
+        statements.sort(key=lambda s: s.total_ms, reverse=True)
+        return QueryStats(sum(s.calls for s in statements), sum(s.rows for s in statements),
+                          sum(s.errors for s in statements), sum(s.slow for s in statements),
+                          sum(s.total_ms for s in statements), statements)
+
+    def reset(self):
+        """Forget all counters; captured plans are kept."""
+        with self._lock:
+            self._statements.clear()
+
+
+class InstrumentedCursor(sqlite3.Cursor):
+    """
+    Cursor that reports each statement to its connection's QueryInstrumentation.
+
+    SQLite produces rows lazily, so an execution is timed across execute and
+    the fetches that follow. It is recorded once its rows are exhausted, the
+    next statement starts, or the cursor goes away.
+    """
+
+    def __init__(self, connection: "InstrumentedConnection"):
+        super().__init__(connection)
+        self._pending = None
+
+    def _finish(self):
+        pending, self._pending = self._pending, None
+        if pending is not None:
+            sql, params, seconds, rows = pending
+            if self.description is None:
+                rows = max(self.rowcount, 0)
+            self.connection.instrumentation.record(self.connection, sql, params, seconds, rows)
+
+    def _run(self, method: Callable, sql: str, params, first_params):
+        self._finish()
+        start = time.perf_counter()
+        try:
+            method(sql, params)
+        except Exception as e:
+            self.connection.instrumentation.record(self.connection, sql, first_params,
+                                                   time.perf_counter() - start, 0, e)
+            raise
+        self._pending = (sql, first_params, time.perf_counter() - start, 0)
+        if self.description is None:
+            self._finish()
+        return self
+
+    def execute(self, sql: str, parameters=()):
+        return self._run(super().execute, sql, parameters, parameters)
+
+    def executemany(self, sql: str, seq_of_parameters):
+        # The plan only needs one set of parameters, so keep the first
+        seq_of_parameters = iter(seq_of_parameters)
+        first = next(seq_of_parameters, None)
+        if first is None:
+            return self._run(super().executemany, sql, [], ())
+        return self._run(super().executemany, sql, chain((first,), seq_of_parameters), first)
+
+    def _fetched(self, start: float, rows: int, exhausted: bool):
+        if self._pending is not None:
+            sql, params, seconds, count = self._pending
+            self._pending = (sql, params, seconds + time.perf_counter() - start, count + rows)
+            if exhausted:
+                self._finish()
+
+    def fetchone(self):
+        start = time.perf_counter()
+        row = super().fetchone()
+        self._fetched(start, row is not None, row is None)
+        return row
+
+    def fetchmany(self, size: Optional[int] = None):
+        start = time.perf_counter()
+        size = self.arraysize if size is None else size
+        rows = super().fetchmany(size)
+        self._fetched(start, len(rows), len(rows) < size)
+        return rows
+
+    def fetchall(self):
+        start = time.perf_counter()
+        rows = super().fetchall()
+        self._fetched(start, len(rows), True)
+        return rows
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        row = self.fetchone()
+        if row is None:
+            raise StopIteration
+        return row
+
+    def close(self):
+        self._finish()
+        super().close()
+
+    def __del__(self):
+        try:
+            self._finish()
+        except Exception:
+            pass
+
+
+class InstrumentedConnection(sqlite3.Connection):
+    """Connection whose cursors are InstrumentedCursors; set instrumentation after connecting."""
+    instrumentation: QueryInstrumentation
+
+    def cursor(self, factory=None):
+        return super().cursor(factory or InstrumentedCursor)
+
+    def execute(self, sql: str, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql: str, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
 
 class WarehouseDB:
-    def __init__(self, db_name: str = "warehouse.db"):
+    def __init__(self, db_name: str = "warehouse.db",
+                 profile: PerformanceProfile = DEFAULT_PROFILE,
+                 pooled: bool = False,
+                 instrumentation: Optional[QueryInstrumentation] = None,
+                 read_only: bool = False):
+        """
+        Open the warehouse database.
+
+        Args:
+            db_name: Path of the SQLite database file
+            profile: Connection tuning applied to every connection
+            pooled: Give each thread its own read connection and serialize
+                writes through one shared writer connection, so the instance
+                can be used from many threads (best combined with WAL)
+            instrumentation: Time every statement on this database's
+                connections, see QueryInstrumentation; None adds no overhead
+            read_only: Open an existing file for reading only, without creating
+                or migrating the schema and without changing its journal mode
+        """
+        if pooled and db_name == ":memory:":
+            raise ValueError("Pooled mode needs a database file, not :memory:")
         self.db_name = db_name
+        self.profile = profile
+        self.pooled = pooled
+        self.instrumentation = instrumentation
+        self.read_only = read_only
         self.conn = None
         self.cursor = None
+        self.fts_enabled = False
+        self._write_lock = threading.RLock()
+        self._local = threading.local()
+        self._readers: List[sqlite3.Connection] = []
+        self._readers_lock = threading.Lock()
+        self._transaction_depth = 0
+        self._transaction_failed = False
+        self._transaction_owner: Optional[int] = None
         self.initialize()
 
     def initialize(self):
         """Initialize the database connection and create tables if they don't exist."""
-        self.conn = sqlite3.connect(self.db_name)
+        self.conn = self._connect()
         self.cursor = self.conn.cursor()
-        
+        if self.read_only:
+            self.cursor.execute(
+                "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'products_fts'")
+            self.fts_enabled = self.cursor.fetchone() is not None
+            return
+        self._create_schema()
+        self.conn.commit()
+
+    def _create_schema(self):
+        """Create or upgrade every table, index and trigger the warehouse uses."""
         # Create table if it doesn't exist
         self.cursor.execute('''
         CREATE TABLE IF NOT EXISTS products (
@@ -26,385 +575,3663 @@ class WarehouseDB:
         
         # Create indexes for efficient queries
         self.cursor.execute('CREATE INDEX IF NOT EXISTS idx_products_name ON products (name)')
-        self.cursor.execute('CREATE INDEX IF NOT EXISTS idx_products_price ON products (price)')
+
+        # Covering indexes for the analytics queries, so they never touch the table
+        # (price, name, amount) also serves every lookup by price, which makes a
+        # plain price index redundant
+        self.cursor.execute('DROP INDEX IF EXISTS idx_products_price')
+        self.cursor.execute('DROP INDEX IF EXISTS idx_products_price_amount')
+        self.cursor.execute(
+            'CREATE INDEX IF NOT EXISTS idx_products_price_covering ON products (price, name, amount)')
+        self.cursor.execute(
+            'CREATE INDEX IF NOT EXISTS idx_products_amount ON products (amount, name, price)')
+        self.cursor.execute(
+            'CREATE INDEX IF NOT EXISTS idx_products_value ON products (price * amount)')
         
-        self.conn.commit()
+        self.fts_enabled = self._create_search_index()
+        reconcile_locations = self._create_stock_ledger()
+        self._create_changelog()
+        self._create_locations(reconcile_locations)
 
-    def close(self):
-        """Close the database connection."""
-        if self.conn:
-            self.conn.commit()
-            self.conn.close()
-            self.conn = None
-            self.cursor = None
+    def _create_stock_ledger(self):
+        """
+        Create the append-only stock movement ledger.
 
-    def add_product(self, name: str, price: int, amount: int) -> bool:
-        """Add a new product to the database."""
-        try:
+        Inserting a movement is the only way the ledger changes: triggers
+        refuse movements that would make stock negative, apply the delta to
+        products.amount and fold it into the per-day totals, so stock levels
+        and period summaries are single-row reads.
+
+        Writes that set amount outright (new, updated and deleted products)
+        are logged too, as 'set' movements the triggers do not apply again,
+        so the deltas of a product always sum to its stock. Every movement
+        names its location, and transfers are logged as a pair of 'transfer'
+        movements, so the deltas per location sum to location_stock as well.
+        The history of a deleted product is kept.
+
+        Returns:
+            bool: True if the ledger is new or just gained its location column,
+            so _create_locations() must reconcile it with the stock per location
+        """
+        self.cursor.execute('SELECT name FROM pragma_table_info(?)', ('stock_movements',))
+        columns = {row[0] for row in self.cursor.fetchall()}
+        if columns and 'kind' not in columns:
+            # A ledger from before overwrites were logged: add the column and
+            # replace the triggers that predate it
+            self.cursor.execute(
+                "ALTER TABLE stock_movements ADD COLUMN kind TEXT NOT NULL DEFAULT 'move'")
+            for trigger in ('stock_movements_check', 'stock_movements_apply',
+                            'stock_movements_no_delete', 'products_ledger_delete'):
+                self.cursor.execute(f'DROP TRIGGER IF EXISTS {trigger}')
+        if columns and 'location_id' not in columns:
+            # A ledger from before movements named their location
             self.cursor.execute(
-                'INSERT INTO products (name, price, amount) VALUES (?, ?, ?)',
-                (name, price, amount)
+                'ALTER TABLE stock_movements ADD COLUMN location_id INTEGER NOT NULL '
+                f'DEFAULT {DEFAULT_LOCATION_ID}')
+            for trigger in ('stock_movements_apply', 'products_ledger_delete',
+                            'products_locations_delete'):
+                self.cursor.execute(f'DROP TRIGGER IF EXISTS {trigger}')
+
+        # kind is 'move' for adjustments, which the triggers apply to
+        # products.amount, 'set' for a write that already changed it, or
+        # 'transfer' for one leg of a move between locations
+        self.cursor.execute(f'''
+        CREATE TABLE IF NOT EXISTS stock_movements (
+            id INTEGER PRIMARY KEY,
+            product_id INTEGER NOT NULL,
+            delta INTEGER NOT NULL,
+            created_at INTEGER NOT NULL,
+            kind TEXT NOT NULL DEFAULT 'move',
+            location_id INTEGER NOT NULL DEFAULT {DEFAULT_LOCATION_ID}
+        )
+        ''')
+        self.cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_stock_movements_product
+        ON stock_movements (product_id, created_at)
+        ''')
+        self.cursor.execute('''
+        CREATE TABLE IF NOT EXISTS stock_movement_totals (
+            product_id INTEGER NOT NULL,
+            period TEXT NOT NULL,
+            inbound INTEGER NOT NULL,
+            outbound INTEGER NOT NULL,
+            movements INTEGER NOT NULL,
+            PRIMARY KEY (product_id, period)
+        ) WITHOUT ROWID
+        ''')
+        self.cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS stock_movements_check BEFORE INSERT ON stock_movements
+        WHEN new.kind = 'move'
+            AND (SELECT amount FROM products WHERE id = new.product_id) + new.delta < 0
+        BEGIN
+            SELECT RAISE(ABORT, 'insufficient stock');
+        END
+        ''')
+        self.cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS stock_movements_apply AFTER INSERT ON stock_movements
+        BEGIN
+            UPDATE products SET amount = amount + new.delta
+            WHERE id = new.product_id AND new.kind = 'move';
+            INSERT INTO stock_movement_totals (product_id, period, inbound, outbound, movements)
+            SELECT new.product_id, date(new.created_at, 'unixepoch'),
+                   max(new.delta, 0), max(-new.delta, 0), 1
+            WHERE new.kind != 'transfer'
+            ON CONFLICT (product_id, period) DO UPDATE SET
+                inbound = inbound + excluded.inbound,
+                outbound = outbound + excluded.outbound,
+                movements = movements + 1;
+        END
+        ''')
+        self.cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS stock_movements_no_update BEFORE UPDATE ON stock_movements
+        BEGIN
+            SELECT RAISE(ABORT, 'stock_movements is append-only');
+        END
+        ''')
+        self.cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS stock_movements_no_delete BEFORE DELETE ON stock_movements
+        BEGIN
+            SELECT RAISE(ABORT, 'stock_movements is append-only');
+        END
+        ''')
+
+        # Log the amounts written directly; they change the default location.
+        # Every such write also sets price, while stock_movements_apply sets
+        # only amount, so keying the update trigger on price keeps applied
+        # movements from being logged twice. products_locations_delete logs
+        # the stock a deleted product leaves at each location.
+        self.cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS products_ledger_insert AFTER INSERT ON products
+        WHEN new.amount != 0
+        BEGIN
+            INSERT INTO stock_movements (product_id, delta, created_at, kind)
+            VALUES (new.id, new.amount, CAST(strftime('%s', 'now') AS INTEGER), 'set');
+        END
+        ''')
+        self.cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS products_ledger_update AFTER UPDATE OF price ON products
+        WHEN new.amount != old.amount
+        BEGIN
+            INSERT INTO stock_movements (product_id, delta, created_at, kind)
+            VALUES (new.id, new.amount - old.amount, CAST(strftime('%s', 'now') AS INTEGER), 'set');
+        END
+        ''')
+        if 'kind' not in columns:
+            # Open a new or migrated ledger with the stock it never saw
+            self.cursor.execute('''
+            INSERT INTO stock_movements (product_id, delta, created_at, kind)
+            SELECT p.id, p.amount - COALESCE(SUM(m.delta), 0),
+                   CAST(strftime('%s', 'now') AS INTEGER), 'set'
+            FROM products p LEFT JOIN stock_movements m ON m.product_id = p.id
+            GROUP BY p.id
+            HAVING p.amount != COALESCE(SUM(m.delta), 0)
+            ''')
+        return 'location_id' not in columns
+
+    def _create_changelog(self):
+        """
+        Create the change-data-capture log of the products table.
+
+        Triggers append one row per inserted, updated or deleted product with
+        the row's new values. AUTOINCREMENT keeps seq strictly increasing even
+        after compaction deletes the newest entries, so a consumer's last seen
+        seq stays a valid resume point.
+        """
+        self.cursor.execute('''
+        CREATE TABLE IF NOT EXISTS product_changes (
+            seq INTEGER PRIMARY KEY AUTOINCREMENT,
+            op TEXT NOT NULL,
+            name TEXT NOT NULL,
+            price INTEGER,
+            amount INTEGER
+        )
+        ''')
+        self.cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS products_changelog_insert AFTER INSERT ON products
+        BEGIN
+            INSERT INTO product_changes (op, name, price, amount)
+            VALUES ('{CHANGE_INSERT}', new.name, new.price, new.amount);
+        END
+        ''')
+        # Upserts that rewrite identical values are not changes; a rename is
+        # logged as a delete of the old name and an insert of the new one
+        self.cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS products_changelog_update AFTER UPDATE ON products
+        WHEN old.name IS NOT new.name OR old.price IS NOT new.price
+            OR old.amount IS NOT new.amount
+        BEGIN
+            INSERT INTO product_changes (op, name, price, amount)
+            SELECT '{CHANGE_DELETE}', old.name, NULL, NULL WHERE old.name IS NOT new.name;
+            INSERT INTO product_changes (op, name, price, amount)
+            VALUES (CASE WHEN old.name IS new.name THEN '{CHANGE_UPDATE}'
+                         ELSE '{CHANGE_INSERT}' END,
+                    new.name, new.price, new.amount);
+        END
+        ''')
+        self.cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS products_changelog_delete AFTER DELETE ON products
+        BEGIN
+            INSERT INTO product_changes (op, name, price, amount)
+            VALUES ('{CHANGE_DELETE}', old.name, NULL, NULL);
+        END
+        ''')
+
+    def _create_locations(self, reconcile_ledger: bool = False):
+        """
+        Create the stock locations and the per-location stock table.
+
+        products.amount stays the total across all locations. The default
+        location holds whatever the other locations do not, so writes that
+        only know the total keep working: a trigger moves every change of the
+        total into the default location. Each location row carries its
+        product count, units and stock value, kept current by triggers, so
+        per-location totals are single-row reads.
+
+        Args:
+            reconcile_ledger: Log the stock per location the movement ledger
+                has not seen, as transfers, see _create_stock_ledger()
+        """
+        self.cursor.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'location_stock'")
+        existed = self.cursor.fetchone() is not None
+
+        self.cursor.execute('''
+        CREATE TABLE IF NOT EXISTS locations (
+            id INTEGER PRIMARY KEY,
+            name TEXT NOT NULL UNIQUE,
+            products INTEGER NOT NULL DEFAULT 0,
+            units INTEGER NOT NULL DEFAULT 0,
+            value INTEGER NOT NULL DEFAULT 0
+        )
+        ''')
+        self.cursor.execute('INSERT OR IGNORE INTO locations (id, name) VALUES (?, ?)',
+                            (DEFAULT_LOCATION_ID, DEFAULT_LOCATION))
+        self.cursor.execute('''
+        CREATE TABLE IF NOT EXISTS location_stock (
+            location_id INTEGER NOT NULL,
+            product_id INTEGER NOT NULL,
+            amount INTEGER NOT NULL CHECK (amount >= 0),
+            PRIMARY KEY (location_id, product_id)
+        ) WITHOUT ROWID
+        ''')
+        # The primary key serves per-location listings; these serve
+        # per-product breakdowns and per-location low stock scans
+        self.cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_location_stock_product
+        ON location_stock (product_id, location_id)
+        ''')
+        self.cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_location_stock_amount
+        ON location_stock (location_id, amount)
+        ''')
+
+        self.cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS location_stock_insert AFTER INSERT ON location_stock
+        BEGIN
+            UPDATE locations SET
+                products = products + 1,
+                units = units + new.amount,
+                value = value + new.amount * (SELECT price FROM products WHERE id = new.product_id)
+            WHERE id = new.location_id;
+        END
+        ''')
+        self.cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS location_stock_update AFTER UPDATE OF amount ON location_stock
+        WHEN old.amount IS NOT new.amount
+        BEGIN
+            UPDATE locations SET
+                units = units + new.amount - old.amount,
+                value = value + (new.amount - old.amount)
+                    * (SELECT price FROM products WHERE id = new.product_id)
+            WHERE id = new.location_id;
+        END
+        ''')
+        self.cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS location_stock_delete AFTER DELETE ON location_stock
+        BEGIN
+            UPDATE locations SET
+                products = products - 1,
+                units = units - old.amount,
+                value = value - old.amount * (SELECT price FROM products WHERE id = old.product_id)
+            WHERE id = old.location_id;
+        END
+        ''')
+
+        self.cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS products_locations_insert AFTER INSERT ON products
+        BEGIN
+            INSERT INTO location_stock (location_id, product_id, amount)
+            VALUES ({DEFAULT_LOCATION_ID}, new.id, new.amount);
+        END
+        ''')
+        # One trigger in a fixed order: the stock is revalued at its current
+        # amounts first, then the change in the total lands in the default
+        # location at the new price. The CHECK on amount refuses totals below
+        # what the other locations hold.
+        self.cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS products_locations_update AFTER UPDATE ON products
+        WHEN old.price IS NOT new.price OR old.amount IS NOT new.amount
+        BEGIN
+            UPDATE locations SET value = value + (new.price - old.price) * (
+                SELECT amount FROM location_stock
+                WHERE location_id = locations.id AND product_id = new.id)
+            WHERE old.price IS NOT new.price
+                AND id IN (SELECT location_id FROM location_stock WHERE product_id = new.id);
+            UPDATE location_stock SET amount = new.amount - (
+                SELECT COALESCE(SUM(amount), 0) FROM location_stock
+                WHERE product_id = new.id AND location_id != {DEFAULT_LOCATION_ID})
+            WHERE old.amount IS NOT new.amount
+                AND location_id = {DEFAULT_LOCATION_ID} AND product_id = new.id;
+        END
+        ''')
+        # BEFORE, so the location totals can still look up the price; the
+        # ledger keeps what the product held at each location
+        self.cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS products_locations_delete BEFORE DELETE ON products
+        BEGIN
+            INSERT INTO stock_movements (product_id, delta, created_at, kind, location_id)
+            SELECT old.id, -amount, CAST(strftime('%s', 'now') AS INTEGER), 'set', location_id
+            FROM location_stock WHERE product_id = old.id AND amount != 0;
+            DELETE FROM location_stock WHERE product_id = old.id;
+        END
+        ''')
+
+        if not existed:
+            # Databases created before locations existed keep all their stock
+            # in the default location
+            self.cursor.execute(
+                'INSERT INTO location_stock (location_id, product_id, amount) '
+                'SELECT ?, id, amount FROM products',
+                (DEFAULT_LOCATION_ID,))
+        if reconcile_ledger:
+            # Stock that moved between locations before the ledger logged
+            # locations; the legs of each product sum to zero
+            self.cursor.execute('''
+            WITH ledger AS (
+                SELECT product_id, location_id, SUM(delta) AS amount
+                FROM stock_movements GROUP BY product_id, location_id
+            ), places AS (
+                SELECT product_id, location_id FROM ledger
+                UNION SELECT product_id, location_id FROM location_stock
             )
-            self.conn.commit()
-            return True
-        except sqlite3.IntegrityError:
-            return False
-        except Exception as e:
-            print(f"Error adding product: {e}")
-            return False
+            INSERT INTO stock_movements (product_id, delta, created_at, kind, location_id)
+            SELECT p.product_id, COALESCE(s.amount, 0) - COALESCE(l.amount, 0),
+                   CAST(strftime('%s', 'now') AS INTEGER), 'transfer', p.location_id
+            FROM places p
+            LEFT JOIN location_stock s USING (product_id, location_id)
+            LEFT JOIN ledger l USING (product_id, location_id)
+            WHERE p.product_id IN (SELECT id FROM products)
+                AND COALESCE(s.amount, 0) != COALESCE(l.amount, 0)
+            ''')
 
-    def update_product(self, name: str, price: int, amount: int) -> bool:
-        """Update an existing product."""
+    def _create_search_index(self) -> bool:
+        """
+        Create the trigram full-text index used for substring searches.
+
+        The index is an external-content FTS5 table kept in sync with products
+        by triggers, so it stores only the index and no copy of the names.
+
+        Returns:
+            bool: True if the index is available, False if this SQLite build
+            lacks FTS5 or the trigram tokenizer
+        """
+        exists = self.cursor.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'products_fts'"
+        ).fetchone()
         try:
-            self.cursor.execute(
-                'UPDATE products SET price = ?, amount = ? WHERE name = ?',
-                (price, amount, name)
+            self.cursor.execute('''
+            CREATE VIRTUAL TABLE IF NOT EXISTS products_fts USING fts5(
+                name, content='products', content_rowid='id', tokenize='trigram'
             )
-            self.conn.commit()
-            return self.cursor.rowcount > 0
-        except Exception as e:
-            print(f"Error updating product: {e}")
+            ''')
+        except sqlite3.OperationalError:
             return False
 
-    def delete_product(self, name: str) -> bool:
-        """Delete a product by name."""
+        self.cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS products_fts_insert AFTER INSERT ON products BEGIN
+            INSERT INTO products_fts (rowid, name) VALUES (new.id, new.name);
+        END
+        ''')
+        self.cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS products_fts_delete AFTER DELETE ON products BEGIN
+            INSERT INTO products_fts (products_fts, rowid, name) VALUES ('delete', old.id, old.name);
+        END
+        ''')
+        self.cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS products_fts_update AFTER UPDATE OF name ON products BEGIN
+            INSERT INTO products_fts (products_fts, rowid, name) VALUES ('delete', old.id, old.name);
+            INSERT INTO products_fts (rowid, name) VALUES (new.id, new.name);
+        END
+        ''')
+
+        # Index products that were stored before the search index existed
+        if not exists:
+            self.cursor.execute("INSERT INTO products_fts (products_fts) VALUES ('rebuild')")
+        return True
+
+    def _connect(self) -> sqlite3.Connection:
+        """Open a connection with the performance profile applied."""
+        database, uri = self.db_name, False
+        if self.read_only:
+            database, uri = f"file:{quote(os.path.abspath(self.db_name))}?mode=ro", True
+        if self.instrumentation is None:
+            conn = sqlite3.connect(database, check_same_thread=not self.pooled,
+                                   cached_statements=STATEMENT_CACHE_SIZE, uri=uri)
+        else:
+            conn = sqlite3.connect(database, check_same_thread=not self.pooled,
+                                   cached_statements=STATEMENT_CACHE_SIZE, uri=uri,
+                                   factory=InstrumentedConnection)
+            conn.instrumentation = self.instrumentation
         try:
-            self.cursor.execute('DELETE FROM products WHERE name = ?', (name,))
-            self.conn.commit()
-            return self.cursor.rowcount > 0
+            self._apply_profile(conn)
+        except Exception:
+            conn.close()
+            raise
+        return conn
+
+    def _reader(self) -> sqlite3.Connection:
+        """Return the connection the calling thread should read through."""
+        # Inside transaction() the owning thread reads its own uncommitted writes
+        if not self.pooled or self._transaction_owner == threading.get_ident():
+            return self.conn
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._connect()
+            self._local.conn = conn
+            with self._readers_lock:
+                self._readers.append(conn)
+        return conn
+
+    def _query(self, sql: str, params: Tuple = ()) -> List[tuple]:
+        """Run a read-only statement and return all result rows."""
+        return self._reader().execute(sql, params).fetchall()
+
+    def _query_one(self, sql: str, params: Tuple = ()) -> Optional[tuple]:
+        """Run a read-only statement and return its first result row."""
+        return self._reader().execute(sql, params).fetchone()
+
+    def _apply_profile(self, conn: sqlite3.Connection):
+        """Apply the performance profile's pragmas to a connection."""
+        profile = self.profile
+        journal_mode = profile.journal_mode.upper() if profile.journal_mode is not None else None
+        synchronous = profile.synchronous.upper()
+        temp_store = profile.temp_store.upper()
+        if journal_mode is not None and journal_mode not in JOURNAL_MODES:
+            raise ValueError(f"Invalid journal mode: {profile.journal_mode}")
+        if synchronous not in SYNCHRONOUS_LEVELS:
+            raise ValueError(f"Invalid synchronous level: {profile.synchronous}")
+        if temp_store not in TEMP_STORES:
+            raise ValueError(f"Invalid temp store: {profile.temp_store}")
+
+        # busy_timeout goes first so the journal mode switch can wait for locks
+        conn.execute(f'PRAGMA busy_timeout = {int(profile.busy_timeout)}')
+        if journal_mode is not None and not self.read_only:
+            conn.execute(f'PRAGMA journal_mode = {journal_mode}')
+        conn.execute(f'PRAGMA synchronous = {synchronous}')
+        conn.execute(f'PRAGMA cache_size = {int(profile.cache_size)}')
+        conn.execute(f'PRAGMA mmap_size = {int(profile.mmap_size)}')
+        conn.execute(f'PRAGMA temp_store = {temp_store}')
+
+    def optimize(self, analyze: bool = False):
+        """
+        Refresh the query planner statistics.
+
+        Args:
+            analyze: Run a full ANALYZE instead of the incremental PRAGMA optimize
+        """
+        try:
+            with self._write_lock:
+                if analyze:
+                    self.cursor.execute('ANALYZE')
+                else:
+                    self.cursor.execute(f'PRAGMA analysis_limit = {ANALYSIS_LIMIT}')
+                    self.cursor.execute('PRAGMA optimize')
+                self.conn.commit()
         except Exception as e:
-            print(f"Error deleting product: {e}")
-            return False
+            print(f"Error optimizing database: {e}")
+
+    def stats(self) -> Optional[QueryStats]:
+        """Return per-statement timings, or None when instrumentation is off."""
+        if self.instrumentation is None:
+            return None
+        return self.instrumentation.stats()
+
+    def backup(self, path: str, pages_per_step: int = DEFAULT_BACKUP_PAGES,
+               max_bytes_per_second: Optional[float] = None,
+               progress: Optional[Callable[[int, int], None]] = None
+               ) -> Optional[BackupResult]:
+        """
+        Copy the live database to path with the SQLite online backup API.
+
+        The copy runs in steps of pages_per_step pages through the writer
+        connection. The write lock is released between steps, so writers
+        keep going; their changes go through the same connection and are
+        copied along, so the backup never restarts. The copy is written
+        next to path and moved into place once complete.
+
+        Args:
+            path: File to write the backup to; an existing file is replaced
+            pages_per_step: Pages copied while holding the write lock
+            max_bytes_per_second: Throttle the copy to this rate, or None for
+                full speed
+            progress: Called after each step with (pages copied, total pages)
+
+        Returns:
+            Optional[BackupResult]: Size, duration and throughput, or None on error
+        """
+        if pages_per_step <= 0:
+            raise ValueError("pages_per_step must be positive")
+        if max_bytes_per_second is not None and max_bytes_per_second <= 0:
+            raise ValueError("max_bytes_per_second must be positive")
+        partial_path = path + ".partial"
+        copied = 0
+
+        def step(status: int, remaining: int, total: int):
+            nonlocal copied
+            copied = total - remaining
+            if progress is not None:
+                progress(copied, total)
+            self._write_lock.release()
+            try:
+                delay = 0.0
+                if max_bytes_per_second:
+                    delay = start + copied * page_size / max_bytes_per_second - time.perf_counter()
+                # Sleeping, even for 0 s, lets waiting writers take the lock
+                time.sleep(max(delay, 0.0))
+            finally:
+                self._write_lock.acquire()
+
+        try:
+            page_size = self._query_one('PRAGMA page_size')[0]
+            if os.path.exists(partial_path):
+                os.remove(partial_path)
+            start = time.perf_counter()
+            target = sqlite3.connect(partial_path)
+            try:
+                with self._write_lock:
+                    self.conn.commit()
+                    self.conn.backup(target, pages=pages_per_step, progress=step)
+            finally:
+                target.close()
+            os.replace(partial_path, path)
+        except Exception as e:
+            print(f"Error backing up database: {e}")
+            if os.path.exists(partial_path):
+                os.remove(partial_path)
+            return None
+        seconds = time.perf_counter() - start
+        size = copied * page_size
+        return BackupResult(copied, size, seconds, size / seconds if seconds > 0 else 0.0)
+
+    def restore(self, path: str) -> bool:
+        """
+        Replace the whole database with the contents of a backup.
+
+        The backup is checked, then copied to a staging file beside the
+        database, where its schema is brought up to date, so backups from
+        older versions work, and the restore is logged. Only then is the
+        staged copy swapped in, in a single transaction, so a restore that
+        fails at any point leaves the database unchanged. Writers wait until
+        the restore completes; pooled readers see the restored data on their
+        next query. The changelog keeps counting from where it was and
+        records the restore as changes: a delete for every product the backup
+        lacks and an insert or update for every restored product, so
+        changes_since() consumers catch up with it.
+
+        Args:
+            path: Backup file written by backup()
+
+        Returns:
+            bool: True if the database was restored
+        """
+        try:
+            import tempfile
+            with self._write_lock, tempfile.TemporaryDirectory(
+                    prefix=".restore-", dir=self._staging_directory()) as staging_dir:
+                staged = self._stage_restore(path, staging_dir)
+                if staged is None:
+                    return False
+                self._swap_in(staged)
+            return True
+        except Exception as e:
+            print(f"Error restoring database: {e}")
+            return False
+
+    def _staging_directory(self) -> Optional[str]:
+        """Return the directory for restore staging files, None for the system default."""
+        if self.db_name == ":memory:":
+            return None
+        return os.path.dirname(os.path.abspath(self.db_name))
+
+    def _stage_restore(self, path: str, staging_dir: str) -> Optional[str]:
+        """
+        Check a backup and copy it to staging_dir, ready to be swapped in.
+
+        Opening the copy as a WarehouseDB upgrades its schema; its changelog
+        then continues from this database's, against the products it holds
+        now, so the write lock must be held until the copy is swapped in.
+
+        Returns:
+            Optional[str]: Path of the staged copy, or None if the backup is
+            missing, damaged or not a warehouse backup
+        """
+        if not os.path.isfile(path):
+            print(f"Error restoring database: no backup file {path}")
+            return None
+        staging_path = os.path.join(staging_dir, "staging.db")
+        source = sqlite3.connect(path)
+        try:
+            if source.execute('PRAGMA quick_check').fetchone()[0] != 'ok':
+                print(f"Error restoring database: {path} is damaged")
+                return None
+            if not source.execute("SELECT 1 FROM sqlite_master "
+                                  "WHERE type = 'table' AND name = 'products'").fetchone():
+                print(f"Error restoring database: {path} is not a warehouse backup")
+                return None
+            staging = sqlite3.connect(staging_path)
+            try:
+                source.backup(staging)
+            finally:
+                staging.close()
+        finally:
+            source.close()
+
+        self.conn.commit()
+        staging = WarehouseDB(staging_path, DEFAULT_PROFILE._replace(synchronous="OFF",
+                                                                     optimize_on_close=False))
+        try:
+            staging.cursor.execute('CREATE TEMP TABLE restore_names (name TEXT PRIMARY KEY)')
+            staging.cursor.executemany('INSERT INTO temp.restore_names (name) VALUES (?)',
+                                       self.conn.execute('SELECT name FROM products'))
+            staging._log_restore(self.last_change_seq())
+            staging.conn.commit()
+        finally:
+            staging.close()
+        return staging_path
+
+    def _swap_in(self, staging_path: str):
+        """Replace the database with a copy staged by _stage_restore."""
+        # One backup step copies every page in one transaction on this
+        # connection, so a failure leaves the database as it was
+        staging = sqlite3.connect(staging_path)
+        try:
+            staging.backup(self.conn)
+        finally:
+            staging.close()
+
+    def _log_restore(self, last_seq: int):
+        """
+        Continue the changelog of a just restored database from last_seq.
+
+        temp.restore_names holds the products that existed before the restore.
+        """
+        self.cursor.execute(
+            "UPDATE sqlite_sequence SET seq = MAX(seq, ?) WHERE name = 'product_changes'",
+            (last_seq,))
+        if self.cursor.rowcount == 0:
+            self.cursor.execute(
+                "INSERT INTO sqlite_sequence (name, seq) VALUES ('product_changes', ?)",
+                (last_seq,))
+        self.cursor.execute(f'''
+        INSERT INTO product_changes (op, name, price, amount)
+        SELECT '{CHANGE_DELETE}', name, NULL, NULL FROM temp.restore_names
+        WHERE name NOT IN (SELECT name FROM main.products)
+        ORDER BY name
+        ''')
+        self.cursor.execute(f'''
+        INSERT INTO product_changes (op, name, price, amount)
+        SELECT CASE WHEN name IN (SELECT name FROM temp.restore_names)
+                    THEN '{CHANGE_UPDATE}' ELSE '{CHANGE_INSERT}' END,
+               name, price, amount
+        FROM main.products ORDER BY name
+        ''')
+
+    def close(self):
+        """Close the database connection and any pooled read connections."""
+        with self._readers_lock:
+            for reader in self._readers:
+                reader.close()
+            self._readers.clear()
+        self._local = threading.local()
+        with self._write_lock:
+            if self.conn:
+                self.conn.commit()
+                if self.profile.optimize_on_close and not self.read_only:
+                    self.optimize()
+                self.conn.close()
+                self.conn = None
+                self.cursor = None
+
+    @contextmanager
+    def transaction(self, names: Optional[Collection[str]] = None) -> Iterator["WarehouseDB"]:
+        """
+        Apply every write made inside the block as one transaction.
+
+        The write lock is held for the whole block, so other threads cannot
+        interleave writes. The block commits when it exits normally and rolls
+        back if it raises. A write that fails inside the block rolls back the
+        transaction, so the block then raises sqlite3.DatabaseError on exit
+        instead of committing the writes around it. Nested blocks join the
+        outer transaction. Reads made by the same thread inside the block see
+        its writes, also in pooled mode.
+
+        Args:
+            names: Products the block writes; only ShardedWarehouseDB needs them
+        """
+        with self._write_lock:
+            self._transaction_depth += 1
+            self._transaction_owner = threading.get_ident()
+            try:
+                yield self
+                if self._transaction_depth == 1 and self._transaction_failed:
+                    raise sqlite3.DatabaseError("A write failed; the transaction was rolled back")
+            except BaseException:
+                if self._transaction_depth == 1:
+                    self.conn.rollback()
+                raise
+            else:
+                if self._transaction_depth == 1:
+                    self.conn.commit()
+            finally:
+                self._transaction_depth -= 1
+                if self._transaction_depth == 0:
+                    self._transaction_failed = False
+                    self._transaction_owner = None
+
+    def _commit(self):
+        """Commit a write, unless it is part of a transaction() block."""
+        if not self._transaction_depth:
+            self.conn.commit()
+
+    def _rollback(self):
+        """Roll back a failed write; inside transaction() this aborts the whole block."""
+        if self._transaction_depth:
+            self._transaction_failed = True
+        self.conn.rollback()
+
+    def add_product(self, name: str, price: int, amount: int) -> bool:
+        """Add a new product to the database."""
+        try:
+            with self._write_lock:
+                self.cursor.execute(
+                    f'''INSERT INTO products (id, name, price, amount)
+                    VALUES ({NEXT_PRODUCT_ID_SQL}, ?, ?, ?)''',
+                    (name, price, amount)
+                )
+                self._commit()
+            return True
+        except sqlite3.IntegrityError:
+            return False
+        except Exception as e:
+            print(f"Error adding product: {e}")
+            return False
+
+    def update_product(self, name: str, price: int, amount: int) -> bool:
+        """Update an existing product; a change of amount is logged in the stock ledger."""
+        try:
+            with self._write_lock:
+                self.cursor.execute(
+                    'UPDATE products SET price = ?, amount = ? WHERE name = ?',
+                    (price, amount, name)
+                )
+                self._commit()
+                return self.cursor.rowcount > 0
+        except Exception as e:
+            print(f"Error updating product: {e}")
+            return False
+
+    def bulk_upsert(self, rows: Iterable[Tuple[str, int, int]],
+                    batch_size: int = DEFAULT_BATCH_SIZE) -> List[BatchResult]:
+        """
+        Insert or update many products, committing once per batch.
+
+        Rows are streamed from the iterable, so arbitrarily large feeds are
+        processed in bounded memory. Existing products (matched by name) get
+        their price and amount overwritten; the stock ledger logs each change
+        of amount. Malformed rows, and rows the database refuses (such as a
+        total below the stock held at other locations), are rejected one by
+        one; the rest of their batch is still written.
+
+        Args:
+            rows: Iterable of (name, price_cents, amount) tuples
+            batch_size: Maximum number of rows written per transaction
+
+        Returns:
+            List[BatchResult]: Inserted, updated and rejected counts per batch
+        """
+        if batch_size <= 0:
+            raise ValueError("batch_size must be positive")
+
+        results = []
+        iterator = iter(rows)
+        while True:
+            batch = list(islice(iterator, batch_size))
+            if not batch:
+                break
+
+            valid = [row for row in batch if self._is_valid_row(row)]
+            rejected = len(batch) - len(valid)
+            inserted = updated = 0
+            try:
+                with self._write_lock:
+                    # New rows get rowids above the current maximum, which lets us
+                    # split the affected row count into inserts and updates
+                    self.cursor.execute('SELECT COALESCE(MAX(id), 0) FROM products')
+                    max_id = self.cursor.fetchone()[0]
+                    sql = f'''INSERT INTO products (id, name, price, amount)
+                        VALUES ({NEXT_PRODUCT_ID_SQL}, ?, ?, ?)
+                        ON CONFLICT(name) DO UPDATE SET
+                            price = excluded.price, amount = excluded.amount'''
+                    try:
+                        # A savepoint undoes a failed batch without ending an
+                        # enclosing transaction() block
+                        self.cursor.execute('SAVEPOINT bulk_upsert')
+                        try:
+                            self.cursor.executemany(sql, valid)
+                            affected = self.cursor.rowcount
+                        except sqlite3.IntegrityError:
+                            # A row broke a constraint, e.g. a new total below the
+                            # stock other locations hold: replay the batch row by
+                            # row so only the offending rows are rejected
+                            self.cursor.execute('ROLLBACK TO bulk_upsert')
+                            affected = 0
+                            for row in valid:
+                                try:
+                                    self.cursor.execute(sql, row)
+                                    affected += self.cursor.rowcount
+                                except sqlite3.IntegrityError:
+                                    rejected += 1
+                        self.cursor.execute('RELEASE bulk_upsert')
+                        self.cursor.execute('SELECT COUNT(*) FROM products WHERE id > ?',
+                                            (max_id,))
+                        inserted = self.cursor.fetchone()[0]
+                        updated = affected - inserted
+                        self._commit()
+                    except Exception:
+                        self._rollback()
+                        raise
+            except Exception as e:
+                print(f"Error importing batch {len(results) + 1}: {e}")
+                inserted = updated = 0
+                rejected = len(batch)
+            results.append(BatchResult(len(results) + 1, inserted, updated, rejected))
+        return results
+
+    @staticmethod
+    def _is_valid_row(row) -> bool:
+        """Check that a row is a well-formed (name, price_cents, amount) tuple."""
+        try:
+            name, price, amount = row
+        except (TypeError, ValueError):
+            return False
+        return (isinstance(name, str) and bool(name)
+                and isinstance(price, int) and not isinstance(price, bool) and price >= 0
+                and isinstance(amount, int) and not isinstance(amount, bool) and amount >= 0)
+
+    def adjust_stock(self, name: str, delta: int, timestamp: Optional[int] = None,
+                     location: Optional[str] = None) -> bool:
+        """
+        Atomically change a product's stock by a signed amount.
+
+        The change is a single INSERT into the movement ledger; triggers apply
+        it to the stock level, so concurrent adjustments never lose updates.
+
+        Args:
+            name: The name of the product
+            delta: Units received (positive) or removed (negative)
+            timestamp: Unix time of the movement, defaults to now
+            location: Location the units arrive at or leave from; None or
+                DEFAULT_LOCATION changes the default location
+
+        Returns:
+            bool: True if applied, False if the product or location does not
+            exist or the stock there would become negative
+        """
+        if not self._is_valid_delta(delta):
+            return False
+        try:
+            with self._write_lock:
+                if location is not None and location != DEFAULT_LOCATION:
+                    # Change the location first; the movement then changes the
+                    # total by the same amount, which leaves the default as is.
+                    # Removals only update, as the CHECK refuses a negative
+                    # row before the upsert can merge it.
+                    if delta > 0:
+                        sql = '''INSERT INTO location_stock (location_id, product_id, amount)
+                        SELECT l.id, p.id, ? FROM locations l, products p
+                        WHERE l.name = ? AND p.name = ?
+                        ON CONFLICT (location_id, product_id) DO UPDATE SET
+                            amount = amount + excluded.amount'''
+                    else:
+                        sql = '''UPDATE location_stock SET amount = amount + ?
+                        WHERE location_id = (SELECT id FROM locations WHERE name = ?)
+                            AND product_id = (SELECT id FROM products WHERE name = ?)'''
+                    self.cursor.execute(sql, (delta, location, name))
+                    if self.cursor.rowcount == 0:
+                        self._commit()
+                        return False
+                self.cursor.execute(
+                    '''INSERT INTO stock_movements (product_id, delta, created_at, location_id)
+                    SELECT p.id, ?, ?, l.id FROM products p, locations l
+                    WHERE p.name = ? AND l.name = ?''',
+                    (delta, int(time.time()) if timestamp is None else timestamp, name,
+                     DEFAULT_LOCATION if location is None else location)
+                )
+                self._commit()
+                return self.cursor.rowcount > 0
+        except sqlite3.IntegrityError:
+            self._rollback()
+            return False
+        except Exception as e:
+            self._rollback()
+            print(f"Error adjusting stock: {e}")
+            return False
+
+    def record_movements(self, movements: Iterable[Tuple[str, int]],
+                         batch_size: int = DEFAULT_BATCH_SIZE,
+                         timestamp: Optional[int] = None) -> List[MovementBatchResult]:
+        """
+        Apply a stream of stock movements, committing once per batch.
+
+        A batch is written with a single executemany. If any movement in it
+        is refused (e.g. insufficient stock) the batch is rolled back to a
+        savepoint and replayed row by row, so only the offending movements
+        are rejected and earlier writes of a transaction() block are kept.
+
+        Args:
+            movements: Iterable of (name, delta) tuples
+            batch_size: Maximum number of movements written per transaction
+            timestamp: Unix time recorded for every movement, defaults to now
+
+        Returns:
+            List[MovementBatchResult]: Applied and rejected counts per batch
+        """
+        if batch_size <= 0:
+            raise ValueError("batch_size must be positive")
+        sql = '''INSERT INTO stock_movements (product_id, delta, created_at)
+                 SELECT id, ?, ? FROM products WHERE name = ?'''
+
+        results = []
+        iterator = iter(movements)
+        while True:
+            batch = list(islice(iterator, batch_size))
+            if not batch:
+                break
+
+            created_at = int(time.time()) if timestamp is None else timestamp
+            valid = [(delta, created_at, name) for name, delta in
+                     (m for m in batch if self._is_valid_movement(m))]
+            applied = 0
+            try:
+                with self._write_lock:
+                    # A savepoint undoes a failed batch without ending an
+                    # enclosing transaction() block
+                    self.cursor.execute('SAVEPOINT record_movements')
+                    try:
+                        self.cursor.executemany(sql, valid)
+                        applied = self.cursor.rowcount
+                    except sqlite3.IntegrityError:
+                        self.cursor.execute('ROLLBACK TO record_movements')
+                        for row in valid:
+                            try:
+                                self.cursor.execute(sql, row)
+                                applied += self.cursor.rowcount
+                            except sqlite3.IntegrityError:
+                                pass
+                    self.cursor.execute('RELEASE record_movements')
+                    self._commit()
+            except Exception as e:
+                self._rollback()
+                print(f"Error recording movement batch {len(results) + 1}: {e}")
+                applied = 0
+            results.append(MovementBatchResult(len(results) + 1, applied, len(batch) - applied))
+        return results
+
+    @staticmethod
+    def _is_valid_delta(delta) -> bool:
+        """Check that a stock delta is a non-zero integer."""
+        return isinstance(delta, int) and not isinstance(delta, bool) and delta != 0
+
+    @classmethod
+    def _is_valid_movement(cls, movement) -> bool:
+        """Check that a movement is a well-formed (name, delta) tuple."""
+        try:
+            name, delta = movement
+        except (TypeError, ValueError):
+            return False
+        return isinstance(name, str) and bool(name) and cls._is_valid_delta(delta)
+
+    def transfer_stock(self, name: str, source: str, destination: str, quantity: int) -> bool:
+        """
+        Move units of a product from one location to another in one transaction.
+
+        The product's total does not change, so the changelog does not record
+        a transfer; the movement ledger logs it as a pair of 'transfer'
+        movements, which leave stock levels and movement totals as they are.
+
+        Args:
+            name: The name of the product
+            source: Location the units leave
+            destination: Location the units arrive at
+            quantity: Number of units moved, positive
+
+        Returns:
+            bool: True if moved, False if the product or a location does not
+            exist or the source holds fewer than quantity units
+        """
+        if not self._is_valid_delta(quantity) or quantity < 0 or source == destination:
+            return False
+        try:
+            with self._write_lock:
+                self.cursor.execute('SELECT name, id FROM locations WHERE name IN (?, ?)',
+                                    (source, destination))
+                ids = dict(self.cursor.fetchall())
+                self.cursor.execute('SELECT id FROM products WHERE name = ?', (name,))
+                product = self.cursor.fetchone()
+                if len(ids) < 2 or product is None:
+                    return False
+                self.cursor.execute(
+                    '''UPDATE location_stock SET amount = amount - ?
+                    WHERE location_id = ? AND product_id = ?''',
+                    (quantity, ids[source], product[0])
+                )
+                if self.cursor.rowcount == 0:
+                    self._commit()
+                    return False
+                self.cursor.execute(
+                    '''INSERT INTO location_stock (location_id, product_id, amount)
+                    VALUES (?, ?, ?)
+                    ON CONFLICT (location_id, product_id) DO UPDATE SET
+                        amount = amount + excluded.amount''',
+                    (ids[destination], product[0], quantity)
+                )
+                created_at = int(time.time())
+                self.cursor.executemany(
+                    '''INSERT INTO stock_movements (product_id, delta, created_at, kind, location_id)
+                    VALUES (?, ?, ?, 'transfer', ?)''',
+                    [(product[0], -quantity, created_at, ids[source]),
+                     (product[0], quantity, created_at, ids[destination])]
+                )
+                self._commit()
+                return True
+        except sqlite3.IntegrityError:
+            self._rollback()
+            return False
+        except Exception as e:
+            self._rollback()
+            print(f"Error transferring stock: {e}")
+            return False
+
+    def add_location(self, name: str) -> bool:
+        """Add an empty stock location; False if the name is taken."""
+        try:
+            with self._write_lock:
+                self.cursor.execute('INSERT INTO locations (name) VALUES (?)', (name,))
+                self._commit()
+            return True
+        except sqlite3.IntegrityError:
+            return False
+        except Exception as e:
+            print(f"Error adding location: {e}")
+            return False
+
+    def get_locations(self) -> List[LocationSummary]:
+        """Get every location with its product count, units and stock value in cents."""
+        try:
+            return [LocationSummary(*row) for row in self._query(
+                'SELECT name, products, units, value FROM locations ORDER BY id')]
+        except Exception as e:
+            print(f"Error getting locations: {e}")
+            return []
+
+    def get_product_locations(self, name: str) -> List[Tuple[str, int]]:
+        """Get the (location, amount) pairs of a product, default location first."""
+        try:
+            return self._query(
+                '''SELECT l.name, s.amount
+                FROM products p
+                JOIN location_stock s ON s.product_id = p.id
+                JOIN locations l ON l.id = s.location_id
+                WHERE p.name = ? ORDER BY l.id''',
+                (name,)
+            )
+        except Exception as e:
+            print(f"Error getting product locations: {e}")
+            return []
+
+    def get_movement_summaries(self, name: str, first_period: Optional[str] = None,
+                               last_period: Optional[str] = None) -> List[MovementSummary]:
+        """
+        Get the per-day movement totals of a product.
+
+        Args:
+            name: The name of the product
+            first_period: First day to include (YYYY-MM-DD), or None for all
+            last_period: Last day to include (YYYY-MM-DD), or None for all
+
+        Returns:
+            List[MovementSummary]: One entry per day with movements, oldest first
+        """
+        try:
+            rows = self._query(
+                '''SELECT t.period, t.inbound, t.outbound, t.movements
+                FROM products p JOIN stock_movement_totals t ON t.product_id = p.id
+                WHERE p.name = ? AND t.period BETWEEN ? AND ?
+                ORDER BY t.period''',
+                (name, first_period or '', last_period or '9999-12-31')
+            )
+            return [MovementSummary(*row) for row in rows]
+        except Exception as e:
+            print(f"Error getting movement summaries: {e}")
+            return []
+
+    def changes_since(self, seq: int = 0,
+                      page_size: int = CHANGE_PAGE_SIZE) -> Iterator[Change]:
+        """
+        Stream the changelog entries recorded after seq, oldest first.
+
+        Entries are read in keyset-paged queries, so changes committed while
+        the generator is consumed are picked up as well; it ends once it has
+        caught up. Pass the seq of the last entry applied to resume later.
+
+        Args:
+            seq: Sequence number of the last change already seen (0 for all)
+            page_size: Entries fetched per query
+
+        Yields:
+            Change: Entries with prices in cents
+        """
+        if page_size <= 0:
+            raise ValueError("page_size must be positive")
+        while True:
+            try:
+                rows = self._query(
+                    '''SELECT seq, op, name, price, amount FROM product_changes
+                    WHERE seq > ? ORDER BY seq LIMIT ?''',
+                    (seq, page_size)
+                )
+            except Exception as e:
+                print(f"Error reading changes: {e}")
+                return
+            for row in rows:
+                yield Change(*row)
+            if len(rows) < page_size:
+                return
+            seq = rows[-1][0]
+
+    def last_change_seq(self) -> int:
+        """Return the sequence number of the newest change ever recorded (0 if none)."""
+        try:
+            row = self._query_one(
+                "SELECT seq FROM sqlite_sequence WHERE name = 'product_changes'")
+            return row[0] if row else 0
+        except Exception as e:
+            print(f"Error reading change sequence: {e}")
+            return 0
+
+    def compact_changes(self, up_to: Optional[int] = None,
+                        drop_deletes: bool = False) -> int:
+        """
+        Compact the changelog up to and including seq up_to.
+
+        Only the newest entry per product name is kept, so a consumer that
+        replays the log from any point still reaches the current state. With
+        drop_deletes, deletes up to up_to are removed as well; only do that
+        once every consumer has read past up_to, or it will miss them.
+
+        Args:
+            up_to: Last sequence number to compact, or None for the whole log
+            drop_deletes: Also remove compacted delete entries
+
+        Returns:
+            int: Number of entries removed, or -1 on error
+        """
+        try:
+            with self._write_lock:
+                if up_to is None:
+                    up_to = self.last_change_seq()
+                self.cursor.execute(
+                    '''DELETE FROM product_changes WHERE seq <= ? AND seq NOT IN (
+                        SELECT MAX(seq) FROM product_changes WHERE seq <= ? GROUP BY name
+                    )''',
+                    (up_to, up_to)
+                )
+                removed = self.cursor.rowcount
+                if drop_deletes:
+                    self.cursor.execute(
+                        'DELETE FROM product_changes WHERE seq <= ? AND op = ?',
+                        (up_to, CHANGE_DELETE)
+                    )
+                    removed += self.cursor.rowcount
+                self._commit()
+                return removed
+        except Exception as e:
+            self._rollback()
+            print(f"Error compacting changes: {e}")
+            return -1
+
+    def delete_product(self, name: str) -> bool:
+        """Delete a product by name."""
+        try:
+            with self._write_lock:
+                self.cursor.execute('DELETE FROM products WHERE name = ?', (name,))
+                self._commit()
+                return self.cursor.rowcount > 0
+        except Exception as e:
+            print(f"Error deleting product: {e}")
+            return False
+
+    def get_product_by_name(self, name: str,
+                            location: Optional[str] = None) -> Optional[Tuple[str, int, int]]:
+        """Get a product by its exact name, with the amount held at location if given."""
+        try:
+            if location is None:
+                result = self._query_one(
+                    'SELECT name, price, amount FROM products WHERE name = ?', (name,))
+            else:
+                result = self._query_one(f'{LOCATION_PRODUCTS_SQL} AND p.name = ?',
+                                         (location, name))
+            return result if result else None
+        except Exception as e:
+            print(f"Error getting product: {e}")
+            return None
+
+    def get_products_by_names(self, names: Iterable[str]) -> List[Tuple[str, int, int]]:
+        """Get the products with the given exact names; unknown names are skipped."""
+        names = list(names)
+        results = []
+        try:
+            for start in range(0, len(names), NAMES_PER_QUERY):
+                chunk = names[start:start + NAMES_PER_QUERY]
+                results.extend(self._query(
+                    'SELECT name, price, amount FROM products WHERE name IN '
+                    f'({", ".join("?" * len(chunk))})',
+                    tuple(chunk)
+                ))
+            return results
+        except Exception as e:
+            print(f"Error getting products: {e}")
+            return []
+
+    def find_products_by_partial_name(self, partial_name: str) -> List[Tuple[str, int, int]]:
+        """Find products by partial name (case insensitive)."""
+        try:
+            if self._use_search_index(partial_name):
+                return self._query(
+                    '''SELECT p.name, p.price, p.amount
+                    FROM products_fts JOIN products p ON p.id = products_fts.rowid
+                    WHERE products_fts MATCH ?''',
+                    (self._fts_phrase(partial_name),)
+                )
+            return self._query(
+                'SELECT name, price, amount FROM products WHERE name LIKE ? COLLATE NOCASE',
+                (f'%{partial_name}%',)
+            )
+        except Exception as e:
+            print(f"Error finding products: {e}")
+            return []
+
+    def find_products_ranked(self, partial_name: str,
+                             limit: Optional[int] = None) -> List[Tuple[str, int, int]]:
+        """
+        Find products by partial name, best matches first.
+
+        Matches are ordered by BM25 relevance, which favours names where the
+        term makes up a larger share of the name.
+
+        Args:
+            partial_name: Substring to search for (case insensitive)
+            limit: Maximum number of results, or None for all of them
+
+        Returns:
+            List[Tuple[str, int, int]]: Matching (name, price, amount) rows
+        """
+        return [row[1:] for row in self.find_products_scored(partial_name, limit)]
+
+    def find_products_scored(self, partial_name: str, limit: Optional[int] = None
+                             ) -> List[Tuple[float, str, int, int]]:
+        """
+        Find products by partial name with their relevance score, best first.
+
+        Lower scores are better and results are ordered by (score, name), so
+        scored lists from several databases can be merged.
+
+        Returns:
+            List[Tuple[float, str, int, int]]: (score, name, price, amount) rows
+        """
+        try:
+            if self._use_search_index(partial_name):
+                return self._query(
+                    '''SELECT products_fts.rank, p.name, p.price, p.amount
+                    FROM products_fts JOIN products p ON p.id = products_fts.rowid
+                    WHERE products_fts MATCH ?
+                    ORDER BY products_fts.rank, p.name
+                    LIMIT ?''',
+                    (self._fts_phrase(partial_name), -1 if limit is None else limit)
+                )
+            # Without the index, earlier and then shorter matches rank first
+            return self._query(
+                '''SELECT instr(lower(name), lower(?)) * 1e9 + length(name) AS score,
+                          name, price, amount
+                FROM products
+                WHERE name LIKE ? COLLATE NOCASE
+                ORDER BY score, name
+                LIMIT ?''',
+                (partial_name, f'%{partial_name}%', -1 if limit is None else limit)
+            )
+        except Exception as e:
+            print(f"Error finding products: {e}")
+            return []
+
+    def _use_search_index(self, partial_name: str) -> bool:
+        """Check whether a search term can be answered by the trigram index."""
+        return self.fts_enabled and len(partial_name) >= MIN_TRIGRAM_TERM_LENGTH
+
+    @staticmethod
+    def _fts_phrase(term: str) -> str:
+        """Quote a search term as an FTS5 phrase so it is matched literally."""
+        return '"' + term.replace('"', '""') + '"'
+
+    def iter_products(self, order_by: str = ORDER_BY_NAME, page_size: int = DEFAULT_PAGE_SIZE,
+                      after: Union[str, Tuple[int, int], None] = None
+                      ) -> Iterator[Tuple[str, int, int]]:
+        """
+        Stream all products in order, one page of rows at a time.
+
+        Pages are fetched by keyset (seeking past the last key seen) rather
+        than by OFFSET, so every page is an index range scan and only one page
+        is held in memory.
+
+        Args:
+            order_by: ORDER_BY_NAME or ORDER_BY_PRICE
+            page_size: Number of rows fetched per query
+            after: Resume after this key: a name when ordering by name, or a
+                (price_cents, id) pair when ordering by price
+
+        Yields:
+            Tuple[str, int, int]: (name, price, amount) rows
+        """
+        if order_by not in (ORDER_BY_NAME, ORDER_BY_PRICE):
+            raise ValueError(f"Invalid sort key: {order_by}")
+        if page_size <= 0:
+            raise ValueError("page_size must be positive")
+
+        while True:
+            page, after = self.get_products_page(order_by, page_size, after)
+            yield from page
+            if after is None:
+                return
+
+    def get_products_page(self, order_by: str, page_size: int,
+                          after: Union[str, Tuple[int, int], None] = None
+                          ) -> Tuple[List[Tuple[str, int, int]], Union[str, Tuple[int, int], None]]:
+        """
+        Fetch one keyset page of the ordered product listing.
+
+        Args:
+            order_by: ORDER_BY_NAME or ORDER_BY_PRICE
+            page_size: Maximum number of rows
+            after: Key returned with the previous page, or None for the first page
+
+        Returns:
+            Tuple: The (name, price, amount) rows and the key of the next page,
+            which is None once the listing is exhausted
+        """
+        try:
+            if order_by == ORDER_BY_NAME and after is None:
+                page = self._query(
+                    'SELECT name, price, amount FROM products ORDER BY name LIMIT ?',
+                    (page_size,)
+                )
+            elif order_by == ORDER_BY_NAME:
+                page = self._query(
+                    '''SELECT name, price, amount FROM products
+                    WHERE name > ? ORDER BY name LIMIT ?''',
+                    (after, page_size)
+                )
+            else:
+                # Prices are non-negative, so (-1, -1) sorts before every product
+                price, product_id = (-1, -1) if after is None else after
+                page = self._query(
+                    '''SELECT name, price, amount, id FROM products
+                    WHERE (price, id) > (?, ?) ORDER BY price, id LIMIT ?''',
+                    (price, product_id, page_size)
+                )
+        except Exception as e:
+            print(f"Error listing products: {e}")
+            return [], None
+
+        if len(page) < page_size:
+            next_after = None
+        elif order_by == ORDER_BY_NAME:
+            next_after = page[-1][0]
+        else:
+            next_after = (page[-1][1], page[-1][3])
+        if order_by == ORDER_BY_PRICE:
+            page = [(name, price, amount) for name, price, amount, _ in page]
+        return page, next_after
+
+    def _iter_table(self, size: int = COLUMNAR_GROUP_SIZE) -> Iterator[List[Tuple[str, int, int]]]:
+        """Yield every product in storage order, in chunks of at most size rows."""
+        cursor = self._reader().execute('SELECT name, price, amount FROM products')
+        while True:
+            rows = cursor.fetchmany(size)
+            if not rows:
+                return
+            yield rows
+
+    def export_csv(self, path: str) -> int:
+        """
+        Write all products to a CSV file with a name,price,amount header.
+
+        Rows are streamed from the database, so memory use does not grow with
+        the size of the table. Prices are written in cents.
+
+        Returns:
+            int: Number of products written
+        """
+        count = 0
+        with open(path, 'w', newline='', encoding='utf-8', buffering=FILE_BUFFER_SIZE) as f:
+            writer = csv.writer(f)
+            writer.writerow(CSV_HEADER)
+            for rows in self._iter_table():
+                writer.writerows(rows)
+                count += len(rows)
+        return count
+
+    def export_jsonl(self, path: str) -> int:
+        """
+        Write all products to a JSON Lines file, one object per product.
+
+        Returns:
+            int: Number of products written
+        """
+        count = 0
+        dumps = json.dumps
+        with open(path, 'w', encoding='utf-8', buffering=FILE_BUFFER_SIZE) as f:
+            for rows in self._iter_table():
+                f.writelines(
+                    f'{{"name": {dumps(name, ensure_ascii=False)}, '
+                    f'"price": {price}, "amount": {amount}}}\n'
+                    for name, price, amount in rows
+                )
+                count += len(rows)
+        return count
+
+    def export_columnar(self, path: str) -> int:
+        """
+        Write all products to the compact binary columnar format.
+
+        Each row group stores names, prices and amounts as contiguous arrays,
+        see COLUMNAR_MAGIC for the layout.
+
+        Returns:
+            int: Number of products written
+        """
+        count = 0
+        with open(path, 'wb', buffering=FILE_BUFFER_SIZE) as f:
+            f.write(COLUMNAR_MAGIC)
+            for rows in self._iter_table():
+                names = [name.encode('utf-8') for name, _, _ in rows]
+                columns = (array('I', map(len, names)),
+                           array('q', [price for _, price, _ in rows]),
+                           array('q', [amount for _, _, amount in rows]))
+                if sys.byteorder == 'big':
+                    for column in columns:
+                        column.byteswap()
+                f.write(COLUMNAR_COUNT.pack(len(rows)))
+                f.write(columns[0].tobytes())
+                f.write(b''.join(names))
+                f.write(columns[1].tobytes())
+                f.write(columns[2].tobytes())
+                count += len(rows)
+            f.write(COLUMNAR_COUNT.pack(0))
+        return count
+
+    def import_csv(self, path: str, batch_size: int = DEFAULT_BATCH_SIZE) -> List[BatchResult]:
+        """Insert or update products from a CSV file written by export_csv."""
+        return self.bulk_upsert(read_csv_products(path), batch_size)
+
+    def import_jsonl(self, path: str, batch_size: int = DEFAULT_BATCH_SIZE) -> List[BatchResult]:
+        """Insert or update products from a JSON Lines file written by export_jsonl."""
+        return self.bulk_upsert(read_jsonl_products(path), batch_size)
+
+    def import_columnar(self, path: str,
+                        batch_size: int = DEFAULT_BATCH_SIZE) -> List[BatchResult]:
+        """Insert or update products from a columnar file written by export_columnar."""
+        return self.bulk_upsert(read_columnar_products(path), batch_size)
+
+    def inventory_summary(self, location: Optional[str] = None) -> InventorySummary:
+        """
+        Get product count, units in stock, stock value and price range, in cents.
+
+        With a location, the counts, units and value are the totals the
+        location row maintains and only the price range is looked up.
+        """
+        try:
+            if location is not None:
+                row = self._query_one(
+                    'SELECT id, products, units, value FROM locations WHERE name = ?',
+                    (location,))
+                if row is None:
+                    return InventorySummary(0, 0, 0, None, None)
+                location_id, products, units, value = row
+                min_price, max_price = self._query_one(
+                    '''SELECT MIN(p.price), MAX(p.price)
+                    FROM location_stock s JOIN products p ON p.id = s.product_id
+                    WHERE s.location_id = ?''',
+                    (location_id,))
+                return InventorySummary(products, units, value, min_price, max_price)
+            products, units, value, min_price, max_price = self._query_one(
+                '''SELECT COUNT(*), COALESCE(SUM(amount), 0), COALESCE(SUM(price * amount), 0),
+                          MIN(price), MAX(price)
+                FROM products INDEXED BY idx_products_price_covering'''
+            )
+            return InventorySummary(products, units, value, min_price, max_price)
+        except Exception as e:
+            print(f"Error summarizing inventory: {e}")
+            return InventorySummary(0, 0, 0, None, None)
+
+    def low_stock(self, threshold: int,
+                  location: Optional[str] = None) -> List[Tuple[str, int, int]]:
+        """Get products with fewer than threshold units (at location if given), scarcest first."""
+        try:
+            if location is not None:
+                return self._query(f'{LOCATION_PRODUCTS_SQL} AND s.amount < ? '
+                                   'ORDER BY s.amount, p.name', (location, threshold))
+            return self._query(
+                '''SELECT name, price, amount FROM products
+                WHERE amount < ? ORDER BY amount, name''',
+                (threshold,)
+            )
+        except Exception as e:
+            print(f"Error getting low stock products: {e}")
+            return []
+
+    def price_histogram(self, bins: int) -> List[HistogramBin]:
+        """
+        Count products and units in equal-width price bands.
+
+        The bands span the lowest to the highest price in cents. Counting is a
+        single GROUP BY over the covering price index.
+
+        Args:
+            bins: Number of bands
+
+        Returns:
+            List[HistogramBin]: One entry per band, lowest prices first, including
+            empty bands; empty when there are no products
+        """
+        if bins <= 0:
+            raise ValueError("bins must be positive")
+        summary = self.inventory_summary()
+        if summary.products == 0:
+            return []
+        low, high = summary.min_price, summary.max_price
+        width = max(high - low, 1)
+        try:
+            counts = self.count_price_bands(low, width, bins)
+        except Exception as e:
+            print(f"Error building price histogram: {e}")
+            return []
+        return [
+            HistogramBin(low + width * band / bins, low + width * (band + 1) / bins,
+                         *counts.get(band, (0, 0)))
+            for band in range(bins)
+        ]
+
+    def count_price_bands(self, low: int, width: int, bins: int) -> Dict[int, Tuple[int, int]]:
+        """
+        Count products and units per price band.
+
+        Args:
+            low: Lowest price in cents, the start of band 0
+            width: Total width in cents of all bands together
+            bins: Number of bands; prices past the end fall into the last one
+
+        Returns:
+            Dict[int, Tuple[int, int]]: (products, units) by band number, for
+            non-empty bands
+        """
+        return {
+            band: (products, units)
+            for band, products, units in self._query(
+                '''SELECT min(max(price - ?, 0) * ? / ?, ? - 1) AS band, COUNT(*), SUM(amount)
+                FROM products INDEXED BY idx_products_price_covering
+                GROUP BY band''',
+                (low, bins, width, bins)
+            )
+        }
+
+    def _prepare_query(self, price_min: Optional[int], price_max: Optional[int],
+                       amount_min: Optional[int], name_prefix: Optional[str],
+                       order_by: str, limit: Optional[int]) -> Tuple[str, Tuple]:
+        """Return the SQL and parameters of a query() call."""
+        if order_by not in (ORDER_BY_NAME, ORDER_BY_PRICE):
+            raise ValueError(f"Invalid sort key: {order_by}")
+        if limit is not None and limit < 0:
+            raise ValueError("limit cannot be negative")
+
+        upper = None if name_prefix is None else prefix_upper_bound(name_prefix)
+        shape = QueryShape(price_min is not None, price_max is not None,
+                           amount_min is not None, name_prefix is not None,
+                           upper is not None, order_by, limit is not None)
+        params = [value for value in (price_min, price_max, amount_min, name_prefix, upper, limit)
+                  if value is not None]
+        return compile_query(shape), tuple(params)
+
+    def query(self, price_min: Optional[int] = None, price_max: Optional[int] = None,
+              amount_min: Optional[int] = None, name_prefix: Optional[str] = None,
+              order_by: str = ORDER_BY_NAME, limit: Optional[int] = None
+              ) -> Iterator[Tuple[str, int, int]]:
+        """
+        Stream products matching all of the given filters.
+
+        Each combination of filters compiles to one fixed parameterized
+        statement, so repeated queries of the same shape reuse the connection's
+        prepared statement. Omitted filters are left out of the SQL entirely.
+
+        Args:
+            price_min: Lowest price in cents
+            price_max: Highest price in cents
+            amount_min: Lowest amount in stock
+            name_prefix: Case-sensitive start of the name
+            order_by: ORDER_BY_NAME or ORDER_BY_PRICE
+            limit: Maximum number of rows
+
+        Yields:
+            Tuple[str, int, int]: (name, price, amount) rows
+        """
+        sql, params = self._prepare_query(price_min, price_max, amount_min, name_prefix,
+                                          order_by, limit)
+        try:
+            cursor = self._reader().execute(sql, params)
+            while True:
+                rows = cursor.fetchmany(DEFAULT_PAGE_SIZE)
+                if not rows:
+                    return
+                yield from rows
+        except Exception as e:
+            print(f"Error querying products: {e}")
+
+    def explain(self, price_min: Optional[int] = None, price_max: Optional[int] = None,
+                amount_min: Optional[int] = None, name_prefix: Optional[str] = None,
+                order_by: str = ORDER_BY_NAME, limit: Optional[int] = None) -> List[str]:
+        """
+        Show how SQLite would run a query() call.
+
+        Returns:
+            List[str]: The EXPLAIN QUERY PLAN steps, e.g.
+            "SEARCH products USING COVERING INDEX idx_products_price_covering (price>? AND price<?)"
+        """
+        sql, params = self._prepare_query(price_min, price_max, amount_min, name_prefix,
+                                          order_by, limit)
+        return [row[-1] for row in self._query('EXPLAIN QUERY PLAN ' + sql, params)]
+
+    def get_products_in_price_range(self, min_price: int,
+                                    max_price: int) -> List[Tuple[str, int, int]]:
+        """Get products priced between min_price and max_price cents inclusive, cheapest first."""
+        try:
+            return self._query(
+                '''SELECT name, price, amount FROM products
+                WHERE price BETWEEN ? AND ? ORDER BY price, name''',
+                (min_price, max_price)
+            )
+        except Exception as e:
+            print(f"Error getting products by price range: {e}")
+            return []
+
+    def top_n_by_value(self, n: int) -> List[Tuple[str, int, int, int]]:
+        """Get the n products with the highest stock value (price * amount)."""
+        try:
+            return self._query(
+                '''SELECT name, price, amount, price * amount FROM products
+                ORDER BY price * amount DESC LIMIT ?''',
+                (n,)
+            )
+        except Exception as e:
+            print(f"Error getting most valuable products: {e}")
+            return []
+
+    def get_all_products_by_name(self, location: Optional[str] = None
+                                 ) -> List[Tuple[str, int, int]]:
+        """Get all products (held at location if given) ordered by name."""
+        try:
+            if location is not None:
+                return self._query(f'{LOCATION_PRODUCTS_SQL} ORDER BY p.name', (location,))
+            return self._query('SELECT name, price, amount FROM products ORDER BY name ASC')
+        except Exception as e:
+            print(f"Error getting products by name: {e}")
+            return []
+
+    def get_all_products_by_price(self, location: Optional[str] = None
+                                  ) -> List[Tuple[str, int, int]]:
+        """Get all products (held at location if given) ordered by price."""
+        try:
+            if location is not None:
+                return self._query(f'{LOCATION_PRODUCTS_SQL} ORDER BY p.price', (location,))
+            return self._query('SELECT name, price, amount FROM products ORDER BY price ASC')
+        except Exception as e:
+            print(f"Error getting products by price: {e}")
+            return []
+
+
+# Streaming readers for the exported file formats. Malformed records are
+# yielded with their invalid fields so bulk_upsert counts them as rejected.
+
+def read_csv_products(path: str) -> Iterator[tuple]:
+    """Yield (name, price_cents, amount) rows from a CSV export."""
+    with open(path, newline='', encoding='utf-8', buffering=FILE_BUFFER_SIZE) as f:
+        reader = csv.reader(f)
+        header = next(reader, None)
+        if header is not None and tuple(header) != CSV_HEADER:
+            raise ValueError(f"Unexpected CSV header: {header}")
+        for row in reader:
+            try:
+                name, price, amount = row
+                yield name, int(price), int(amount)
+            except ValueError:
+                yield tuple(row)
+
+
+def read_jsonl_products(path: str) -> Iterator[tuple]:
+    """Yield (name, price_cents, amount) rows from a JSON Lines export."""
+    loads = json.loads
+    with open(path, encoding='utf-8', buffering=FILE_BUFFER_SIZE) as f:
+        for line in f:
+            if not line.strip():
+                continue
+            try:
+                record = loads(line)
+                yield record["name"], record["price"], record["amount"]
+            except (ValueError, KeyError, TypeError):
+                yield (line,)
+
+
+def read_columnar_products(path: str) -> Iterator[Tuple[str, int, int]]:
+    """Yield (name, price_cents, amount) rows from a columnar export."""
+    def read_exactly(f, size: int) -> bytes:
+        data = f.read(size)
+        if len(data) != size:
+            raise ValueError(f"Truncated columnar file: {path}")
+        return data
+
+    with open(path, 'rb', buffering=FILE_BUFFER_SIZE) as f:
+        if f.read(len(COLUMNAR_MAGIC)) != COLUMNAR_MAGIC:
+            raise ValueError(f"Not a columnar warehouse file: {path}")
+        while True:
+            (count,) = COLUMNAR_COUNT.unpack(read_exactly(f, COLUMNAR_COUNT.size))
+            if count == 0:
+                return
+            lengths, prices, amounts = array('I'), array('q'), array('q')
+            lengths.frombytes(read_exactly(f, count * lengths.itemsize))
+            if sys.byteorder == 'big':
+                lengths.byteswap()
+            blob = read_exactly(f, sum(lengths))
+            prices.frombytes(read_exactly(f, count * prices.itemsize))
+            amounts.frombytes(read_exactly(f, count * amounts.itemsize))
+            if sys.byteorder == 'big':
+                prices.byteswap()
+                amounts.byteswap()
+
+            offset = 0
+            for length, price, amount in zip(lengths, prices, amounts):
+                yield blob[offset:offset + length].decode('utf-8'), price, amount
+                offset += length
+
+
+def detect_file_format(path: str) -> str:
+    """Pick an export format from a file extension (.csv, .jsonl or .wcol)."""
+    file_format = FORMAT_EXTENSIONS.get(os.path.splitext(path)[1].lower())
+    if file_format is None:
+        raise ValueError(f"Cannot tell the file format of {path}")
+    return file_format
+
+
+# sharded_db.py - Sharded Database Layer
+
+# Default number of database files a ShardedWarehouseDB spreads products over
+DEFAULT_SHARDS = 4
+
+# Scatter-gather worker processes keep one read-only WarehouseDB per shard file
+_worker_databases: Dict[str, "WarehouseDB"] = {}
+
+
+def _init_shard_worker():
+    """Close a worker process's shard connections when the pool shuts it down."""
+    from multiprocessing.util import Finalize
+    Finalize(None, _close_worker_databases, exitpriority=10)
+
+
+def _close_worker_databases():
+    """Close every shard connection opened by this worker process."""
+    for db in _worker_databases.values():
+        db.close()
+    _worker_databases.clear()
+
+
+def _run_on_shard(db: "WarehouseDB", method: str, args: Tuple) -> Any:
+    """Call a WarehouseDB method, materializing generators so results can be pickled."""
+    result = getattr(db, method)(*args)
+    return list(result) if isinstance(result, types.GeneratorType) else result
+
+
+def _shard_call(db_name: str, profile: PerformanceProfile, method: str, args: Tuple) -> Any:
+    """Run a WarehouseDB method on a shard inside a scatter-gather worker process."""
+    db = _worker_databases.get(db_name)
+    if db is None:
+        db = _worker_databases[db_name] = WarehouseDB(db_name, profile, read_only=True)
+    return _run_on_shard(db, method, args)
+
+
+def shard_paths(db_name: str, shards: int) -> List[str]:
+    """Name the shard files of a database, e.g. warehouse.shard0of4.db."""
+    root, extension = os.path.splitext(db_name)
+    return [f"{root}.shard{i}of{shards}{extension or '.db'}" for i in range(shards)]
+
+
+class ShardedWarehouseDB:
+    """
+    Drop-in replacement for WarehouseDB that hash-partitions products by name
+    across several SQLite files.
+
+    Each shard has its own writer, so writes to different shards commit in
+    parallel: bulk writes are split per shard and applied on one thread per
+    shard. Listing and search queries are scattered to a process pool (or a
+    thread pool with processes=0), and ordered results are gathered with a
+    k-way merge. Bulk writes are atomic per shard and per batch, not across
+    shards, and transaction() blocks may only write to a single shard.
+    """
+
+    def __init__(self, db_name: str = "warehouse.db", shards: int = DEFAULT_SHARDS,
+                 profile: PerformanceProfile = DEFAULT_PROFILE,
+                 processes: Optional[int] = None,
+                 instrumentation: Optional[QueryInstrumentation] = None):
+        """
+        Open or create the shard files.
+
+        Args:
+            db_name: Base path; shards are stored next to it, see shard_paths()
+            shards: Number of shard files; must stay the same for a given database
+            profile: Connection tuning applied to every shard
+            processes: Worker processes for scatter-gather reads; 0 runs them on
+                threads in this process, None uses one per shard up to the CPU count
+            instrumentation: Shared by every shard; reads run in worker
+                processes are not counted
+        """
+        if shards < 1:
+            raise ValueError("shards must be at least 1")
+        if processes is not None and processes < 0:
+            raise ValueError("processes cannot be negative")
+        self.db_name = db_name
+        self.profile = profile
+        self.pooled = True
+        self.instrumentation = instrumentation
+        self.shards = [WarehouseDB(path, profile, pooled=True, instrumentation=instrumentation)
+                       for path in shard_paths(db_name, shards)]
+        self.fts_enabled = all(shard.fts_enabled for shard in self.shards)
+        self.processes = min(shards, os.cpu_count() or 1) if processes is None else processes
+        from concurrent.futures import ThreadPoolExecutor
+        self._writers = ThreadPoolExecutor(max_workers=shards, thread_name_prefix="shard-writer")
+        self._readers = None
+        self._readers_lock = threading.Lock()
+        # Shard of the calling thread's open transaction(), if any
+        self._local = threading.local()
+
+    def close(self):
+        """Stop the worker pools and close every shard."""
+        with self._readers_lock:
+            if self._readers is not None:
+                self._readers.shutdown(wait=True)
+                self._readers = None
+        self._writers.shutdown(wait=True)
+        for shard in self.shards:
+            shard.close()
+
+    def optimize(self, analyze: bool = False):
+        """Refresh the query planner statistics of every shard."""
+        for shard in self.shards:
+            shard.optimize(analyze)
+
+    stats = WarehouseDB.stats
+
+    def backup(self, path: str, pages_per_step: int = DEFAULT_BACKUP_PAGES,
+               max_bytes_per_second: Optional[float] = None,
+               progress: Optional[Callable[[int, int], None]] = None
+               ) -> Optional[BackupResult]:
+        """
+        Back up every shard to the shard files of path, one after another.
+
+        Each shard is a consistent snapshot of its own; see WarehouseDB.backup.
+        """
+        results = []
+        for shard, shard_path in zip(self.shards, shard_paths(path, len(self.shards))):
+            result = shard.backup(shard_path, pages_per_step, max_bytes_per_second, progress)
+            if result is None:
+                return None
+            results.append(result)
+        pages = sum(r.pages for r in results)
+        size = sum(r.bytes for r in results)
+        seconds = sum(r.seconds for r in results)
+        return BackupResult(pages, size, seconds, size / seconds if seconds > 0 else 0.0)
+
+    def restore(self, path: str) -> bool:
+        """
+        Restore every shard from the shard files of a backup made by backup().
+
+        Every shard backup is checked, upgraded and staged as in
+        WarehouseDB.restore before any shard is overwritten, so one damaged
+        shard backup leaves every shard as it was. Writers wait on all shards
+        until the restore completes.
+        """
+        backups = shard_paths(path, len(self.shards))
+        missing = [backup for backup in backups if not os.path.isfile(backup)]
+        if missing:
+            print(f"Error restoring database: missing shard backups {', '.join(missing)}")
+            return False
+        try:
+            import tempfile
+            with ExitStack() as stack:
+                for shard in self.shards:
+                    stack.enter_context(shard._write_lock)
+                staged = []
+                for shard, backup in zip(self.shards, backups):
+                    staging_dir = stack.enter_context(tempfile.TemporaryDirectory(
+                        prefix=".restore-", dir=shard._staging_directory()))
+                    staged.append(shard._stage_restore(backup, staging_dir))
+                    if staged[-1] is None:
+                        return False
+                for shard, staging_path in zip(self.shards, staged):
+                    shard._swap_in(staging_path)
+            return True
+        except Exception as e:
+            print(f"Error restoring database: {e}")
+            return False
+
+    def shard_for(self, name: str) -> WarehouseDB:
+        """Return the shard that stores the product with the given name."""
+        return self.shards[self._shard_index(name)]
+
+    def _shard_index(self, name) -> int:
+        # crc32 is stable across processes and runs, unlike hash()
+        if not isinstance(name, str):
+            return 0
+        return zlib.crc32(name.encode('utf-8')) % len(self.shards)
+
+    def _partition(self, rows: Iterable) -> Dict[int, list]:
+        """Group rows by the shard of the name in their first field."""
+        groups: Dict[int, list] = {}
+        for row in rows:
+            name = row[0] if isinstance(row, tuple) and row else None
+            groups.setdefault(self._shard_index(name), []).append(row)
+        return groups
+
+    def _submit(self, shard: WarehouseDB, method: str, *args) -> "Future":
+        """Start a read on one shard in the scatter-gather pool."""
+        with self._readers_lock:
+            if self._readers is None:
+                if self.processes:
+                    import multiprocessing
+                    from concurrent.futures import ProcessPoolExecutor
+                    self._readers = ProcessPoolExecutor(
+                        max_workers=self.processes,
+                        mp_context=multiprocessing.get_context("spawn"),
+                        initializer=_init_shard_worker)
+                else:
+                    from concurrent.futures import ThreadPoolExecutor
+                    self._readers = ThreadPoolExecutor(max_workers=len(self.shards),
+                                                       thread_name_prefix="shard-reader")
+            if self.processes:
+                return self._readers.submit(_shard_call, shard.db_name, self.profile,
+                                            method, args)
+            return self._readers.submit(_run_on_shard, shard, method, args)
+
+    def _scatter(self, method: str, *args) -> List[Any]:
+        """Run a read on every shard in parallel and return the per-shard results."""
+        futures = [self._submit(shard, method, *args) for shard in self.shards]
+        return [future.result() for future in futures]
+
+    @contextmanager
+    def transaction(self, names: Optional[Collection[str]] = None) -> Iterator["ShardedWarehouseDB"]:
+        """
+        Apply every write made inside the block as one transaction on one shard.
+
+        A transaction cannot span several database files, so the block must
+        name the products it writes up front, and they must all live on one
+        shard; see WarehouseDB.transaction for the rest. Writes to other
+        shards inside the block raise ValueError. Reads scattered to the
+        other shards do not see the block's uncommitted writes.
+
+        Raises:
+            ValueError: Before the block runs, if names is missing or spans
+                several shards
+        """
+        if getattr(self._local, "transaction_shard", None) is not None:
+            with self._local.transaction_shard.transaction():
+                yield self
+            return
+        if names is None:
+            raise ValueError("A sharded transaction must name the products it writes")
+        indexes = {self._shard_index(name) for name in names}
+        if len(indexes) > 1:
+            raise ValueError(f"The products are spread over {len(indexes)} shards; "
+                             "a transaction can only write to one")
+        shard = self.shards[indexes.pop() if indexes else 0]
+        with shard.transaction():
+            self._local.transaction_shard = shard
+            try:
+                yield self
+            finally:
+                self._local.transaction_shard = None
+
+    def _shard_for_write(self, name: str) -> WarehouseDB:
+        """Return the shard a write goes to, refusing shards outside the open transaction."""
+        shard = self.shard_for(name)
+        active = getattr(self._local, "transaction_shard", None)
+        if active is not None and shard is not active:
+            raise ValueError(f"'{name}' lives on another shard than this transaction")
+        return shard
+
+    # Single-product operations go straight to the owning shard
+
+    def add_product(self, name: str, price: int, amount: int) -> bool:
+        """Add a new product to its shard."""
+        return self._shard_for_write(name).add_product(name, price, amount)
+
+    def update_product(self, name: str, price: int, amount: int) -> bool:
+        """Update an existing product."""
+        return self._shard_for_write(name).update_product(name, price, amount)
+
+    def delete_product(self, name: str) -> bool:
+        """Delete a product by name."""
+        return self._shard_for_write(name).delete_product(name)
+
+    def get_product_by_name(self, name: str,
+                            location: Optional[str] = None) -> Optional[Tuple[str, int, int]]:
+        """Get a product by its exact name, with the amount held at location if given."""
+        return self.shard_for(name).get_product_by_name(name, location)
+
+    def adjust_stock(self, name: str, delta: int, timestamp: Optional[int] = None,
+                     location: Optional[str] = None) -> bool:
+        """Atomically change a product's stock, see WarehouseDB.adjust_stock."""
+        return self._shard_for_write(name).adjust_stock(name, delta, timestamp, location)
+
+    def transfer_stock(self, name: str, source: str, destination: str, quantity: int) -> bool:
+        """Move units between locations; a product's stock lives on one shard."""
+        return self._shard_for_write(name).transfer_stock(name, source, destination, quantity)
+
+    def get_product_locations(self, name: str) -> List[Tuple[str, int]]:
+        """Get the (location, amount) pairs of a product, default location first."""
+        return self.shard_for(name).get_product_locations(name)
+
+    # Every shard keeps its own copy of the locations table
+
+    def add_location(self, name: str) -> bool:
+        """
+        Add an empty stock location to every shard.
+
+        A shard that already has the location counts as done, so calling
+        again after a partial failure adds it to the shards that missed it.
+
+        Returns:
+            bool: True if every shard has the location and at least one shard
+            added it, False if the name was taken or a shard failed
+        """
+        if getattr(self._local, "transaction_shard", None) is not None:
+            raise ValueError("Locations cannot be added inside a sharded transaction")
+        added = [shard.add_location(name) for shard in self.shards]
+        present = [done or any(summary.location == name for summary in shard.get_locations())
+                   for done, shard in zip(added, self.shards)]
+        return any(added) and all(present)
+
+    def get_locations(self) -> List[LocationSummary]:
+        """Get every location with its totals summed over all shards."""
+        totals: Dict[str, LocationSummary] = {}
+        for summaries in self._scatter('get_locations'):
+            for summary in summaries:
+                known = totals.get(summary.location)
+                totals[summary.location] = summary if known is None else LocationSummary(
+                    summary.location, known.products + summary.products,
+                    known.units + summary.units, known.total_value + summary.total_value)
+        return list(totals.values())
+
+    def get_movement_summaries(self, name: str, first_period: Optional[str] = None,
+                               last_period: Optional[str] = None) -> List[MovementSummary]:
+        """Get the per-day movement totals of a product."""
+        return self.shard_for(name).get_movement_summaries(name, first_period, last_period)
+
+    def get_products_by_names(self, names: Iterable[str]) -> List[Tuple[str, int, int]]:
+        """Get the products with the given exact names; unknown names are skipped."""
+        results = []
+        for index, group in self._partition((name,) for name in names).items():
+            results.extend(self.shards[index].get_products_by_names(name for name, in group))
+        return results
+
+    # Bulk writes are split per shard and applied in parallel
+
+    def _write_groups(self, method: str, groups: Dict[int, list], *args) -> List[Any]:
+        """
+        Apply a bulk write's per-shard groups, one writer thread per shard.
+
+        Inside a transaction() the groups are applied on the calling thread,
+        which holds the shard's write lock, and may only target its shard.
+        """
+        active = getattr(self._local, "transaction_shard", None)
+        if active is None:
+            futures = [self._writers.submit(getattr(self.shards[index], method), group,
+                                            len(group), *args)
+                       for index, group in groups.items()]
+            return [future.result() for future in futures]
+        if any(self.shards[index] is not active for index in groups):
+            raise ValueError("A bulk write inside a sharded transaction must stay on its shard")
+        return [getattr(active, method)(group, len(group), *args) for group in groups.values()]
+
+    def bulk_upsert(self, rows: Iterable[Tuple[str, int, int]],
+                    batch_size: int = DEFAULT_BATCH_SIZE) -> List[BatchResult]:
+        """Insert or update many products, see WarehouseDB.bulk_upsert."""
+        if batch_size <= 0:
+            raise ValueError("batch_size must be positive")
+        results = []
+        iterator = iter(rows)
+        while True:
+            batch = list(islice(iterator, batch_size))
+            if not batch:
+                return results
+            shard_results = [result for group_results in self._write_groups(
+                'bulk_upsert', self._partition(batch)) for result in group_results]
+            results.append(BatchResult(len(results) + 1,
+                                       sum(r.inserted for r in shard_results),
+                                       sum(r.updated for r in shard_results),
+                                       sum(r.rejected for r in shard_results)))
+
+    def record_movements(self, movements: Iterable[Tuple[str, int]],
+                         batch_size: int = DEFAULT_BATCH_SIZE,
+                         timestamp: Optional[int] = None) -> List[MovementBatchResult]:
+        """Apply a stream of stock movements, see WarehouseDB.record_movements."""
+        if batch_size <= 0:
+            raise ValueError("batch_size must be positive")
+        results = []
+        iterator = iter(movements)
+        while True:
+            batch = list(islice(iterator, batch_size))
+            if not batch:
+                return results
+            applied = sum(r.applied for shard_results in self._write_groups(
+                'record_movements', self._partition(batch), timestamp) for r in shard_results)
+            results.append(MovementBatchResult(len(results) + 1, applied, len(batch) - applied))
+
+    # Reads are scattered to every shard and gathered
+
+    def find_products_by_partial_name(self, partial_name: str) -> List[Tuple[str, int, int]]:
+        """Find products by partial name (case insensitive)."""
+        return [row for rows in self._scatter('find_products_by_partial_name', partial_name)
+                for row in rows]
+
+    def find_products_scored(self, partial_name: str, limit: Optional[int] = None
+                             ) -> List[Tuple[float, str, int, int]]:
+        """
+        Find products by partial name with their relevance score, best first.
+
+        Scores are computed per shard, so relevance is approximate across shards.
+        """
+        merged = heapq.merge(*self._scatter('find_products_scored', partial_name, limit),
+                             key=lambda row: (row[0], row[1]))
+        return list(merged if limit is None else islice(merged, limit))
+
+    def find_products_ranked(self, partial_name: str,
+                             limit: Optional[int] = None) -> List[Tuple[str, int, int]]:
+        """Find products by partial name, best matches first."""
+        return [row[1:] for row in self.find_products_scored(partial_name, limit)]
+
+    def iter_products(self, order_by: str = ORDER_BY_NAME, page_size: int = DEFAULT_PAGE_SIZE,
+                      after: Optional[str] = None) -> Iterator[Tuple[str, int, int]]:
+        """
+        Stream all products in order, merging one keyset-paged stream per shard.
+
+        Each shard's next page is requested before its current page is
+        consumed, so shards are read in parallel with the merge. Resuming with
+        after is only supported when ordering by name, since (price, id) keys
+        are local to a shard.
+        """
+        if order_by not in (ORDER_BY_NAME, ORDER_BY_PRICE):
+            raise ValueError(f"Invalid sort key: {order_by}")
+        if page_size <= 0:
+            raise ValueError("page_size must be positive")
+        if order_by == ORDER_BY_PRICE and after is not None:
+            raise ValueError("Sharded price listings cannot resume after a key")
+
+        def stream(shard: WarehouseDB, future: "Future") -> Iterator[Tuple[str, int, int]]:
+            while True:
+                page, next_after = future.result()
+                if next_after is not None:
+                    future = self._submit(shard, 'get_products_page', order_by, page_size,
+                                          next_after)
+                yield from page
+                if next_after is None:
+                    return
+
+        streams = [stream(shard, self._submit(shard, 'get_products_page', order_by,
+                                              page_size, after))
+                   for shard in self.shards]
+        key = (lambda row: row[0]) if order_by == ORDER_BY_NAME else (lambda row: row[1])
+        yield from heapq.merge(*streams, key=key)
+
+    def get_all_products_by_name(self, location: Optional[str] = None
+                                 ) -> List[Tuple[str, int, int]]:
+        """Get all products (held at location if given) ordered by name."""
+        return list(heapq.merge(*self._scatter('get_all_products_by_name', location),
+                                key=lambda row: row[0]))
+
+    def get_all_products_by_price(self, location: Optional[str] = None
+                                  ) -> List[Tuple[str, int, int]]:
+        """Get all products (held at location if given) ordered by price."""
+        return list(heapq.merge(*self._scatter('get_all_products_by_price', location),
+                                key=lambda row: row[1]))
+
+    def get_products_in_price_range(self, min_price: int,
+                                    max_price: int) -> List[Tuple[str, int, int]]:
+        """Get products priced between min_price and max_price cents inclusive, cheapest first."""
+        return list(heapq.merge(*self._scatter('get_products_in_price_range',
+                                               min_price, max_price),
+                                key=lambda row: (row[1], row[0])))
+
+    def query(self, price_min: Optional[int] = None, price_max: Optional[int] = None,
+              amount_min: Optional[int] = None, name_prefix: Optional[str] = None,
+              order_by: str = ORDER_BY_NAME, limit: Optional[int] = None
+              ) -> Iterator[Tuple[str, int, int]]:
+        """Stream products matching all of the given filters, see WarehouseDB.query."""
+        self.shards[0]._prepare_query(price_min, price_max, amount_min, name_prefix,
+                                      order_by, limit)
+        results = self._scatter('query', price_min, price_max, amount_min, name_prefix,
+                                order_by, limit)
+        key = ((lambda row: row[0]) if order_by == ORDER_BY_NAME
+               else (lambda row: (row[1], row[0])))
+        merged = heapq.merge(*results, key=key)
+        yield from (merged if limit is None else islice(merged, limit))
+
+    def explain(self, *args, **kwargs) -> List[str]:
+        """Show the query plan of a query() call; every shard has the same schema."""
+        return self.shards[0].explain(*args, **kwargs)
+
+    def inventory_summary(self, location: Optional[str] = None) -> InventorySummary:
+        """Get product count, units in stock, stock value and price range, in cents."""
+        summaries = [s for s in self._scatter('inventory_summary', location) if s.products]
+        if not summaries:
+            return InventorySummary(0, 0, 0, None, None)
+        return InventorySummary(sum(s.products for s in summaries),
+                                sum(s.units for s in summaries),
+                                sum(s.total_value for s in summaries),
+                                min(s.min_price for s in summaries),
+                                max(s.max_price for s in summaries))
+
+    def low_stock(self, threshold: int,
+                  location: Optional[str] = None) -> List[Tuple[str, int, int]]:
+        """Get products with fewer than threshold units (at location if given), scarcest first."""
+        return list(heapq.merge(*self._scatter('low_stock', threshold, location),
+                                key=lambda row: (row[2], row[0])))
+
+    def price_histogram(self, bins: int) -> List[HistogramBin]:
+        """Count products and units in equal-width price bands across all shards."""
+        if bins <= 0:
+            raise ValueError("bins must be positive")
+        summary = self.inventory_summary()
+        if summary.products == 0:
+            return []
+        low, width = summary.min_price, max(summary.max_price - summary.min_price, 1)
+        totals: Dict[int, Tuple[int, int]] = {}
+        for counts in self._scatter('count_price_bands', low, width, bins):
+            for band, (products, units) in counts.items():
+                known_products, known_units = totals.get(band, (0, 0))
+                totals[band] = (known_products + products, known_units + units)
+        return [
+            HistogramBin(low + width * band / bins, low + width * (band + 1) / bins,
+                         *totals.get(band, (0, 0)))
+            for band in range(bins)
+        ]
+
+    def top_n_by_value(self, n: int) -> List[Tuple[str, int, int, int]]:
+        """Get the n products with the highest stock value (price * amount)."""
+        merged = heapq.merge(*self._scatter('top_n_by_value', n), key=lambda row: -row[3])
+        return list(islice(merged, n))
+
+    def changes_since(self, seq: ChangeSeq = 0,
+                      page_size: int = CHANGE_PAGE_SIZE) -> Iterator[Change]:
+        """
+        Stream the changelog entries of every shard recorded after seq.
+
+        Each shard keeps its own changelog, so the position is a tuple of one
+        sequence number per shard, and every yielded Change carries the tuple
+        to resume from after applying it. Entries of one product stay in
+        order, since a product lives on one shard; the shards' logs are
+        interleaved one entry at a time.
+
+        Args:
+            seq: seq of the last change already seen, or 0 for all
+            page_size: Entries fetched per query on each shard
+        """
+        cursor = list(self._change_cursor(seq))
+        streams = [(index, shard.changes_since(cursor[index], page_size))
+                   for index, shard in enumerate(self.shards)]
+        while streams:
+            active = []
+            for index, stream in streams:
+                change = next(stream, None)
+                if change is None:
+                    continue
+                cursor[index] = change.seq
+                yield change._replace(seq=tuple(cursor))
+                active.append((index, stream))
+            streams = active
+
+    def _change_cursor(self, seq: ChangeSeq) -> Tuple[int, ...]:
+        """Check a changelog position and spell it out per shard."""
+        if seq == 0:
+            return (0,) * len(self.shards)
+        if not isinstance(seq, tuple) or len(seq) != len(self.shards):
+            raise ValueError(f"Expected one sequence number per shard ({len(self.shards)}), got {seq!r}")
+        return seq
+
+    def last_change_seq(self) -> Tuple[int, ...]:
+        """Return the newest change ever recorded on each shard."""
+        return tuple(shard.last_change_seq() for shard in self.shards)
+
+    def compact_changes(self, up_to: Optional[ChangeSeq] = None,
+                        drop_deletes: bool = False) -> int:
+        """
+        Compact every shard's changelog up to the position up_to.
+
+        See WarehouseDB.compact_changes; up_to is a seq from changes_since()
+        or last_change_seq(), or None for every shard's whole log.
+        """
+        limits = [None] * len(self.shards) if up_to is None else self._change_cursor(up_to)
+        counts = [shard.compact_changes(limit, drop_deletes)
+                  for shard, limit in zip(self.shards, limits)]
+        return -1 if -1 in counts else sum(counts)
+
+    def _iter_table(self, size: int = COLUMNAR_GROUP_SIZE) -> Iterator[List[Tuple[str, int, int]]]:
+        """Yield every product shard by shard, in chunks of at most size rows."""
+        for shard in self.shards:
+            yield from shard._iter_table(size)
+
+    # The exporters only read through _iter_table and the importers only
+    # write through bulk_upsert, so WarehouseDB's implementations apply as is
+    export_csv = WarehouseDB.export_csv
+    export_jsonl = WarehouseDB.export_jsonl
+    export_columnar = WarehouseDB.export_columnar
+    import_csv = WarehouseDB.import_csv
+    import_jsonl = WarehouseDB.import_jsonl
+    import_columnar = WarehouseDB.import_columnar
+
+
+# warehouse.py - Business Logic Layer
+
+# Default number of products kept by the product lookup cache
+DEFAULT_CACHE_SIZE = 4096
+
+# Distinct prices kept as shared Money instances by Money.of
+MONEY_INTERN_SIZE = 65_536
+
+# Precision money amounts are rounded to when parsed
+ONE_CENT = Decimal("0.01")
+
+
+class Money:
+    """
+    An exact amount of euros, stored as an integer number of cents.
+
+    Amounts are parsed through Decimal, so "19.99" and 19.99 both become
+    1999 cents; anything finer than a cent is rounded half up.
+
+    Prices used to be floats, so Money stands in for one: it equals ints
+    and floats and hashes like them, Money(1000) == 10 and
+    Money(1999) == 19.99. A float is compared as the decimal it was written
+    as, its shortest repr, just as Money.parse reads it, so
+    Money(1999) < 19.995 whatever the float's binary error. Decimals and
+    Fractions hash by their exact value instead, so Money orders against
+    them but never equals them: Money(1999) != Decimal("19.99").
+
+    Adding or subtracting a number adds or subtracts that many euros, and
+    multiplying or dividing by one rounds the result half up to a cent;
+    both give Money. Dividing two amounts gives their ratio as a float.
+    Instances are immutable and may be shared.
+    """
+    __slots__ = ("cents",)
+
+    def __init__(self, cents: int):
+        if not isinstance(cents, int) or isinstance(cents, bool):
+            raise TypeError("Money needs a whole number of cents")
+        object.__setattr__(self, "cents", cents)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("Money is immutable")
+
+    @staticmethod
+    def of(cents: int) -> "Money":
+        """Return a shared Money for a number of cents; listings reuse one per price."""
+        money = _MONEY_INTERN.get(cents)
+        if money is None:
+            # Values read from the database are already validated ints, so
+            # skip __init__ and fill the slot directly
+            money = object.__new__(Money)
+            _set_cents(money, cents)
+            if len(_MONEY_INTERN) < MONEY_INTERN_SIZE:
+                _MONEY_INTERN[cents] = money
+        return money
+
+    @classmethod
+    def parse(cls, value: "MoneyLike") -> "Money":
+        """
+        Convert an amount of euros to Money without binary rounding errors.
+
+        Args:
+            value: Money, an int or Decimal number of euros, a string such as
+                "19.99" or "€19.99", or a float, which is read as its
+                shortest repr (19.99 -> "19.99")
+
+        Raises:
+            ValueError: If the value is not a finite amount
+            TypeError: If the value is not a supported type
+        """
+        if isinstance(value, Money):
+            return value
+        if isinstance(value, bool):
+            raise TypeError("Cannot convert bool to Money")
+        if isinstance(value, int):
+            return cls(value * 100)
+        try:
+            if isinstance(value, float):
+                amount = Decimal(repr(value))
+            elif isinstance(value, str):
+                amount = Decimal(value.strip().lstrip("€").strip())
+            elif isinstance(value, Decimal):
+                amount = value
+            else:
+                raise TypeError(f"Cannot convert {type(value).__name__} to Money")
+            if not amount.is_finite():
+                raise ValueError(f"Not a finite amount of money: {value!r}")
+            return cls(int(amount.quantize(ONE_CENT, ROUND_HALF_UP).scaleb(2)))
+        except InvalidOperation:
+            raise ValueError(f"Not an amount of money: {value!r}") from None
+
+    def to_decimal(self) -> Decimal:
+        """Return the amount in euros as an exact Decimal."""
+        return Decimal(self.cents).scaleb(-2)
+
+    def __float__(self) -> float:
+        return self.cents / 100
+
+    def __str__(self) -> str:
+        sign = "-" if self.cents < 0 else ""
+        euros, cents = divmod(abs(self.cents), 100)
+        return f"{sign}{euros}.{cents:02d}"
+
+    def __repr__(self) -> str:
+        return f"Money('{self}')"
+
+    def __format__(self, spec: str) -> str:
+        # Decimal formatting is exact, so f"{price:.2f}" never shows float noise
+        return format(self.to_decimal(), spec) if spec else str(self)
+
+    def __bool__(self) -> bool:
+        return self.cents != 0
+
+    def __hash__(self) -> int:
+        # Equal to the hash of the int or float it equals
+        if self.cents % 100 == 0:
+            return hash(self.cents // 100)
+        return hash(self.cents / 100)
+
+    def _compare(self, other, op: Callable[[Any, Any], bool]):
+        if isinstance(other, Money):
+            return op(self.cents, other.cents)
+        if isinstance(other, int):
+            return op(self.cents, other * 100)
+        if isinstance(other, float):
+            if not math.isfinite(other):
+                return op(self.cents / 100, other)
+            other = Decimal(repr(other))
+        if isinstance(other, (Decimal, Fraction)):
+            return op(Fraction(self.cents, 100), other)
+        return NotImplemented
+
+    def __eq__(self, other):
+        if isinstance(other, (Decimal, Fraction)):
+            return NotImplemented
+        return self._compare(other, operator.eq)
+
+    def __lt__(self, other):
+        return self._compare(other, operator.lt)
+
+    def __le__(self, other):
+        return self._compare(other, operator.le)
+
+    def __gt__(self, other):
+        return self._compare(other, operator.gt)
+
+    def __ge__(self, other):
+        return self._compare(other, operator.ge)
+
+    @staticmethod
+    def _amount(value) -> Optional["Money"]:
+        """Return a number of euros as Money, or None if it is not a number."""
+        if isinstance(value, Money):
+            return value
+        if isinstance(value, (int, float, Decimal)) and not isinstance(value, bool):
+            return Money.parse(value)
+        return None
+
+    @staticmethod
+    def _factor(value) -> Optional[Fraction]:
+        """Return a scale factor exactly, or None if it is not a number."""
+        if isinstance(value, bool):
+            return None
+        if isinstance(value, (int, Fraction)):
+            return Fraction(value)
+        if isinstance(value, float):
+            value = Decimal(repr(value))
+        if isinstance(value, Decimal):
+            if not value.is_finite():
+                raise ValueError(f"Not a finite factor: {value!r}")
+            return Fraction(value)
+        return None
+
+    @staticmethod
+    def _round(cents: Fraction) -> "Money":
+        """Round a fraction of cents half up, away from zero as Money.parse does."""
+        whole = math.floor(abs(cents) + Fraction(1, 2))
+        return Money(whole if cents >= 0 else -whole)
+
+    def __add__(self, other):
+        other = Money._amount(other)
+        if other is None:
+            return NotImplemented
+        return Money(self.cents + other.cents)
+
+    # Also lets sum() start from 0
+    __radd__ = __add__
+
+    def __sub__(self, other):
+        other = Money._amount(other)
+        if other is None:
+            return NotImplemented
+        return Money(self.cents - other.cents)
+
+    def __rsub__(self, other):
+        other = Money._amount(other)
+        if other is None:
+            return NotImplemented
+        return Money(other.cents - self.cents)
+
+    def __neg__(self):
+        return Money(-self.cents)
+
+    def __mul__(self, other):
+        # Price times a quantity in stock
+        if isinstance(other, int) and not isinstance(other, bool):
+            return Money(self.cents * other)
+        factor = Money._factor(other)
+        if factor is None:
+            return NotImplemented
+        return Money._round(self.cents * factor)
+
+    __rmul__ = __mul__
+
+    def __truediv__(self, other):
+        if isinstance(other, Money):
+            return self.cents / other.cents
+        factor = Money._factor(other)
+        if factor is None:
+            return NotImplemented
+        return Money._round(self.cents / factor)
+
+
+# Values accepted wherever a price in euros is passed in
+MoneyLike = Union[Money, Decimal, str, int, float]
+
+# Shared Money instances by cents, filled by Money.of up to MONEY_INTERN_SIZE
+_MONEY_INTERN: Dict[int, Money] = {}
+_set_cents = Money.__dict__["cents"].__set__
+
+
+def money_rows(rows: Iterable[Tuple[str, int, int]]) -> List[Tuple[str, Money, int]]:
+    """
+    Convert (name, price_cents, amount) rows to Money prices in one pass.
+
+    Prices repeat across a catalogue, so each distinct price becomes one
+    shared Money instance instead of a new object per row.
+    """
+    shared, of = _MONEY_INTERN.get, Money.of
+    return [(name, shared(cents) or of(cents), amount) for name, cents, amount in rows]
+
+
+class CacheStats(NamedTuple):
+    """Counters describing the effectiveness of a ProductCache."""
+    hits: int
+    misses: int
+    evictions: int
+    expirations: int
+    size: int
+    max_size: int
+
+
+class ProductCache:
+    """
+    Thread-safe bounded LRU cache with an optional time-to-live.
+
+    Writers bracket their database changes with begin_write()/end_write().
+    While a write is in flight, and for any lookup that started before it,
+    results are not stored, so a reader can never re-cache a value that a
+    concurrent writer is replacing.
+    """
+
+    def __init__(self, max_size: int = DEFAULT_CACHE_SIZE, ttl: Optional[float] = None,
+                 clock: Callable[[], float] = time.monotonic):
+        """
+        Create an empty cache.
+
+        Args:
+            max_size: Maximum number of entries; 0 disables caching
+            ttl: Seconds an entry stays valid, or None to keep it until evicted
+            clock: Monotonic time source, replaceable for testing
+        """
+        if max_size < 0:
+            raise ValueError("max_size cannot be negative")
+        if ttl is not None and ttl <= 0:
+            raise ValueError("ttl must be positive")
+        self.max_size = max_size
+        self.ttl = ttl
+        self._clock = clock
+        self._entries: "OrderedDict[Hashable, Tuple[Any, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._generation = 0
+        self._pending_writes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def __contains__(self, key: Hashable) -> bool:
+        with self._lock:
+            return key in self._entries
+
+    def get(self, key: Hashable) -> Tuple[bool, Any, int]:
+        """
+        Look up a key.
+
+        Returns:
+            Tuple[bool, Any, int]: Whether the key was found, its value, and a
+            token to pass to put() when the value has to be loaded
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                value, expires = entry
+                if expires >= self._clock():
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return True, value, self._generation
+                del self._entries[key]
+                self.expirations += 1
+            self.misses += 1
+            return False, None, self._generation
+
+    def put(self, key: Hashable, value: Any, token: int):
+        """Store a value loaded after get() returned the given token."""
+        with self._lock:
+            if self.max_size == 0 or self._pending_writes or token != self._generation:
+                return
+            expires = float("inf") if self.ttl is None else self._clock() + self.ttl
+            self._entries[key] = (value, expires)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def begin_write(self):
+        """Mark the start of a database write; loads in flight are discarded."""
+        with self._lock:
+            self._pending_writes += 1
+            self._generation += 1
+
+    def end_write(self, keys: Iterable[Hashable] = ()):
+        """Invalidate the keys a completed write touched and resume caching."""
+        with self._lock:
+            for key in keys:
+                self._entries.pop(key, None)
+            self._pending_writes -= 1
+            self._generation += 1
+
+    def clear(self):
+        """Drop every entry."""
+        with self._lock:
+            self._entries.clear()
+            self._generation += 1
+
+    def stats(self) -> CacheStats:
+        """Return the current cache counters."""
+        with self._lock:
+            return CacheStats(self.hits, self.misses, self.evictions, self.expirations,
+                              len(self._entries), self.max_size)
+
+
+# Bulk writes touching more products than this reload the in-memory mirror
+# instead of refreshing the touched products one by one
+MIRROR_REFRESH_LIMIT = 100_000
+
+
+class ProductMirror:
+    """
+    In-process columnar snapshot of the products table.
+
+    Names, prices (cents) and amounts live in parallel columns indexed by a
+    slot number. Two permutations of the live slots, kept sorted by name and
+    by (price, name), serve sorted listings, price ranges and counts without
+    querying SQLite. Changes are applied one product at a time, so a write
+    costs a binary search plus a list insertion rather than a re-sort.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self.clear()
+
+    def clear(self):
+        """Drop every product."""
+        with self._lock:
+            self.names: List[Optional[str]] = []
+            self.prices = array('q')
+            self.amounts = array('q')
+            self._rows: List[Optional[Tuple[str, Money, int]]] = []
+            self._slots: Dict[str, int] = {}
+            self._free: List[int] = []
+            self._name_order: List[int] = []
+            self._price_order: List[int] = []
+            self._listings: Dict[str, List[Tuple[str, Money, int]]] = {}
+
+    def load(self, rows: Iterable[Tuple[str, int, int]]):
+        """Replace the contents with (name, price_cents, amount) rows."""
+        with self._lock:
+            self.clear()
+            for name, price, amount in rows:
+                self._slots[name] = len(self.names)
+                self.names.append(name)
+                self.prices.append(price)
+                self.amounts.append(amount)
+                self._rows.append((name, Money.of(price), amount))
+            slots = range(len(self.names))
+            self._name_order = sorted(slots, key=self.names.__getitem__)
+            self._price_order = sorted(slots, key=self._price_key)
+
+    def _price_key(self, slot: int) -> Tuple[int, str]:
+        return self.prices[slot], self.names[slot]
+
+    def apply(self, name: str, row: Optional[Tuple[str, int, int]]):
+        """
+        Bring one product up to date.
+
+        Args:
+            name: The name of the product
+            row: Its current (name, price_cents, amount), or None if it no longer exists
+        """
+        with self._lock:
+            self._listings.clear()
+            slot = self._slots.get(name)
+            if slot is not None:
+                if row is not None and row[1] == self.prices[slot]:
+                    # Neither sort position changes
+                    self.amounts[slot] = row[2]
+                    self._rows[slot] = (name, Money.of(row[1]), row[2])
+                    return
+                del self._price_order[self._position(self._price_order, slot, self._price_key)]
+                if row is None:
+                    del self._name_order[self._position(self._name_order, slot,
+                                                        self.names.__getitem__)]
+                    del self._slots[name]
+                    self.names[slot] = None
+                    self._rows[slot] = None
+                    self._free.append(slot)
+                    return
+            elif row is None:
+                return
+            else:
+                if self._free:
+                    slot = self._free.pop()
+                else:
+                    slot = len(self.names)
+                    self.names.append(None)
+                    self.prices.append(0)
+                    self.amounts.append(0)
+                    self._rows.append(None)
+                self.names[slot] = name
+                self._slots[name] = slot
+                insort(self._name_order, slot, key=self.names.__getitem__)
+
+            _, price, amount = row
+            self.prices[slot] = price
+            self.amounts[slot] = amount
+            self._rows[slot] = (name, Money.of(price), amount)
+            insort(self._price_order, slot, key=self._price_key)
+
+    @staticmethod
+    def _position(order: List[int], slot: int, key: Callable[[int], Any]) -> int:
+        """Find the index of a slot in a sorted permutation."""
+        return bisect_left(order, key(slot), key=key)
+
+    def refresh(self, db: "WarehouseDB", names: Collection[str]):
+        """
+        Re-read the given products from the database and apply them.
+
+        The read happens under the mirror's lock, so concurrent refreshes
+        apply their rows in the order they read them: a refresh that read
+        before another writer committed can never overwrite the newer rows
+        of the refresh that follows it.
+        """
+        with self._lock:
+            current = {row[0]: row for row in db.get_products_by_names(names)}
+            for name in names:
+                self.apply(name, current.get(name))
+
+    def __len__(self) -> int:
+        return len(self._slots)
+
+    def listing(self, order_by: str) -> List[Tuple[str, Money, int]]:
+        """Get all products as (name, price, amount), sorted by name or price."""
+        with self._lock:
+            listing = self._listings.get(order_by)
+            if listing is None:
+                order = self._name_order if order_by == ORDER_BY_NAME else self._price_order
+                rows = self._rows
+                listing = self._listings[order_by] = [rows[slot] for slot in order]
+            # Callers get their own list; the tuples are immutable and shared
+            return list(listing)
+
+    def price_range(self, min_cents: int, max_cents: int) -> List[Tuple[str, Money, int]]:
+        """Get products priced within [min_cents, max_cents], cheapest first."""
+        with self._lock:
+            order = self._price_order
+            prices = self.prices.__getitem__
+            start = bisect_left(order, min_cents, key=prices)
+            end = bisect_right(order, max_cents, key=prices)
+            rows = self._rows
+            return [rows[slot] for slot in order[start:end]]
+
+
+class Warehouse:
+    def __init__(self, db_name: str = "warehouse.db",
+                 profile: PerformanceProfile = DEFAULT_PROFILE,
+                 pooled: bool = False,
+                 cache_size: int = DEFAULT_CACHE_SIZE,
+                 cache_ttl: Optional[float] = None,
+                 mirror: bool = False,
+                 shards: int = 1,
+                 instrumentation: Optional[QueryInstrumentation] = None):
+        """
+        Open the warehouse.
+
+        Args:
+            db_name: Path of the SQLite database file
+            profile: Connection tuning, see PerformanceProfile
+            pooled: Make the warehouse safe to share between threads
+            cache_size: Products kept by the get_product_by_name cache (0 disables it)
+            cache_ttl: Seconds a cached product stays valid, or None for no expiry
+            mirror: Keep an in-memory ProductMirror that serves sorted listings,
+                price ranges and counts; only writes made through this
+                Warehouse are reflected in it
+            shards: Spread products over this many database files with a
+                ShardedWarehouseDB (always thread-safe); 1 uses a single file
+            instrumentation: Record per-statement timings and log slow
+                queries, see QueryInstrumentation and stats()
+        """
+        if shards > 1:
+            self.db = ShardedWarehouseDB(db_name, shards, profile,
+                                         instrumentation=instrumentation)
+        else:
+            self.db = WarehouseDB(db_name, profile, pooled, instrumentation)
+        self.cache = ProductCache(cache_size, cache_ttl)
+        # Thread inside transaction() and the products its writes touched
+        self._transaction_owner: Optional[int] = None
+        self._transaction_names: set = set()
+        self.mirror: Optional[ProductMirror] = None
+        if mirror:
+            self.mirror = ProductMirror()
+            self.mirror.load(row for rows in self.db._iter_table() for row in rows)
+
+    def close(self):
+        """Close the database connection."""
+        self.db.close()
 
-    def get_product_by_name(self, name: str) -> Optional[Tuple[str, int, int]]:
-        """Get a product by its exact name."""
-        try:
-            self.cursor.execute('SELECT name, price, amount FROM products WHERE name = ?', (name,))
-            result = self.cursor.fetchone()
-            return result if result else None
-        except Exception as e:
-            print(f"Error getting product: {e}")
-            return None
+    @contextmanager
+    def transaction(self, names: Optional[Collection[str]] = None) -> Iterator["Warehouse"]:
+        """
+        Apply every write made inside the block atomically.
 
-    def find_products_by_partial_name(self, partial_name: str) -> List[Tuple[str, int, int]]:
-        """Find products by partial name (case insensitive)."""
+        See WarehouseDB.transaction; a sharded warehouse needs the names of
+        the products the block writes. Lookups inside the block see its writes.
+        The cache takes no new entries while the block runs, and once it
+        commits or rolls back the cache and mirror catch up with every
+        product it touched, so other threads never see uncommitted writes.
+        """
+        if self._transaction_owner == threading.get_ident():
+            with self.db.transaction(names):
+                yield self
+            return
+        touched: set = set()
+        self.cache.begin_write()
         try:
-            self.cursor.execute(
-                'SELECT name, price, amount FROM products WHERE name LIKE ? COLLATE NOCASE',
-                (f'%{partial_name}%',)
-            )
-            return self.cursor.fetchall()
-        except Exception as e:
-            print(f"Error finding products: {e}")
-            return []
+            with self.db.transaction(names):
+                self._transaction_owner = threading.get_ident()
+                self._transaction_names = touched
+                try:
+                    yield self
+                finally:
+                    self._transaction_owner = None
+        finally:
+            self._finish_write(touched)
+
+    def backup(self, path: str, pages_per_step: int = DEFAULT_BACKUP_PAGES,
+               max_bytes_per_second: Optional[float] = None,
+               progress: Optional[Callable[[int, int], None]] = None
+               ) -> Optional[BackupResult]:
+        """
+        Back up the warehouse to path while it stays in use.
+
+        Args:
+            path: File to write the backup to
+            pages_per_step: Database pages copied per step; smaller steps let
+                writers in more often
+            max_bytes_per_second: Limit the backup's I/O rate, or None for full speed
+            progress: Called after each step with (pages copied, total pages)
+
+        Returns:
+            Optional[BackupResult]: Size, duration and throughput, or None on error
+        """
+        return self.db.backup(path, pages_per_step, max_bytes_per_second, progress)
 
-    def get_all_products_by_name(self) -> List[Tuple[str, int, int]]:
-        """Get all products ordered by name."""
+    def restore(self, path: str) -> bool:
+        """Replace the warehouse contents with a backup made by backup()."""
+        self.cache.begin_write()
         try:
-            self.cursor.execute('SELECT name, price, amount FROM products ORDER BY name ASC')
-            return self.cursor.fetchall()
-        except Exception as e:
-            print(f"Error getting products by name: {e}")
-            return []
+            return self.db.restore(path)
+        finally:
+            self.cache.clear()
+            self.cache.end_write()
+            if self.mirror is not None:
+                self.mirror.load(row for rows in self.db._iter_table() for row in rows)
+
+    @contextmanager
+    def _writing(self, names: Collection[str]):
+        """
+        Bracket a database write so the cache and mirror follow it.
 
-    def get_all_products_by_price(self) -> List[Tuple[str, int, int]]:
-        """Get all products ordered by price."""
+        Args:
+            names: Products the write touches. Bulk writes pass a set that
+                _track() fills while the write runs.
+        """
+        self.cache.begin_write()
         try:
-            self.cursor.execute('SELECT name, price, amount FROM products ORDER BY price ASC')
-            return self.cursor.fetchall()
-        except Exception as e:
-            print(f"Error getting products by price: {e}")
-            return []
+            yield
+        finally:
+            if self._transaction_owner == threading.get_ident():
+                # Other threads must not see the write before the block commits;
+                # transaction() brings the mirror up to date afterwards
+                self._transaction_names.update(names)
+                self._finish_write(names, refresh_mirror=False)
+            else:
+                self._finish_write(names)
 
+    def _finish_write(self, names: Collection[str], refresh_mirror: bool = True):
+        """End a write begun with cache.begin_write() and bring the cache and mirror up to date."""
+        overflow = len(names) > MIRROR_REFRESH_LIMIT
+        if overflow:
+            self.cache.clear()
+        self.cache.end_write(() if overflow else names)
+        if self.mirror is not None and refresh_mirror:
+            if overflow:
+                self.mirror.load(row for rows in self.db._iter_table() for row in rows)
+            else:
+                self.mirror.refresh(self.db, names)
 
-# warehouse.py - Business Logic Layer
-class Warehouse:
-    def __init__(self, db_name: str = "warehouse.db"):
-        self.db = WarehouseDB(db_name)
+    def _track(self, rows: Iterable, names: set) -> Iterator:
+        """
+        Pass bulk rows through while noting which products they touch.
 
-    def close(self):
-        """Close the database connection."""
-        self.db.close()
+        Only names the cache holds need invalidating, which bounds the set by
+        the cache size. With a mirror every name is needed, up to
+        MIRROR_REFRESH_LIMIT, past which _writing() reloads everything.
+        """
+        for row in rows:
+            name = row[0] if isinstance(row, tuple) and row else None
+            if (isinstance(name, str) and len(names) <= MIRROR_REFRESH_LIMIT
+                    and (self.mirror is not None or name in self.cache)):
+                names.add(name)
+            yield row
 
-    def add_product(self, name: str, price_euros: float, amount: int) -> bool:
+    def add_product(self, name: str, price_euros: MoneyLike, amount: int) -> bool:
         """
         Add a new product to the warehouse.
         
         Args:
             name: The name of the product
-            price_euros: The price in euros (will be converted to cents)
+            price_euros: The price in euros, see Money.parse
             amount: The quantity in stock
             
         Returns:
             bool: True if the product was added successfully, False otherwise
         """
-        if not name or price_euros < 0 or amount < 0:
+        try:
+            price = Money.parse(price_euros)
+        except (TypeError, ValueError):
+            return False
+        if not name or price.cents < 0 or amount < 0:
             return False
         
-        # Convert euros to cents
-        price_cents = int(price_euros * 100)
-        
-        return self.db.add_product(name, price_cents, amount)
+        with self._writing((name,)):
+            return self.db.add_product(name, price.cents, amount)
 
-    def update_product(self, name: str, price_euros: float, amount: int) -> bool:
+    def update_product(self, name: str, price_euros: MoneyLike, amount: int) -> bool:
         """
         Update an existing product.
         
         Args:
             name: The name of the product
-            price_euros: The new price in euros (will be converted to cents)
+            price_euros: The new price in euros, see Money.parse
             amount: The new quantity in stock
             
         Returns:
             bool: True if the product was updated successfully, False otherwise
         """
-        if not name or price_euros < 0 or amount < 0:
+        try:
+            price = Money.parse(price_euros)
+        except (TypeError, ValueError):
+            return False
+        if not name or price.cents < 0 or amount < 0:
             return False
         
-        # Convert euros to cents
-        price_cents = int(price_euros * 100)
-        
-        return self.db.update_product(name, price_cents, amount)
+        with self._writing((name,)):
+            return self.db.update_product(name, price.cents, amount)
+
+    def import_products(self, products: Iterable[Tuple[str, Money, int]],
+                        batch_size: int = DEFAULT_BATCH_SIZE) -> List[BatchResult]:
+        """
+        Import or update many products in batched transactions.
+
+        Args:
+            products: Iterable of (name, price_euros, amount) tuples; prices
+                are converted with Money.parse
+            batch_size: Maximum number of rows written per transaction
+
+        Returns:
+            List[BatchResult]: Inserted, updated and rejected counts per batch
+        """
+        def to_cents(products):
+            for product in products:
+                try:
+                    name, price_euros, amount = product
+                except (TypeError, ValueError):
+                    name, price_euros, amount = product, None, None
+                try:
+                    yield name, Money.parse(price_euros).cents, amount
+                except (TypeError, ValueError):
+                    # Passed on malformed so the database layer counts it as rejected
+                    yield name, None, amount
+
+        names = set()
+        with self._writing(names):
+            return self.db.bulk_upsert(self._track(to_cents(products), names), batch_size)
+
+    def inventory_summary(self, location: Optional[str] = None) -> InventorySummary:
+        """Get product count, units in stock, total stock value and price range as Money."""
+        products, units, value, min_price, max_price = self.db.inventory_summary(location)
+        return InventorySummary(products, units, Money(value),
+                                None if min_price is None else Money.of(min_price),
+                                None if max_price is None else Money.of(max_price))
+
+    def low_stock(self, threshold: int,
+                  location: Optional[str] = None) -> List[Tuple[str, Money, int]]:
+        """Get products with fewer than threshold units, at location if given."""
+        return money_rows(self.db.low_stock(threshold, location))
+
+    def price_histogram(self, bins: int) -> List[HistogramBin]:
+        """Count products and units in equal-width price bands, bounds rounded to the cent."""
+        return [HistogramBin(Money(round(low)), Money(round(high)), products, units)
+                for low, high, products, units in self.db.price_histogram(bins)]
+
+    def top_n_by_value(self, n: int) -> List[Tuple[str, Money, int, Money]]:
+        """Get the n products with the highest stock value, as (name, price, amount, value)."""
+        return [(name, Money.of(price_cents), amount, Money(value_cents))
+                for name, price_cents, amount, value_cents in self.db.top_n_by_value(n)]
+
+    def export_products(self, path: str, file_format: Optional[str] = None) -> int:
+        """
+        Stream all products to a file.
+
+        Args:
+            path: Destination file
+            file_format: FORMAT_CSV, FORMAT_JSONL or FORMAT_COLUMNAR; detected
+                from the file extension when omitted
+
+        Returns:
+            int: Number of products written
+        """
+        exporters = {FORMAT_CSV: self.db.export_csv, FORMAT_JSONL: self.db.export_jsonl,
+                     FORMAT_COLUMNAR: self.db.export_columnar}
+        file_format = file_format or detect_file_format(path)
+        if file_format not in exporters:
+            raise ValueError(f"Unknown file format: {file_format}")
+        return exporters[file_format](path)
+
+    def import_file(self, path: str, file_format: Optional[str] = None,
+                    batch_size: int = DEFAULT_BATCH_SIZE) -> List[BatchResult]:
+        """
+        Insert or update products from a file written by export_products.
+
+        Args:
+            path: Source file
+            file_format: FORMAT_CSV, FORMAT_JSONL or FORMAT_COLUMNAR; detected
+                from the file extension when omitted
+            batch_size: Maximum number of rows written per transaction
+
+        Returns:
+            List[BatchResult]: Inserted, updated and rejected counts per batch
+        """
+        readers = {FORMAT_CSV: read_csv_products, FORMAT_JSONL: read_jsonl_products,
+                   FORMAT_COLUMNAR: read_columnar_products}
+        file_format = file_format or detect_file_format(path)
+        if file_format not in readers:
+            raise ValueError(f"Unknown file format: {file_format}")
+
+        names = set()
+        with self._writing(names):
+            return self.db.bulk_upsert(self._track(readers[file_format](path), names),
+                                       batch_size)
+
+    def adjust_stock(self, name: str, delta: int, location: Optional[str] = None) -> bool:
+        """
+        Atomically add units to (positive delta) or remove units from
+        (negative delta) a product's stock, recording the movement.
+
+        Args:
+            name: The name of the product
+            delta: Signed change in the quantity in stock
+            location: Location whose stock changes; None for DEFAULT_LOCATION
+
+        Returns:
+            bool: True if the stock was adjusted, False if the product does not
+            exist or does not have enough stock
+        """
+        if not name:
+            return False
+
+        with self._writing((name,)):
+            return self.db.adjust_stock(name, delta, location=location)
+
+    def transfer_stock(self, name: str, source: str, destination: str, quantity: int) -> bool:
+        """
+        Move units of a product between two locations as one transaction.
+
+        Returns:
+            bool: True if moved, False if the product or a location does not
+            exist or the source holds fewer than quantity units
+        """
+        if not name:
+            return False
+        # The total stays the same, so the cache and mirror are still valid
+        return self.db.transfer_stock(name, source, destination, quantity)
+
+    def add_location(self, name: str) -> bool:
+        """Add an empty stock location; False if the name is empty or taken."""
+        if not name or not name.strip():
+            return False
+        return self.db.add_location(name.strip())
+
+    def get_locations(self) -> List[LocationSummary]:
+        """Get every location with its product count, units and stock value as Money."""
+        return [summary._replace(total_value=Money(summary.total_value))
+                for summary in self.db.get_locations()]
+
+    def get_product_locations(self, name: str) -> List[Tuple[str, int]]:
+        """Get the (location, amount) pairs of a product, default location first."""
+        return self.db.get_product_locations(name)
+
+    def record_movements(self, movements: Iterable[Tuple[str, int]],
+                         batch_size: int = DEFAULT_BATCH_SIZE) -> List[MovementBatchResult]:
+        """
+        Apply a high-rate stream of (name, delta) stock movements in batches.
+
+        Returns:
+            List[MovementBatchResult]: Applied and rejected counts per batch
+        """
+        names = set()
+        with self._writing(names):
+            return self.db.record_movements(self._track(movements, names), batch_size)
+
+    def get_movement_summaries(self, name: str, first_period: Optional[str] = None,
+                               last_period: Optional[str] = None) -> List[MovementSummary]:
+        """Get the per-day (YYYY-MM-DD) inbound/outbound totals of a product."""
+        return self.db.get_movement_summaries(name, first_period, last_period)
+
+    def changes_since(self, seq: ChangeSeq = 0) -> Iterator[Change]:
+        """
+        Stream every product change recorded after seq, with prices as Money.
+
+        Consumers keep the seq of the last change they applied and pass it
+        back to receive only newer inserts, updates and deletes. On a sharded
+        warehouse seq is a tuple with one entry per shard.
+        """
+        for change in self.db.changes_since(seq):
+            if change.price is None:
+                yield change
+            else:
+                yield change._replace(price=Money.of(change.price))
+
+    def compact_changes(self, up_to: Optional[ChangeSeq] = None,
+                        drop_deletes: bool = False) -> int:
+        """Keep only the newest change per product, see WarehouseDB.compact_changes."""
+        return self.db.compact_changes(up_to, drop_deletes)
 
     def delete_product(self, name: str) -> bool:
         """Delete a product by name."""
         if not name:
             return False
         
-        return self.db.delete_product(name)
+        with self._writing((name,)):
+            return self.db.delete_product(name)
 
-    def get_product_by_name(self, name: str) -> Optional[Tuple[str, float, int]]:
-        """Get a product by its exact name, with price converted to euros."""
+    def get_product_by_name(self, name: str,
+                            location: Optional[str] = None) -> Optional[Tuple[str, Money, int]]:
+        """Get a product by its exact name, with the amount held at location if given."""
+        if location is not None:
+            # The cache and mirror only hold totals across all locations
+            result = self.db.get_product_by_name(name, location)
+            if result is None:
+                return None
+            name, price_cents, amount = result
+            return name, Money.of(price_cents), amount
+        found, product, token = self.cache.get(name)
+        if found:
+            return product
         result = self.db.get_product_by_name(name)
         if result:
             name, price_cents, amount = result
-            return name, price_cents / 100, amount
+            product = name, Money.of(price_cents), amount
+            # Only hits are cached; a miss may be a transient database error
+            self.cache.put(name, product, token)
+            return product
         return None
 
-    def find_products_by_partial_name(self, partial_name: str) -> List[Tuple[str, float, int]]:
-        """Find products by partial name, with prices converted to euros."""
-        results = self.db.find_products_by_partial_name(partial_name)
-        return [(name, price_cents / 100, amount) for name, price_cents, amount in results]
-
-    def get_all_products_by_name(self) -> List[Tuple[str, float, int]]:
-        """Get all products ordered by name, with prices converted to euros."""
-        results = self.db.get_all_products_by_name()
-        return [(name, price_cents / 100, amount) for name, price_cents, amount in results]
-
-    def get_all_products_by_price(self) -> List[Tuple[str, float, int]]:
-        """Get all products ordered by price, with prices converted to euros."""
-        results = self.db.get_all_products_by_price()
-        return [(name, price_cents / 100, amount) for name, price_cents, amount in results]
-
-
-# ui.py - User Interface Layer
-class WarehouseUI:
-    def __init__(self, warehouse: Warehouse):
-        self.warehouse = warehouse
-
-    def display_menu(self):
-        """Display the main menu."""
-        print("\n===== Warehouse Management System =====")
-        print("1. Add a new product")
-        print("2. Modify existing product")
-        print("3. Delete existing product")
-        print("4. List products in alphabetical order")
-        print("5. List products by price")
-        print("6. Find product by partial name")
-        print("7. Exit and save")
-        print("======================================")
-
-    def get_menu_choice(self) -> int:
-        """Get the user's menu choice."""
-        while True:
-            try:
-                choice = int(input("Enter your choice (1-7): "))
-                if 1 <= choice <= 7:
-                    return choice
-                else:
-                    print("Invalid choice. Please enter a number between 1 and 7.")
-            except ValueError:
-                print("Please enter a valid number.")
+    def stats(self) -> Optional[QueryStats]:
+        """
+        Return per-statement database timings, slowest in total first.
 
-    def confirm_action(self, action: str) -> bool:
-        """Confirm an action with the user."""
-        while True:
-            response = input(f"Do you want to {action}? (y/n): ").lower()
-            if response in ('y', 'yes'):
-                return True
-            elif response in ('n', 'no'):
-                return False
-            else:
-                print("Please enter 'y' or 'n'.")
+        Returns:
+            Optional[QueryStats]: Counters, or None unless the warehouse was
+            opened with a QueryInstrumentation
+        """
+        return self.db.stats()
 
-    def add_product(self):
-        """Add a new product."""
-        print("\n--- Add New Product ---")
-        while True:
-            name = input("Enter product name: ").strip()
-            if not name:
-                print("Name cannot be empty.")
-                continue
-            
-            product = self.warehouse.get_product_by_name(name)
-            if product:
-                print(f"A product with name '{name}' already exists.")
-                continue
-                
-            break
-            
-        while True:
-            try:
-                price = float(input("Enter price in euros: "))
-                if price < 0:
-                    print("Price cannot be negative.")
-                    continue
-                break
-            except ValueError:
-                print("Please enter a valid number.")
-        
-        while True:
-            try:
-                amount = int(input("Enter amount: "))
-                if amount < 0:
-                    print("Amount cannot be negative.")
-                    continue
-                break
-            except ValueError:
-                print("Please enter a valid integer.")
-        
-        if self.warehouse.add_product(name, price, amount):
-            print(f"Product '{name}' added successfully.")
-        else:
-            print("Failed to add product. Please try again.")
+    def cache_stats(self) -> CacheStats:
+        """Return hit, miss and eviction counters of the product lookup cache."""
+        return self.cache.stats()
 
-    def modify_product(self):
-        """Modify an existing product."""
-        print("\n--- Modify Existing Product ---")
-        name = input("Enter the name of the product to modify: ").strip()
-        
-        product = self.warehouse.get_product_by_name(name)
-        if not product:
-            print(f"No product found with name '{name}'.")
-            return
-        
-        print(f"Product found: {product[0]}, Price: €{product[1]:.2f}, Amount: {product[2]}")
-                
-        while True:
-            try:
-                price = float(input(f"Enter new price (current: €{product[1]:.2f}): "))
-                if price < 0:
-                    print("Price cannot be negative.")
-                    continue
-                break
-            except ValueError:
-                print("Please enter a valid number.")
-        
-        while True:
-            try:
-                amount = int(input(f"Enter new amount (current: {product[2]}): "))
-                if amount < 0:
-                    print("Amount cannot be negative.")
-                    continue
-                break
-            except ValueError:
-                print("Please enter a valid integer.")
+    def find_products_by_partial_name(self, partial_name: str) -> List[Tuple[str, Money, int]]:
+        """Find products by partial name (case insensitive)."""
+        return money_rows(self.db.find_products_by_partial_name(partial_name))
 
-        if not self.confirm_action("modify this product"):
-            print("Operation cancelled.")
-            return
+    def find_products_ranked(self, partial_name: str,
+                             limit: Optional[int] = None) -> List[Tuple[str, Money, int]]:
+        """Find products by partial name, best matches first."""
+        return money_rows(self.db.find_products_ranked(partial_name, limit))
 
-        if self.warehouse.update_product(name, price, amount):
-            print(f"Product '{name}' updated successfully.")
-        else:
-            print(f"Failed to update product '{name}'.")
+    def iter_products(self, order_by: str = ORDER_BY_NAME, page_size: int = DEFAULT_PAGE_SIZE,
+                      after: Union[str, Tuple[int, int], None] = None
+                      ) -> Iterator[Tuple[str, Money, int]]:
+        """
+        Stream all products in order, with prices as Money.
 
-    def delete_product(self):
-        """Delete an existing product."""
-        print("\n--- Delete Existing Product ---")
-        name = input("Enter the name of the product to delete: ").strip()
-        
-        product = self.warehouse.get_product_by_name(name)
-        if not product:
-            print(f"No product found with name '{name}'.")
-            return
-        
-        print(f"Product found: {product[0]}, Price: €{product[1]:.2f}, Amount: {product[2]}")
-        
-        if not self.confirm_action("delete this product"):
-            print("Operation cancelled.")
+        Args:
+            order_by: ORDER_BY_NAME or ORDER_BY_PRICE
+            page_size: Number of rows fetched per database query
+            after: Resume after this key: a name when ordering by name, or a
+                (price_cents, id) pair when ordering by price
+
+        Yields:
+            Tuple[str, Money, int]: (name, price, amount) rows
+        """
+        if self.mirror is not None and after is None and order_by in (ORDER_BY_NAME,
+                                                                      ORDER_BY_PRICE):
+            yield from self.mirror.listing(order_by)
             return
-        
-        if self.warehouse.delete_product(name):
-            print(f"Product '{name}' deleted successfully.")
-        else:
-            print(f"Failed to delete product '{name}'.")
+        of = Money.of
+        for name, price_cents, amount in self.db.iter_products(order_by, page_size, after):
+            yield name, of(price_cents), amount
+
+    def get_all_products_by_name(self, location: Optional[str] = None
+                                 ) -> List[Tuple[str, Money, int]]:
+        """Get all products ordered by name, or those held at location with the amount there."""
+        if self.mirror is not None and location is None:
+            return self.mirror.listing(ORDER_BY_NAME)
+        return money_rows(self.db.get_all_products_by_name(location))
+
+    def get_all_products_by_price(self, location: Optional[str] = None
+                                  ) -> List[Tuple[str, Money, int]]:
+        """Get all products ordered by price, or those held at location with the amount there."""
+        if self.mirror is not None and location is None:
+            return self.mirror.listing(ORDER_BY_PRICE)
+        return money_rows(self.db.get_all_products_by_price(location))
+
+    def get_products_in_price_range(self, min_euros: MoneyLike,
+                                    max_euros: MoneyLike) -> List[Tuple[str, Money, int]]:
+        """Get products priced between min_euros and max_euros inclusive, cheapest first."""
+        min_cents, max_cents = Money.parse(min_euros).cents, Money.parse(max_euros).cents
+        if self.mirror is not None:
+            return self.mirror.price_range(min_cents, max_cents)
+        return money_rows(self.db.get_products_in_price_range(min_cents, max_cents))
+
+    @staticmethod
+    def _query_filters(price_min: Optional[MoneyLike], price_max: Optional[MoneyLike],
+                       amount_min: Optional[int], name_prefix: Optional[str],
+                       order_by: str, limit: Optional[int]) -> Dict[str, Any]:
+        """Convert query() filters in euros to the database layer's cents."""
+        return dict(price_min=None if price_min is None else Money.parse(price_min).cents,
+                    price_max=None if price_max is None else Money.parse(price_max).cents,
+                    amount_min=amount_min, name_prefix=name_prefix,
+                    order_by=order_by, limit=limit)
+
+    def query(self, price_min: Optional[MoneyLike] = None,
+              price_max: Optional[MoneyLike] = None,
+              amount_min: Optional[int] = None, name_prefix: Optional[str] = None,
+              order_by: str = ORDER_BY_NAME, limit: Optional[int] = None
+              ) -> Iterator[Tuple[str, Money, int]]:
+        """
+        Stream products matching all of the given filters, with prices as Money.
+
+        Args:
+            price_min: Lowest price in euros
+            price_max: Highest price in euros
+            amount_min: Lowest amount in stock
+            name_prefix: Case-sensitive start of the name
+            order_by: ORDER_BY_NAME or ORDER_BY_PRICE
+            limit: Maximum number of rows
+
+        Yields:
+            Tuple[str, Money, int]: (name, price, amount) rows
+        """
+        filters = self._query_filters(price_min, price_max, amount_min, name_prefix,
+                                      order_by, limit)
+        of = Money.of
+        for name, price_cents, amount in self.db.query(**filters):
+            yield name, of(price_cents), amount
+
+    def explain(self, price_min: Optional[MoneyLike] = None,
+                price_max: Optional[MoneyLike] = None,
+                amount_min: Optional[int] = None, name_prefix: Optional[str] = None,
+                order_by: str = ORDER_BY_NAME, limit: Optional[int] = None) -> List[str]:
+        """Show the query plan steps SQLite would use for the same query() call."""
+        return self.db.explain(**self._query_filters(price_min, price_max, amount_min,
+                                                     name_prefix, order_by, limit))
+
+    def count_products(self) -> int:
+        """Get the number of products in the warehouse."""
+        if self.mirror is not None:
+            return len(self.mirror)
+        return self.db.inventory_summary().products
+
+
+# async_warehouse.py - Asynchronous Facade
+
+# Default number of threads running database calls for an AsyncWarehouse
+DEFAULT_ASYNC_WORKERS = 8
+
+
+class AsyncWarehouse:
+    """
+    Asyncio facade over a pooled Warehouse.
+
+    Every call is run on a dedicated, fixed-size thread pool, so the event
+    loop never blocks on SQLite and any number of concurrent awaiting callers
+    share the same few threads and their pooled read connections.
+    """
+
+    def __init__(self, db_name: str = "warehouse.db",
+                 profile: PerformanceProfile = PERFORMANCE_PROFILE,
+                 max_workers: int = DEFAULT_ASYNC_WORKERS,
+                 cache_size: int = DEFAULT_CACHE_SIZE,
+                 cache_ttl: Optional[float] = None):
+        """
+        Open the warehouse in pooled mode and start the worker threads.
+
+        Args:
+            db_name: Path of the SQLite database file
+            profile: Connection tuning, WAL by default so readers never block
+            max_workers: Number of threads running database calls
+            cache_size: Products kept by the get_product_by_name cache
+            cache_ttl: Seconds a cached product stays valid, or None for no expiry
+        """
+        if max_workers <= 0:
+            raise ValueError("max_workers must be positive")
+        self.warehouse = Warehouse(db_name, profile, pooled=True,
+                                   cache_size=cache_size, cache_ttl=cache_ttl)
+        import asyncio
+        from concurrent.futures import ThreadPoolExecutor
+        self._get_running_loop = asyncio.get_running_loop
+        self._executor = ThreadPoolExecutor(max_workers=max_workers,
+                                            thread_name_prefix="warehouse")
+
+    async def __aenter__(self) -> "AsyncWarehouse":
+        return self
 
-    def list_products_by_name(self):
-        """List all products in alphabetical order."""
-        print("\n--- Products in Alphabetical Order ---")
-        products = self.warehouse.get_all_products_by_name()
-        self._display_products(products)
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.close()
 
-    def list_products_by_price(self):
-        """List all products by price."""
-        print("\n--- Products by Price ---")
-        products = self.warehouse.get_all_products_by_price()
-        self._display_products(products)
+    async def _run(self, func: Callable, *args) -> Any:
+        """Run a blocking warehouse call on the worker threads."""
+        loop = self._get_running_loop()
+        return await loop.run_in_executor(self._executor, functools.partial(func, *args))
 
-    def find_products(self):
+    async def close(self):
+        """Close the database and stop the worker threads."""
+        await self._run(self.warehouse.close)
+        self._executor.shutdown(wait=True)
+
+    async def add_product(self, name: str, price_euros: MoneyLike, amount: int) -> bool:
+        """Add a new product, see Warehouse.add_product."""
+        return await self._run(self.warehouse.add_product, name, price_euros, amount)
+
+    async def update_product(self, name: str, price_euros: MoneyLike, amount: int) -> bool:
+        """Update an existing product, see Warehouse.update_product."""
+        return await self._run(self.warehouse.update_product, name, price_euros, amount)
+
+    async def import_products(self, products: Iterable[Tuple[str, Money, int]],
+                              batch_size: int = DEFAULT_BATCH_SIZE) -> List[BatchResult]:
+        """Import or update many products, see Warehouse.import_products."""
+        return await self._run(self.warehouse.import_products, products, batch_size)
+
+    async def adjust_stock(self, name: str, delta: int, location: Optional[str] = None) -> bool:
+        """Atomically change a product's stock, see Warehouse.adjust_stock."""
+        return await self._run(self.warehouse.adjust_stock, name, delta, location)
+
+    async def transfer_stock(self, name: str, source: str, destination: str,
+                             quantity: int) -> bool:
+        """Move units between locations, see Warehouse.transfer_stock."""
+        return await self._run(self.warehouse.transfer_stock, name, source, destination,
+                               quantity)
+
+    async def record_movements(self, movements: Iterable[Tuple[str, int]],
+                               batch_size: int = DEFAULT_BATCH_SIZE
+                               ) -> List[MovementBatchResult]:
+        """Apply stock movements in batches, see Warehouse.record_movements."""
+        return await self._run(self.warehouse.record_movements, movements, batch_size)
+
+    async def delete_product(self, name: str) -> bool:
+        """Delete a product by name."""
+        return await self._run(self.warehouse.delete_product, name)
+
+    async def get_product_by_name(self, name: str, location: Optional[str] = None
+                                  ) -> Optional[Tuple[str, Money, int]]:
+        """Get a product by its exact name, with the amount held at location if given."""
+        return await self._run(self.warehouse.get_product_by_name, name, location)
+
+    async def find_products_by_partial_name(self, partial_name: str
+                                            ) -> List[Tuple[str, Money, int]]:
         """Find products by partial name."""
-        print("\n--- Find Products ---")
-        partial_name = input("Enter part of the product name: ").strip()
-        
-        products = self.warehouse.find_products_by_partial_name(partial_name)
-        if products:
-            print(f"\nFound {len(products)} product(s) matching '{partial_name}':")
-            self._display_products(products)
-        else:
-            print(f"No products found matching '{partial_name}'.")
+        return await self._run(self.warehouse.find_products_by_partial_name, partial_name)
 
-    def _display_products(self, products: List[Tuple[str, float, int]]):
-        """Display a list of products."""
-        if not products:
-            print("No products found.")
-            return
-        
-        print(f"\n{'Name':<30} {'Price':>10} {'Amount':>10}")
-        print("-" * 50)
-        for name, price, amount in products:
-            print(f"{name:<30} €{price:>9.2f} {amount:>10}")
-        print(f"\nTotal: {len(products)} products")
+    async def find_products_ranked(self, partial_name: str, limit: Optional[int] = None
+                                   ) -> List[Tuple[str, Money, int]]:
+        """Find products by partial name, best matches first."""
+        return await self._run(self.warehouse.find_products_ranked, partial_name, limit)
+
+    async def get_all_products_by_name(self, location: Optional[str] = None
+                                       ) -> List[Tuple[str, Money, int]]:
+        """Get all products ordered by name, see Warehouse.get_all_products_by_name."""
+        return await self._run(self.warehouse.get_all_products_by_name, location)
+
+    async def get_all_products_by_price(self, location: Optional[str] = None
+                                        ) -> List[Tuple[str, Money, int]]:
+        """Get all products ordered by price, see Warehouse.get_all_products_by_price."""
+        return await self._run(self.warehouse.get_all_products_by_price, location)
+
+    async def iter_products(self, order_by: str = ORDER_BY_NAME,
+                            page_size: int = DEFAULT_PAGE_SIZE,
+                            after: Union[str, Tuple[int, int], None] = None
+                            ) -> AsyncIterator[Tuple[str, Money, int]]:
+        """
+        Stream all products in order, one page per worker-thread round trip.
+
+        Args:
+            order_by: ORDER_BY_NAME or ORDER_BY_PRICE
+            page_size: Number of rows fetched per round trip
+            after: Resume key, see Warehouse.iter_products
+
+        Yields:
+            Tuple[str, Money, int]: (name, price, amount) rows
+        """
+        rows = self.warehouse.iter_products(order_by, page_size, after)
+
+        def next_page() -> List[Tuple[str, Money, int]]:
+            return list(islice(rows, page_size))
 
-    def run(self):
-        """Run the UI."""
         while True:
-            self.display_menu()
-            choice = self.get_menu_choice()
-            
-            if choice == 1:
-                self.add_product()
-            elif choice == 2:
-                self.modify_product()
-            elif choice == 3:
-                self.delete_product()
-            elif choice == 4:
-                self.list_products_by_name()
-            elif choice == 5:
-                self.list_products_by_price()
-            elif choice == 6:
-                self.find_products()
-            elif choice == 7:
-                print("Exiting and saving database...")
-                break
+            page = await self._run(next_page)
+            for row in page:
+                yield row
+            if len(page) < page_size:
+                return
+
+    def cache_stats(self) -> CacheStats:
+        """Return hit, miss and eviction counters of the product lookup cache."""
+        return self.warehouse.cache_stats()
 
 
 # main.py - Main Application
-def main():
-    """Main entry point for the warehouse application."""
+
+# Operations a --batch file may contain, with the arguments each one takes
+BATCH_OPERATIONS = {
+    "add": (str, Money.parse, int),
+    "update": (str, Money.parse, int),
+    "delete": (str,),
+}
+
+
+def build_parser():
+    """Build the command line parser; argparse is only loaded when it is needed."""
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description="Manage the warehouse. Run without arguments for the interactive menu.")
+    parser.add_argument("--db", default="warehouse.db",
+                        help="database file (default: warehouse.db)")
+    parser.add_argument("--batch", metavar="FILE",
+                        help="apply the add/update/delete operations in FILE, one per line "
+                             "with the same arguments as the subcommands, in one transaction")
+    parser.add_argument("--slow-query-ms", type=float, metavar="MS",
+                        help="log statements taking at least MS milliseconds to stderr as JSON")
+    commands = parser.add_subparsers(dest="command", metavar="command")
+
+    for command, action in (("add", "add a new product"),
+                            ("update", "change the price and amount of a product")):
+        subparser = commands.add_parser(command, help=action)
+        subparser.add_argument("name")
+        subparser.add_argument("price", type=Money.parse, help="price in euros")
+        subparser.add_argument("amount", type=int)
+    commands.add_parser("delete", help="delete a product").add_argument("name")
+
+    listing = commands.add_parser("list", help="list all products")
+    listing.add_argument("--by", choices=(ORDER_BY_NAME, ORDER_BY_PRICE), default=ORDER_BY_NAME,
+                         help="sort order (default: name)")
+    commands.add_parser("find", help="find products by partial name").add_argument("text")
+
+    formats = (FORMAT_CSV, FORMAT_JSONL, FORMAT_COLUMNAR)
+    for command, action in (("import", "insert or update products from a file"),
+                            ("export", "write all products to a file")):
+        subparser = commands.add_parser(command, help=action)
+        subparser.add_argument("path")
+        subparser.add_argument("--format", choices=formats,
+                               help="file format (default: from the file extension)")
+
+    commands.add_parser("stats", help="show inventory totals")
+    return parser
+
+
+def read_batch(path: str) -> List[Tuple[int, str, tuple]]:
+    """
+    Parse a batch file into (line number, operation, arguments) entries.
+
+    Blank lines and # comments are skipped; names with spaces can be quoted.
+
+    Raises:
+        ValueError: If a line is not a valid operation; nothing is applied then
+    """
+    import shlex
+
+    operations = []
+    with open(path, encoding="utf-8") as f:
+        for line_number, line in enumerate(f, start=1):
+            tokens = shlex.split(line, comments=True)
+            if not tokens:
+                continue
+            operation, args = tokens[0], tokens[1:]
+            parsers = BATCH_OPERATIONS.get(operation)
+            if parsers is None:
+                raise ValueError(f"{path}:{line_number}: unknown operation '{operation}'")
+            if len(args) != len(parsers):
+                raise ValueError(f"{path}:{line_number}: {operation} takes "
+                                 f"{len(parsers)} argument(s), got {len(args)}")
+            try:
+                operations.append((line_number, operation,
+                                   tuple(parse(arg) for parse, arg in zip(parsers, args))))
+            except ValueError:
+                raise ValueError(f"{path}:{line_number}: invalid number in '{line.strip()}'")
+    return operations
+
+
+def run_batch(warehouse: Warehouse, path: str) -> int:
+    """Apply a batch file in one transaction; returns the process exit status."""
+    try:
+        operations = read_batch(path)
+    except (OSError, ValueError) as e:
+        print(f"Error: {e}", file=sys.stderr)
+        return 2
+
+    handlers = {"add": warehouse.add_product, "update": warehouse.update_product,
+                "delete": warehouse.delete_product}
+    try:
+        with warehouse.transaction({args[0] for _, _, args in operations}):
+            for line_number, operation, args in operations:
+                if not handlers[operation](*args):
+                    raise ValueError(f"{path}:{line_number}: {operation} '{args[0]}' failed")
+    except (ValueError, sqlite3.DatabaseError) as e:
+        print(f"Error: {e}; no changes were applied", file=sys.stderr)
+        return 1
+    print(f"Applied {len(operations)} operation(s) from {path}")
+    return 0
+
+
+def run_command(warehouse: Warehouse, args) -> int:
+    """Run one subcommand; returns the process exit status."""
+    command = args.command
+    if command in ("add", "update", "delete"):
+        if command == "delete":
+            done = warehouse.delete_product(args.name)
+        else:
+            action = warehouse.add_product if command == "add" else warehouse.update_product
+            done = action(args.name, args.price, args.amount)
+        if not done:
+            print(f"Error: could not {command} product '{args.name}'", file=sys.stderr)
+            return 1
+        print(f"Product '{args.name}' {command}{'d' if command.endswith('e') else 'ed'}.")
+    elif command in ("list", "find"):
+        if command == "list":
+            products = warehouse.iter_products(args.by)
+        else:
+            products = warehouse.find_products_by_partial_name(args.text)
+        for name, price, amount in products:
+            print(f"{name}\t{price:.2f}\t{amount}")
+    elif command == "import":
+        results = warehouse.import_file(args.path, args.format)
+        print(f"Imported {args.path}: {sum(r.inserted for r in results)} inserted, "
+              f"{sum(r.updated for r in results)} updated, "
+              f"{sum(r.rejected for r in results)} rejected")
+    elif command == "export":
+        print(f"Exported {warehouse.export_products(args.path, args.format)} products "
+              f"to {args.path}")
+    elif command == "stats":
+        summary = warehouse.inventory_summary()
+        print(f"Products:    {summary.products}")
+        print(f"Units:       {summary.units}")
+        print(f"Total value: {summary.total_value:.2f}")
+        if summary.products:
+            print(f"Prices:      {summary.min_price:.2f} - {summary.max_price:.2f}")
+    return 0
+
+
+def run_interactive(db_name: str = "warehouse.db",
+                    instrumentation: Optional[QueryInstrumentation] = None):
+    """Run the interactive menu until the user exits."""
+    warehouse = None
     try:
-        warehouse = Warehouse()
-        ui = WarehouseUI(warehouse)
+        from warehouse_ui import WarehouseUI
+        warehouse = Warehouse(db_name, instrumentation=instrumentation)
+        ui = WarehouseUI(warehouse, Money, DEFAULT_BACKUP_FILE, ORDER_BY_PRICE)
         ui.run()
     except Exception as e:
         print(f"An unexpected error occurred: {e}")
@@ -415,5 +4242,42 @@ def main():
             pass
         print("Application terminated.")
 
+
+def main(argv: Optional[List[str]] = None) -> int:
+    """
+    Main entry point for the warehouse application.
+
+    With a subcommand or --batch the warehouse is driven non-interactively;
+    otherwise the interactive menu runs.
+
+    Returns:
+        int: Exit status; 0 on success, 1 if an operation failed, 2 for bad input
+    """
+    args = build_parser().parse_args(sys.argv[1:] if argv is None else argv)
+    instrumentation = None
+    if args.slow_query_ms is not None:
+        import logging
+        logging.basicConfig(level=logging.WARNING, format="%(message)s")
+        instrumentation = QueryInstrumentation(args.slow_query_ms)
+    if args.command is None and args.batch is None:
+        run_interactive(args.db, instrumentation)
+        return 0
+
+    try:
+        warehouse = Warehouse(args.db, instrumentation=instrumentation)
+    except Exception as e:
+        print(f"Error: cannot open {args.db}: {e}", file=sys.stderr)
+        return 1
+    try:
+        status = run_batch(warehouse, args.batch) if args.batch else 0
+        if status == 0 and args.command:
+            status = run_command(warehouse, args)
+        return status
+    except (OSError, ValueError) as e:
+        print(f"Error: {e}", file=sys.stderr)
+        return 1
+    finally:
+        warehouse.close()
+
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    sys.exit(main())
@@ -0,0 +1,267 @@
+#!/usr/bin/env python3
+"""
+Warehouse Interactive Menu
+
+The text menu run by warehouse_db.py when it is started without a
+subcommand. It lives in its own module so the command line interface only
+loads it when the menu is actually used. It does not import warehouse_db:
+the caller hands it the warehouse and the few names the menu needs.
+"""
+
+from typing import TYPE_CHECKING, Iterable, Tuple, Type
+
+if TYPE_CHECKING:
+    from warehouse_db import Money, Warehouse
+
+
+class WarehouseUI:
+    def __init__(self, warehouse: "Warehouse", money: Type["Money"], backup_file: str,
+                 order_by_price: str):
+        """
+        Initialize the menu.
+
+        Args:
+            warehouse: The warehouse the menu works on
+            money: Type that parses the prices typed in
+            backup_file: Backup file offered when none is typed
+            order_by_price: Sort key of the price listing
+        """
+        self.warehouse = warehouse
+        self.money = money
+        self.backup_file = backup_file
+        self.order_by_price = order_by_price
+
+    def display_menu(self):
+        """Display the main menu."""
+        print("\n===== Warehouse Management System =====")
+        print("1. Add a new product")
+        print("2. Modify existing product")
+        print("3. Delete existing product")
+        print("4. List products in alphabetical order")
+        print("5. List products by price")
+        print("6. Find product by partial name")
+        print("7. Back up database")
+        print("8. Restore database from backup")
+        print("9. Exit and save")
+        print("======================================")
+
+    def get_menu_choice(self) -> int:
+        """Get the user's menu choice."""
+        while True:
+            try:
+                choice = int(input("Enter your choice (1-9): "))
+                if 1 <= choice <= 9:
+                    return choice
+                else:
+                    print("Invalid choice. Please enter a number between 1 and 9.")
+            except ValueError:
+                print("Please enter a valid number.")
+
+    def confirm_action(self, action: str) -> bool:
+        """Confirm an action with the user."""
+        while True:
+            response = input(f"Do you want to {action}? (y/n): ").lower()
+            if response in ('y', 'yes'):
+                return True
+            elif response in ('n', 'no'):
+                return False
+            else:
+                print("Please enter 'y' or 'n'.")
+
+    def add_product(self):
+        """Add a new product."""
+        print("\n--- Add New Product ---")
+        while True:
+            name = input("Enter product name: ").strip()
+            if not name:
+                print("Name cannot be empty.")
+                continue
+            
+            product = self.warehouse.get_product_by_name(name)
+            if product:
+                print(f"A product with name '{name}' already exists.")
+                continue
+                
+            break
+            
+        while True:
+            try:
+                price = self.money.parse(input("Enter price in euros: "))
+                if price < 0:
+                    print("Price cannot be negative.")
+                    continue
+                break
+            except ValueError:
+                print("Please enter a valid number.")
+        
+        while True:
+            try:
+                amount = int(input("Enter amount: "))
+                if amount < 0:
+                    print("Amount cannot be negative.")
+                    continue
+                break
+            except ValueError:
+                print("Please enter a valid integer.")
+        
+        if self.warehouse.add_product(name, price, amount):
+            print(f"Product '{name}' added successfully.")
+        else:
+            print("Failed to add product. Please try again.")
+
+    def modify_product(self):
+        """Modify an existing product."""
+        print("\n--- Modify Existing Product ---")
+        name = input("Enter the name of the product to modify: ").strip()
+        
+        product = self.warehouse.get_product_by_name(name)
+        if not product:
+            print(f"No product found with name '{name}'.")
+            return
+        
+        print(f"Product found: {product[0]}, Price: €{product[1]:.2f}, Amount: {product[2]}")
+                
+        while True:
+            try:
+                price = self.money.parse(input(f"Enter new price (current: €{product[1]:.2f}): "))
+                if price < 0:
+                    print("Price cannot be negative.")
+                    continue
+                break
+            except ValueError:
+                print("Please enter a valid number.")
+        
+        while True:
+            try:
+                amount = int(input(f"Enter new amount (current: {product[2]}): "))
+                if amount < 0:
+                    print("Amount cannot be negative.")
+                    continue
+                break
+            except ValueError:
+                print("Please enter a valid integer.")
+
+        if not self.confirm_action("modify this product"):
+            print("Operation cancelled.")
+            return
+
+        if self.warehouse.update_product(name, price, amount):
+            print(f"Product '{name}' updated successfully.")
+        else:
+            print(f"Failed to update product '{name}'.")
+
+    def delete_product(self):
+        """Delete an existing product."""
+        print("\n--- Delete Existing Product ---")
+        name = input("Enter the name of the product to delete: ").strip()
+        
+        product = self.warehouse.get_product_by_name(name)
+        if not product:
+            print(f"No product found with name '{name}'.")
+            return
+        
+        print(f"Product found: {product[0]}, Price: €{product[1]:.2f}, Amount: {product[2]}")
+        
+        if not self.confirm_action("delete this product"):
+            print("Operation cancelled.")
+            return
+        
+        if self.warehouse.delete_product(name):
+            print(f"Product '{name}' deleted successfully.")
+        else:
+            print(f"Failed to delete product '{name}'.")
+
+    def list_products_by_name(self):
+        """List all products in alphabetical order."""
+        print("\n--- Products in Alphabetical Order ---")
+        self._display_products(self.warehouse.iter_products())
+
+    def list_products_by_price(self):
+        """List all products by price."""
+        print("\n--- Products by Price ---")
+        self._display_products(self.warehouse.iter_products(self.order_by_price))
+
+    def find_products(self):
+        """Find products by partial name."""
+        print("\n--- Find Products ---")
+        partial_name = input("Enter part of the product name: ").strip()
+        
+        products = self.warehouse.find_products_by_partial_name(partial_name)
+        if products:
+            print(f"\nFound {len(products)} product(s) matching '{partial_name}':")
+            self._display_products(products)
+        else:
+            print(f"No products found matching '{partial_name}'.")
+
+    def backup_database(self):
+        """Back up the database while the warehouse stays usable."""
+        print("\n--- Back Up Database ---")
+        path = input(f"Enter backup file name (default: {self.backup_file}): ").strip()
+        path = path or self.backup_file
+
+        def show_progress(copied: int, total: int):
+            print(f"\rCopied {copied}/{total} pages", end="", flush=True)
+
+        result = self.warehouse.backup(path, progress=show_progress)
+        print()
+        if result:
+            print(f"Backed up {result.bytes / 1e6:.2f} MB to '{path}' in {result.seconds:.2f} s "
+                  f"({result.bytes_per_second / 1e6:.1f} MB/s).")
+        else:
+            print("Backup failed.")
+
+    def restore_database(self):
+        """Replace the database contents with a backup."""
+        print("\n--- Restore Database ---")
+        path = input(f"Enter backup file name (default: {self.backup_file}): ").strip()
+        path = path or self.backup_file
+
+        if not self.confirm_action(f"replace all products with the backup '{path}'"):
+            print("Operation cancelled.")
+            return
+
+        if self.warehouse.restore(path):
+            print(f"Database restored from '{path}'.")
+        else:
+            print("Restore failed. The database was not changed.")
+
+    def _display_products(self, products: Iterable[Tuple[str, "Money", int]]):
+        """Display products as they are produced, without collecting them first."""
+        count = 0
+        for name, price, amount in products:
+            if count == 0:
+                print(f"\n{'Name':<30} {'Price':>10} {'Amount':>10}")
+                print("-" * 50)
+            print(f"{name:<30} €{price:>9.2f} {amount:>10}")
+            count += 1
+
+        if count == 0:
+            print("No products found.")
+            return
+        print(f"\nTotal: {count} products")
+
+    def run(self):
+        """Run the UI."""
+        while True:
+            self.display_menu()
+            choice = self.get_menu_choice()
+            
+            if choice == 1:
+                self.add_product()
+            elif choice == 2:
+                self.modify_product()
+            elif choice == 3:
+                self.delete_product()
+            elif choice == 4:
+                self.list_products_by_name()
+            elif choice == 5:
+                self.list_products_by_price()
+            elif choice == 6:
+                self.find_products()
+            elif choice == 7:
+                self.backup_database()
+            elif choice == 8:
+                self.restore_database()
+            elif choice == 9:
+                print("Exiting and saving database...")
+                break